@@ -20,7 +20,11 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/2.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-from .secret_settings import *
+try:
+    from .secret_settings import *
+except ImportError:
+    # Django refuses to start without a SECRET_KEY; cachelabweb.test_settings supplies one for tests.
+    pass
 
 # SECURITY WARNING: don't run with debug turned on in production!
 #DEBUG = True
@@ -78,13 +82,65 @@ WSGI_APPLICATION = 'cachelabweb.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
-DATABASES = {
+# Set CACHELAB_DATABASE=postgresql (and CACHELAB_DATABASE_NAME, _USER, _PASSWORD, _HOST, _PORT as needed)
+# to use PostgreSQL instead of SQLite; this requires psycopg2.
+if os.getenv('CACHELAB_DATABASE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('CACHELAB_DATABASE_NAME', 'cachelab'),
+            'USER': os.getenv('CACHELAB_DATABASE_USER', ''),
+            'PASSWORD': os.getenv('CACHELAB_DATABASE_PASSWORD', ''),
+            'HOST': os.getenv('CACHELAB_DATABASE_HOST', ''),
+            'PORT': os.getenv('CACHELAB_DATABASE_PORT', ''),
+            'CONN_MAX_AGE': 600,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'cachelabweb.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'CONN_MAX_AGE': 600,
+            'OPTIONS': {
+                # seconds to wait for another process's write lock
+                'timeout': 20,
+            },
+            'PRAGMAS': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 20000,
+                # in KiB when negative
+                'cache_size': -64 * 1024,
+                'mmap_size': 256 * 1024 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        }
+    }
+
+# A cache shared by all of the uWSGI processes on this machine. Sessions are read from it and only
+# written through to the database when they change, and logged in users are read from it.
+# Outside the checkout by default, next to the ../backups directory used by config-templates/backup-db.sh.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHELAB_CACHE_DIR', os.path.join(os.path.dirname(BASE_DIR), 'cache')),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# ModelBackend stays listed so that sessions logged in before CachedModelBackend was added
+# (which record ModelBackend as their backend) stay logged in.
+AUTHENTICATION_BACKENDS = [
+    'quiz.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -0,0 +1,42 @@
+"""
+SQLite backend tuned for several uWSGI processes sharing one database file.
+
+Set 'ENGINE': 'cachelabweb.sqlite3' and list pragmas to run on each new connection under 'PRAGMAS'.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+_PRAGMA_NAME_RE = re.compile(r'^[a-z_]+$')
+_PRAGMA_VALUE_RE = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+def pragma_statements(pragmas):
+    """
+    Returns the PRAGMA statements for a {name: value} dict, raising ImproperlyConfigured for
+    anything that is not a plain name with an integer or keyword value.
+    """
+    statements = []
+    for name, value in pragmas.items():
+        if not _PRAGMA_NAME_RE.match(name) or not _PRAGMA_VALUE_RE.match(str(value)):
+            raise ImproperlyConfigured('invalid SQLite pragma {!r} = {!r}'.format(name, value))
+        statements.append('PRAGMA {} = {}'.format(name, value))
+    return statements
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # set by quiz.models.write_transaction for the transaction it starts
+    begin_immediate = False
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for statement in pragma_statements(self.settings_dict.get('PRAGMAS', {})):
+            conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.begin_immediate:
+            # Take the write lock when the transaction starts, so it waits for busy_timeout
+            # instead of failing with "database is locked" when upgrading a read lock later.
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,15 @@
+"""
+Settings for running the test suite: python manage.py test --settings=cachelabweb.test_settings
+"""
+from .settings import *
+
+# tests must not read or evict entries of the real cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# checkouts without a secret_settings.py can still run the tests
+if not globals().get('SECRET_KEY'):
+    SECRET_KEY = 'cachelab-tests-only'
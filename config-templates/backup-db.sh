@@ -1,2 +1,5 @@
 pushd cachelabweb
-sqlite3 db.sqlite3 '.dump' >../backup.`date +%Y%m%dT%H%M%S`.sql
+# safe to run every few minutes, even while students are submitting;
+# restore with: manage.py backup_database --directory ../backups --restore PATH [--time YYYYMMDDTHHMMSS, in UTC]
+../bin/python manage.py backup_database --directory ../backups --full-every 24 --keep-full 7
+popd
@@ -8,7 +8,7 @@ python3 -m venv .
 git clone -b $CACHELABWEB_BRANCH $CACHELABWEB_GIT cachelabweb
 cp $SECRET_SETTINGS cachelabweb/cachelabweb/secret_settings.py
 source bin/activate
-pip install django uwsgi
+pip install django uwsgi numpy
 pushd cachelabweb
 python3 manage.py migrate
 popd
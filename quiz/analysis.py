@@ -0,0 +1,320 @@
+"""
+Tools for analyzing long address traces with the quiz's cache model.
+
+Unlike the rest of the quiz app, these require numpy.
+"""
+import concurrent.futures
+import logging
+import os
+import re
+
+import django
+import numpy
+
+from .models import CacheParameters, CacheState, CacheTraceResult, value_from_hex
+
+logger = logging.getLogger('cachelabweb')
+
+def read_trace(lines):
+    """
+    Read a trace with one access per line, either "ADDRESS" or "R ADDRESS"/"W ADDRESS",
+    with addresses in hexadecimal. Blank lines and lines starting with # are ignored.
+
+    Returns (addresses, writes) as numpy arrays.
+    """
+    addresses = []
+    writes = []
+    for line_number, line in enumerate(lines):
+        parts = line.split()
+        if len(parts) == 0 or parts[0].startswith('#'):
+            continue
+        if len(parts) == 1:
+            kind, address_string = 'R', parts[0]
+        else:
+            kind, address_string = parts[0].upper(), parts[1]
+        address = value_from_hex(address_string)
+        if address == None or kind not in ('R', 'W'):
+            raise ValueError('could not parse trace line {}: {!r}'.format(line_number + 1, line))
+        addresses.append(address)
+        writes.append(kind == 'W')
+    return (numpy.array(addresses, dtype=numpy.uint64), numpy.array(writes, dtype=bool))
+
+def _group_positions(keys):
+    # positions of the trace with each distinct key, each in trace order
+    order = numpy.argsort(keys, kind='stable')
+    boundaries = numpy.flatnonzero(numpy.diff(keys[order])) + 1
+    return [positions for positions in numpy.split(order, boundaries) if len(positions) > 0]
+
+def _set_stack_distances(blocks, distances, positions):
+    # Mattson stack distances for the accesses to one set. A Fenwick tree over
+    # access times marks the most recent access to each block, so the distance
+    # of a reuse is the number of marks after the block's previous access.
+    size = len(blocks)
+    tree = [0] * (size + 1)
+    last_time = {}
+    for time, block in enumerate(blocks):
+        previous = last_time.get(block)
+        if previous != None:
+            # marks in times [0, previous]
+            i = previous + 1
+            before = 0
+            while i > 0:
+                before += tree[i]
+                i -= i & -i
+            distances[positions[time]] = len(last_time) - before
+            i = previous + 1
+            while i <= size:
+                tree[i] -= 1
+                i += i & -i
+        i = time + 1
+        while i <= size:
+            tree[i] += 1
+            i += i & -i
+        last_time[block] = time
+    return len(last_time)
+
+class StackDistanceResult():
+    """
+    LRU stack distances of each access in a trace for a fixed number of sets and block size.
+
+    distances[i] is the number of distinct other blocks in the same set accessed since the
+    last access to the block of access i, or -1 for the first access to that block. An
+    access hits in an LRU cache with W ways exactly when 0 <= distances[i] < W.
+
+    set_block_counts has the number of distinct blocks accessed in each set that was used.
+    """
+    def __init__(self, num_sets, block_size, address_bits, distances, set_block_counts):
+        self.num_sets = num_sets
+        self.block_size = block_size
+        self.address_bits = address_bits
+        self.distances = distances
+        self.set_block_counts = set_block_counts
+        reuses = distances[distances >= 0]
+        self._cumulative_hits = numpy.cumsum(numpy.bincount(reuses)) if len(reuses) > 0 else numpy.zeros(0, dtype=numpy.int64)
+
+    @property
+    def num_accesses(self):
+        return len(self.distances)
+
+    @property
+    def num_compulsory_misses(self):
+        return int((self.distances < 0).sum())
+
+    def hits_for_ways(self, num_ways):
+        if len(self._cumulative_hits) == 0:
+            return 0
+        return int(self._cumulative_hits[min(num_ways, len(self._cumulative_hits)) - 1])
+
+    def misses_for_ways(self, num_ways):
+        return self.num_accesses - self.hits_for_ways(num_ways)
+
+    def evictions_for_ways(self, num_ways):
+        # every miss evicts something except those filling one of the num_ways
+        # initially invalid lines of a set
+        fills = int(numpy.minimum(self.set_block_counts, num_ways).sum())
+        return self.misses_for_ways(num_ways) - fills
+
+    def hit_ratio(self, num_ways):
+        if self.num_accesses == 0:
+            return 0.0
+        return self.hits_for_ways(num_ways) / self.num_accesses
+
+    def curve(self, max_ways):
+        """
+        Returns a list of (num_ways, cache_size_bytes, hits, hit_ratio) for 1 to max_ways ways.
+        """
+        result = []
+        for num_ways in range(1, max_ways + 1):
+            result.append((
+                num_ways,
+                num_ways * self.num_sets * self.block_size,
+                self.hits_for_ways(num_ways),
+                self.hit_ratio(num_ways),
+            ))
+        return result
+
+def stack_distances(addresses, num_sets, block_size, address_bits=64):
+    """
+    Compute LRU stack distances for a trace in one pass, giving the hits for every
+    associativity (and so every capacity) of a cache with num_sets sets and block_size byte blocks.
+    """
+    params = CacheParameters(num_ways=1, num_sets=num_sets, block_size=block_size, address_bits=address_bits)
+    (tags, indices, _) = params.split_addresses(addresses)
+    blocks = (tags << numpy.uint64(params.index_bits)) | indices
+    distances = numpy.full(len(blocks), -1, dtype=numpy.int64)
+    set_block_counts = []
+    for positions in _group_positions(indices):
+        set_block_counts.append(_set_stack_distances(blocks[positions].tolist(), distances, positions.tolist()))
+    return StackDistanceResult(num_sets, block_size, address_bits, distances,
+        numpy.array(set_block_counts, dtype=numpy.int64))
+
+def stack_distance_curves(addresses, set_counts, block_sizes, max_ways, address_bits=64):
+    """
+    Returns a list of (num_sets, block_size, num_ways, cache_size_bytes, hits, hit_ratio) rows
+    covering every combination of set count and block size.
+    """
+    rows = []
+    for block_size in block_sizes:
+        for num_sets in set_counts:
+            logger.debug('computing stack distances for %d sets of %d byte blocks', num_sets, block_size)
+            result = stack_distances(addresses, num_sets, block_size, address_bits=address_bits)
+            for (num_ways, cache_size_bytes, hits, hit_ratio) in result.curve(max_ways):
+                rows.append((num_sets, block_size, num_ways, cache_size_bytes, hits, hit_ratio))
+    return rows
+
+def geometries_within(
+        min_ways=1, max_ways=12, min_sets_log=0,
+        max_sets_log=24, min_block_size_log=0,
+        max_block_size_log=8,
+        max_cache_size=128 * 1024 * 1024):
+    """
+    Returns every (num_ways, num_sets, block_size) that CacheParameters.random could choose
+    with the same bounds.
+    """
+    result = []
+    for offset_bits in range(min_block_size_log, max_block_size_log + 1):
+        for index_bits in range(min_sets_log, max_sets_log + 1):
+            for num_ways in range(min_ways, max_ways + 1):
+                if num_ways << (index_bits + offset_bits) < max_cache_size:
+                    result.append((num_ways, 1 << index_bits, 1 << offset_bits))
+    return result
+
+SWEEP_COLUMNS = ['num_ways', 'num_sets', 'block_size', 'cache_size_bytes', 'accesses', 'hits', 'misses', 'evictions']
+
+def sweep(addresses, geometries, address_bits=64):
+    """
+    Simulate a trace against many (num_ways, num_sets, block_size) geometries in one pass
+    over the trace for each distinct (num_sets, block_size); all associativities for those
+    come from the same stack distances.
+
+    Returns one tuple of SWEEP_COLUMNS per geometry.
+    """
+    addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+    ways_by_shape = {}
+    for (num_ways, num_sets, block_size) in geometries:
+        ways_by_shape.setdefault((num_sets, block_size), set()).add(num_ways)
+    rows = []
+    for (num_sets, block_size), ways in sorted(ways_by_shape.items()):
+        logger.debug('sweeping %d sets of %d byte blocks for ways %s', num_sets, block_size, ways)
+        result = stack_distances(addresses, num_sets, block_size, address_bits=address_bits)
+        for num_ways in sorted(ways):
+            rows.append((
+                num_ways,
+                num_sets,
+                block_size,
+                num_ways * num_sets * block_size,
+                result.num_accesses,
+                result.hits_for_ways(num_ways),
+                result.misses_for_ways(num_ways),
+                result.evictions_for_ways(num_ways),
+            ))
+    return rows
+
+def _simulate_shard(geometry, addresses, writes):
+    (num_ways, num_sets, block_size, address_bits) = geometry
+    params = CacheParameters(num_ways=num_ways, num_sets=num_sets, block_size=block_size, address_bits=address_bits)
+    result = CacheState(params).apply_trace(addresses, writes)
+    return (result.hit, result.evicted, result.has_evicted)
+
+def simulate_sharded(params, addresses, writes=None, num_shards=None, max_workers=None):
+    """
+    Simulate a trace like CacheState(params).apply_trace, but split by set index into
+    num_shards shards that are simulated in parallel in a process pool.
+
+    Since each LRU set is independent, the merged CacheTraceResult is the same as a serial
+    simulation's. The final cache state is not returned.
+    """
+    if max_workers == None:
+        max_workers = os.cpu_count() or 1
+    if num_shards == None:
+        num_shards = max_workers
+    addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+    if writes is not None:
+        writes = numpy.asarray(writes, dtype=bool)
+    (tags, indices, offsets) = params.split_addresses(addresses)
+    geometry = (params.num_ways, params.num_sets, params.block_size, params.address_bits)
+    shards = _group_positions(indices % numpy.uint64(num_shards))
+    hit = numpy.zeros(len(addresses), dtype=bool)
+    evicted = numpy.zeros(len(addresses), dtype=numpy.uint64)
+    has_evicted = numpy.zeros(len(addresses), dtype=bool)
+    # workers started with the spawn method need Django configured before they can
+    # unpickle _simulate_shard, which imports quiz.models
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=django.setup) as executor:
+        futures = []
+        for positions in shards:
+            futures.append(executor.submit(
+                _simulate_shard,
+                geometry,
+                addresses[positions],
+                writes[positions] if writes is not None else None,
+            ))
+        for positions, future in zip(shards, futures):
+            (shard_hit, shard_evicted, shard_has_evicted) = future.result()
+            logger.debug('shard with %d accesses had %d hits', len(positions), shard_hit.sum())
+            hit[positions] = shard_hit
+            evicted[positions] = shard_evicted
+            has_evicted[positions] = shard_has_evicted
+    return CacheTraceResult(
+        hit=hit,
+        tag=tags,
+        index=indices,
+        offset=offsets,
+        evicted=evicted,
+        has_evicted=has_evicted,
+    )
+
+def checkpoint_path(directory, position):
+    return os.path.join(directory, 'checkpoint-{:016d}.snapshot'.format(position))
+
+def latest_checkpoint(directory):
+    """
+    Returns the trace position of the most recent checkpoint in directory, or None.
+    """
+    positions = []
+    for name in os.listdir(directory):
+        match = re.fullmatch(r'checkpoint-(\d+)\.snapshot', name)
+        if match:
+            positions.append(int(match.group(1)))
+    return max(positions) if len(positions) > 0 else None
+
+def apply_trace_with_checkpoints(state, addresses, writes=None, directory='.', interval=1000000, start=0):
+    """
+    Apply addresses[start:] to state like CacheState.apply_trace, writing a snapshot of the
+    state to directory after every interval accesses.
+
+    Returns a CacheTraceResult for the accesses from start on.
+    """
+    addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+    if writes is not None:
+        writes = numpy.asarray(writes, dtype=bool)
+    results = []
+    for chunk_start in range(start, len(addresses), interval):
+        chunk_end = min(chunk_start + interval, len(addresses))
+        results.append(state.apply_trace(
+            addresses[chunk_start:chunk_end],
+            writes[chunk_start:chunk_end] if writes is not None else None,
+        ))
+        path = checkpoint_path(directory, chunk_end)
+        with open(path + '.tmp', 'wb') as fh:
+            fh.write(state.to_snapshot())
+        os.replace(path + '.tmp', path)
+        logger.debug('wrote checkpoint %s', path)
+    return CacheTraceResult.concatenate(results)
+
+def resume_trace(params, addresses, writes=None, directory='.', interval=1000000):
+    """
+    Continue a run of apply_trace_with_checkpoints from the latest checkpoint in directory,
+    replaying only the accesses after it (or start from scratch if there is none).
+
+    Returns (start position, final CacheState, CacheTraceResult for the replayed accesses).
+    """
+    position = latest_checkpoint(directory)
+    if position == None:
+        position = 0
+        state = CacheState(params)
+    else:
+        with open(checkpoint_path(directory, position), 'rb') as fh:
+            state = CacheState.from_snapshot(params, fh.read())
+    result = apply_trace_with_checkpoints(state, addresses, writes,
+        directory=directory, interval=interval, start=position)
+    return (position, state, result)
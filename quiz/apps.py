@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class QuizConfig(AppConfig):
     name = 'quiz'
+
+    def ready(self):
+        from .auth import connect_signals
+        connect_signals()
@@ -0,0 +1,31 @@
+"""
+Authentication backend that keeps User rows in the cache, so that each request does not need
+to load the logged in user from the database.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_CACHE_TIMEOUT = 60 * 60
+
+def _user_cache_key(user_id):
+    return 'quiz-auth-user-{}'.format(user_id)
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = _user_cache_key(user_id)
+        user = cache.get(key)
+        if user == None:
+            user = super().get_user(user_id)
+            if user != None:
+                cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user
+
+def forget_cached_user(sender, instance, **kwargs):
+    cache.delete(_user_cache_key(instance.pk))
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    User = get_user_model()
+    post_save.connect(forget_cached_user, sender=User, dispatch_uid='quiz-forget-cached-user-save')
+    post_delete.connect(forget_cached_user, sender=User, dispatch_uid='quiz-forget-cached-user-delete')
@@ -0,0 +1,227 @@
+"""
+Online backups of the SQLite database.
+
+A backup directory holds chains of snapshots: a gzipped copy of the whole database
+(full-TIME.sqlite3.gz) followed by gzipped lists of the pages that changed since the
+previous snapshot (incremental-TIME.pages.gz). TIME is in UTC, as YYYYMMDDTHHMMSS. It also
+keeps a hash of each page of the newest snapshot (latest.hashes) to compare new snapshots against.
+"""
+import datetime
+import gzip
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import struct
+
+from django.db import connection
+
+logger = logging.getLogger('cachelabweb')
+
+_PAGES_HEADER = struct.Struct('<4sHxxIQ')
+_PAGE_NUMBER = struct.Struct('<Q')
+PAGES_MAGIC = b'CLBP'
+PAGES_VERSION = 1
+
+_HASHES_HEADER = struct.Struct('<4sHxxIQ15s')
+HASHES_MAGIC = b'CLBH'
+HASHES_VERSION = 1
+_HASH_SIZE = 16
+
+LATEST_HASHES_NAME = 'latest.hashes'
+# kept by older versions instead of LATEST_HASHES_NAME
+_OLD_LATEST_NAME = 'latest.sqlite3'
+_SNAPSHOT_RE = re.compile(r'^(full|incremental)-(\d{8}T\d{6})\.(sqlite3|pages)\.gz$')
+
+def _page_size(path):
+    with open(path, 'rb') as fh:
+        header = fh.read(18)
+    page_size = struct.unpack('>H', header[16:18])[0]
+    return 65536 if page_size == 1 else page_size
+
+class _TooManyRestarts(Exception):
+    pass
+
+def copy_database(path, pages_per_step=256, sleep=0.005, max_restarts=10):
+    """
+    Copy the default database to path with SQLite's online backup API, pages_per_step
+    pages at a time, so that other processes can write between steps. A write by another
+    process restarts the copy, so after max_restarts restarts the rest is copied in one step.
+    """
+    if connection.vendor != 'sqlite':
+        raise ValueError('online backups are only supported for SQLite; use the database\'s own tools')
+    connection.ensure_connection()
+    restarts = 0
+    last_remaining = None
+    def _progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining != None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+    target = sqlite3.connect(path)
+    try:
+        try:
+            connection.connection.backup(target, pages=pages_per_step, progress=_progress, sleep=sleep)
+        except _TooManyRestarts:
+            logger.warning('backup restarted %d times; copying the database in one step', restarts)
+            connection.connection.backup(target)
+    finally:
+        target.close()
+
+def list_snapshots(directory):
+    """
+    Returns [(time, kind, filename), ...] of the snapshots in directory, oldest first.
+    """
+    result = []
+    for name in os.listdir(directory):
+        match = _SNAPSHOT_RE.match(name)
+        if match:
+            result.append((match.group(2), match.group(1), name))
+    return sorted(result)
+
+def _hash_page(page):
+    return hashlib.blake2b(page, digest_size=_HASH_SIZE).digest()
+
+def _read_hashes(path, time):
+    # the page hashes in path, or None if it is missing or not for the snapshot from time
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fh:
+        magic, version, page_size, page_count, hashes_time = _HASHES_HEADER.unpack(fh.read(_HASHES_HEADER.size))
+        if magic != HASHES_MAGIC or version != HASHES_VERSION or hashes_time.decode('ascii') != time:
+            return None
+        data = fh.read()
+    return (page_size, [data[i:i + _HASH_SIZE] for i in range(0, page_count * _HASH_SIZE, _HASH_SIZE)])
+
+def _write_hashes(path, time, page_size, hashes):
+    with open(path + '.tmp', 'wb') as fh:
+        fh.write(_HASHES_HEADER.pack(HASHES_MAGIC, HASHES_VERSION, page_size, len(hashes), time.encode('ascii')))
+        fh.write(b''.join(hashes))
+    os.replace(path + '.tmp', path)
+
+def _write_full(new_path, out_path):
+    page_size = _page_size(new_path)
+    hashes = []
+    with open(new_path, 'rb') as new, gzip.open(out_path, 'wb') as out:
+        while True:
+            page = new.read(page_size)
+            if len(page) == 0:
+                break
+            out.write(page)
+            hashes.append(_hash_page(page))
+    return (page_size, hashes)
+
+def _write_changed_pages(old_hashes, new_path, out_path):
+    page_size = _page_size(new_path)
+    page_count = os.path.getsize(new_path) // page_size
+    hashes = []
+    changed = 0
+    with open(new_path, 'rb') as new, gzip.open(out_path, 'wb') as out:
+        out.write(_PAGES_HEADER.pack(PAGES_MAGIC, PAGES_VERSION, page_size, page_count))
+        for page_number in range(page_count):
+            page = new.read(page_size)
+            hashes.append(_hash_page(page))
+            if page_number >= len(old_hashes) or old_hashes[page_number] != hashes[-1]:
+                out.write(_PAGE_NUMBER.pack(page_number))
+                out.write(page)
+                changed += 1
+    return (changed, hashes)
+
+def _apply_changed_pages(path, pages_path):
+    with gzip.open(pages_path, 'rb') as fh, open(path, 'r+b') as out:
+        magic, version, page_size, page_count = _PAGES_HEADER.unpack(fh.read(_PAGES_HEADER.size))
+        if magic != PAGES_MAGIC or version != PAGES_VERSION:
+            raise ValueError('{} is not a page list'.format(pages_path))
+        while True:
+            raw_number = fh.read(_PAGE_NUMBER.size)
+            if len(raw_number) == 0:
+                break
+            page_number = _PAGE_NUMBER.unpack(raw_number)[0]
+            out.seek(page_number * page_size)
+            out.write(fh.read(page_size))
+        out.truncate(page_count * page_size)
+
+def backup(directory, full_every=24, keep_full=7, pages_per_step=256, now=None):
+    """
+    Add a snapshot to directory: a full one if there are none yet or the newest chain already has
+    full_every snapshots, otherwise just the changed pages. Then delete all but the newest keep_full chains.
+    The snapshot is named after now (default: the current time) in UTC; naive times are taken to be in UTC.
+
+    Returns the filename of the new snapshot.
+    """
+    _check_keep_full(keep_full)
+    os.makedirs(directory, exist_ok=True)
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if now.tzinfo != None:
+        now = now.astimezone(datetime.timezone.utc)
+    time = now.strftime('%Y%m%dT%H%M%S')
+    snapshots = list_snapshots(directory)
+    if len(snapshots) > 0 and snapshots[-1][0] >= time:
+        raise ValueError('a snapshot from {} already exists'.format(snapshots[-1][0]))
+    hashes_path = os.path.join(directory, LATEST_HASHES_NAME)
+    new_path = os.path.join(directory, 'new.sqlite3')
+    if os.path.exists(new_path):
+        os.remove(new_path)
+    copy_database(new_path, pages_per_step=pages_per_step)
+    try:
+        chain_length = 0
+        for _, kind, _ in reversed(snapshots):
+            chain_length += 1
+            if kind == 'full':
+                break
+        old_hashes = _read_hashes(hashes_path, snapshots[-1][0]) if len(snapshots) > 0 else None
+        if old_hashes == None or chain_length >= full_every or old_hashes[0] != _page_size(new_path):
+            name = 'full-{}.sqlite3.gz'.format(time)
+            (page_size, hashes) = _write_full(new_path, os.path.join(directory, name + '.tmp'))
+        else:
+            name = 'incremental-{}.pages.gz'.format(time)
+            (changed, hashes) = _write_changed_pages(old_hashes[1], new_path, os.path.join(directory, name + '.tmp'))
+            page_size = old_hashes[0]
+            logger.info('%d pages changed since the last backup', changed)
+        os.replace(os.path.join(directory, name + '.tmp'), os.path.join(directory, name))
+        _write_hashes(hashes_path, time, page_size, hashes)
+    finally:
+        os.remove(new_path)
+    old_latest_path = os.path.join(directory, _OLD_LATEST_NAME)
+    if os.path.exists(old_latest_path):
+        os.remove(old_latest_path)
+    rotate(directory, keep_full)
+    return name
+
+def _check_keep_full(keep_full):
+    if keep_full < 1:
+        raise ValueError('keep_full must be at least 1, not {}'.format(keep_full))
+
+def rotate(directory, keep_full):
+    """
+    Delete snapshots older than the newest keep_full full snapshots.
+    """
+    _check_keep_full(keep_full)
+    snapshots = list_snapshots(directory)
+    full_times = [time for time, kind, _ in snapshots if kind == 'full']
+    if len(full_times) <= keep_full:
+        return
+    oldest_kept = full_times[-keep_full]
+    for time, _, name in snapshots:
+        if time < oldest_kept:
+            os.remove(os.path.join(directory, name))
+
+def restore(directory, path, time=None):
+    """
+    Write the database as of the newest snapshot at or before time (a UTC YYYYMMDDTHHMMSS string;
+    default: the newest) to path.
+    """
+    snapshots = [snapshot for snapshot in list_snapshots(directory) if time == None or snapshot[0] <= time]
+    full_indices = [i for i, (_, kind, _) in enumerate(snapshots) if kind == 'full']
+    if len(full_indices) == 0:
+        raise ValueError('no full snapshot in {}'.format(directory))
+    chain = snapshots[full_indices[-1]:]
+    with gzip.open(os.path.join(directory, chain[0][2]), 'rb') as fh, open(path, 'wb') as out:
+        shutil.copyfileobj(fh, out)
+    for _, _, name in chain[1:]:
+        _apply_changed_pages(path, os.path.join(directory, name))
+    return chain[-1][0]
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz.backup import backup, restore
+
+class Command(BaseCommand):
+    help = 'Back up the SQLite database while it is in use, storing only changed pages between full snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default='backups', help='directory holding the snapshots')
+        parser.add_argument('--full-every', type=int, default=24, help='take a full snapshot after this many snapshots')
+        parser.add_argument('--keep-full', type=int, default=7, help='number of full snapshots (with their incremental ones) to keep')
+        parser.add_argument('--pages-per-step', type=int, default=256, help='pages copied before letting other processes write')
+        parser.add_argument('--restore', metavar='PATH', help='instead of backing up, write the newest snapshot to PATH')
+        parser.add_argument('--time', help='with --restore, use the newest snapshot at or before this UTC time (YYYYMMDDTHHMMSS)')
+
+    def handle(self, *args, **options):
+        try:
+            if options['restore']:
+                time = restore(options['directory'], options['restore'], options['time'])
+                self.stdout.write('restored snapshot from {} to {}'.format(time, options['restore']))
+            else:
+                name = backup(options['directory'], full_every=options['full_every'],
+                              keep_full=options['keep_full'], pages_per_step=options['pages_per_step'])
+                self.stdout.write('wrote {}'.format(name))
+        except ValueError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,50 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz.analysis import SWEEP_COLUMNS, geometries_within, read_trace, sweep
+
+class Command(BaseCommand):
+    help = 'Simulate a trace against every cache geometry within some bounds and write hits, misses and evictions as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', help='trace file with one hexadecimal address (optionally preceded by R or W) per line')
+        parser.add_argument('--output', help='CSV file to write (default: standard output)')
+        parser.add_argument('--min-ways', type=int, default=1)
+        parser.add_argument('--max-ways', type=int, default=12)
+        parser.add_argument('--min-sets-log', type=int, default=0)
+        parser.add_argument('--max-sets-log', type=int, default=12)
+        parser.add_argument('--min-block-size-log', type=int, default=2)
+        parser.add_argument('--max-block-size-log', type=int, default=8)
+        parser.add_argument('--max-cache-size', type=int, default=128 * 1024 * 1024)
+        parser.add_argument('--address-bits', type=int, default=64)
+
+    def handle(self, *args, **options):
+        geometries = geometries_within(
+            min_ways=options['min_ways'],
+            max_ways=options['max_ways'],
+            min_sets_log=options['min_sets_log'],
+            max_sets_log=options['max_sets_log'],
+            min_block_size_log=options['min_block_size_log'],
+            max_block_size_log=options['max_block_size_log'],
+            max_cache_size=options['max_cache_size'],
+        )
+        if len(geometries) == 0:
+            raise CommandError('no cache geometries within the given bounds')
+        with open(options['trace']) as fh:
+            try:
+                (addresses, _) = read_trace(fh)
+            except ValueError as e:
+                raise CommandError(str(e))
+        rows = sweep(addresses, geometries, address_bits=options['address_bits'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as out:
+                self._write_csv(out, rows)
+        else:
+            self._write_csv(self.stdout, rows)
+
+    def _write_csv(self, out, rows):
+        writer = csv.writer(out)
+        writer.writerow(SWEEP_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quiz.models import CachePattern, QuestionPoolEntry
+
+class Command(BaseCommand):
+    help = ('Pre-generate questions so that handing out a new question does not need to generate one, '
+            'and store results for patterns simulated by an older simulator version')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patterns', type=int, default=200, help='number of pattern questions to keep in the pool')
+        parser.add_argument('--parameters', type=int, default=200, help='number of parameter questions to keep in the pool')
+        parser.add_argument('--watch', action='store_true', help='keep refilling the pool instead of exiting')
+        parser.add_argument('--interval', type=float, default=5.0, help='seconds between refills with --watch')
+
+    def handle(self, *args, **options):
+        while True:
+            added_patterns = QuestionPoolEntry.fill(QuestionPoolEntry.PATTERN, options['patterns'])
+            added_parameters = QuestionPoolEntry.fill(QuestionPoolEntry.PARAMETER, options['parameters'])
+            if added_patterns or added_parameters or not options['watch']:
+                self.stdout.write('added {} pattern and {} parameter questions to the pool'.format(
+                    added_patterns, added_parameters))
+            updated_patterns = CachePattern.update_stale_results()
+            if updated_patterns or not options['watch']:
+                self.stdout.write('updated stored results of {} patterns'.format(updated_patterns))
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz.term import roll_over_term, vacuum
+
+class Command(BaseCommand):
+    help = 'Archive all questions and answers to a gzipped fixture, then empty those tables for a new term'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='file to write, such as term-2018-spring.json.gz; restore it with loaddata')
+        parser.add_argument('--no-vacuum', action='store_true', help='do not vacuum the database afterwards')
+
+    def handle(self, *args, **options):
+        if os.path.exists(options['archive']):
+            raise CommandError('{} already exists'.format(options['archive']))
+        count = roll_over_term(options['archive'])
+        self.stdout.write('archived {} rows to {}'.format(count, options['archive']))
+        if not options['no_vacuum']:
+            vacuum()
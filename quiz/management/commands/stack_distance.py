@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz.analysis import read_trace, stack_distance_curves
+
+def _int_list(value):
+    return [int(x, 0) for x in value.split(',')]
+
+class Command(BaseCommand):
+    help = 'Print LRU hit ratios for every associativity of several cache geometries from one pass over a trace'
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', help='trace file with one hexadecimal address (optionally preceded by R or W) per line')
+        parser.add_argument('--sets', type=_int_list, default=[1], help='comma-separated list of numbers of sets')
+        parser.add_argument('--block-sizes', type=_int_list, default=[64], help='comma-separated list of block sizes in bytes')
+        parser.add_argument('--max-ways', type=int, default=16)
+        parser.add_argument('--address-bits', type=int, default=64)
+
+    def handle(self, *args, **options):
+        for value in options['sets'] + options['block_sizes']:
+            if value <= 0 or value & (value - 1) != 0:
+                raise CommandError('numbers of sets and block sizes must be powers of two, not {}'.format(value))
+        with open(options['trace']) as fh:
+            try:
+                (addresses, _) = read_trace(fh)
+            except ValueError as e:
+                raise CommandError(str(e))
+        rows = stack_distance_curves(
+            addresses,
+            set_counts=options['sets'],
+            block_sizes=options['block_sizes'],
+            max_ways=options['max_ways'],
+            address_bits=options['address_bits'],
+        )
+        self.stdout.write('num_sets\tblock_size\tnum_ways\tcache_size_bytes\thits\thit_ratio')
+        for (num_sets, block_size, num_ways, cache_size_bytes, hits, hit_ratio) in rows:
+            self.stdout.write('{}\t{}\t{}\t{}\t{}\t{:.6f}'.format(
+                num_sets, block_size, num_ways, cache_size_bytes, hits, hit_ratio))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from quiz.models import CACHE_GIVENS_FILE, write_cache_givens
+
+class Command(BaseCommand):
+    help = 'Recompute the table of minimal given parameter sets after changing the parameters or equations in quiz/models.py'
+
+    def handle(self, *args, **options):
+        given_sets = write_cache_givens()
+        self.stdout.write('wrote {} given sets to {}'.format(len(given_sets), CACHE_GIVENS_FILE))
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0007_parameteranswer_was_save'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachepattern',
+            name='expected_results_raw',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='cachepattern',
+            name='final_state_snapshot',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='cachepattern',
+            name='results_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0008_cachepattern_stored_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionPoolEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('given_parts_raw', models.TextField(default='')),
+                ('parameters', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='quiz.CacheParameters')),
+                ('pattern', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='quiz.CachePattern')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='questionpoolentry',
+            index=models.Index(fields=['kind', 'id'], name='quiz_questi_kind_8d37d5_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:43
+
+from django.db import migrations
+
+
+def merge_duplicate_parameters(apps, schema_editor):
+    CacheParameters = apps.get_model('quiz', 'CacheParameters')
+    referencing_models = [
+        apps.get_model('quiz', 'CachePattern'),
+        apps.get_model('quiz', 'ParameterQuestion'),
+        apps.get_model('quiz', 'QuestionPoolEntry'),
+    ]
+    kept_id = {}
+    duplicate_ids = []
+    for row in CacheParameters.objects.order_by('id').values('id', 'num_ways', 'num_sets', 'block_size', 'address_bits'):
+        key = (row['num_ways'], row['num_sets'], row['block_size'], row['address_bits'])
+        if key not in kept_id:
+            kept_id[key] = row['id']
+        else:
+            for model in referencing_models:
+                model.objects.filter(parameters_id=row['id']).update(parameters_id=kept_id[key])
+            duplicate_ids.append(row['id'])
+    CacheParameters.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0009_questionpoolentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_parameters, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cacheparameters',
+            unique_together={('num_ways', 'num_sets', 'block_size', 'address_bits')},
+        ),
+    ]
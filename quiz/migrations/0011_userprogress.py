@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0010_cacheparameters_unique_geometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('for_user', models.TextField(unique=True)),
+                ('last_parameter_in_progress', models.BooleanField(default=False)),
+                ('last_pattern_in_progress', models.BooleanField(default=False)),
+                ('parameter_complete', models.IntegerField(default=0)),
+                ('pattern_complete', models.IntegerField(default=0)),
+                ('best_parameter_answers_raw', models.TextField(default='[]')),
+                ('best_pattern_score', models.IntegerField(null=True)),
+                ('best_pattern_max_score', models.IntegerField(null=True)),
+                ('last_parameter_question', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='quiz.ParameterQuestion')),
+                ('last_pattern_question', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='quiz.PatternQuestion')),
+            ],
+        ),
+    ]
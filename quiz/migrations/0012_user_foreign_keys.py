@@ -0,0 +1,165 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_users(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    models_with_users = [
+        apps.get_model('quiz', 'PatternQuestion'),
+        apps.get_model('quiz', 'PatternAnswer'),
+        apps.get_model('quiz', 'ParameterQuestion'),
+        apps.get_model('quiz', 'ParameterAnswer'),
+    ]
+    usernames = set()
+    for model in models_with_users:
+        usernames.update(model.objects.values_list('for_user', flat=True).distinct())
+    existing = set(User.objects.values_list('username', flat=True))
+    # marked with quiz.models.BACKFILLED_PASSWORD (an unusable password), which keeps them out of the
+    # grades until someone logs in with the name; this also covers 'guest' and forgotten
+    # 'name+hidden' questions, which never had accounts
+    User.objects.bulk_create([
+        User(username=username, password='!cachelab-backfilled')
+        for username in sorted(usernames - existing)
+    ])
+    for model in models_with_users:
+        model.objects.update(user_id=Subquery(User.objects.filter(username=OuterRef('for_user')).values('id')[:1]))
+    # rebuilt from the answers on first use
+    apps.get_model('quiz', 'UserProgress').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0011_userprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parameteranswer',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='parameterquestion',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='patternanswer',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='patternquestion',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='userprogress',
+            name='user',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_users, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='parameteranswer',
+            name='quiz_parame_for_use_5d073c_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='parameteranswer',
+            name='quiz_parame_for_use_382ba3_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patternanswer',
+            name='quiz_patter_for_use_cad271_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patternanswer',
+            name='quiz_patter_for_use_3a2f34_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patternquestion',
+            name='quiz_patter_for_use_c1f75d_idx',
+        ),
+        migrations.RemoveField(
+            model_name='parameteranswer',
+            name='for_user',
+        ),
+        migrations.RemoveField(
+            model_name='parameterquestion',
+            name='for_user',
+        ),
+        migrations.RemoveField(
+            model_name='patternanswer',
+            name='for_user',
+        ),
+        migrations.RemoveField(
+            model_name='patternquestion',
+            name='for_user',
+        ),
+        migrations.RemoveField(
+            model_name='userprogress',
+            name='for_user',
+        ),
+        migrations.AlterField(
+            model_name='parameteranswer',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='parameterquestion',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='patternanswer',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='patternquestion',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='userprogress',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='parameteranswer',
+            index=models.Index(fields=['user', 'submit_time'], name='quiz_parame_user_id_89adc3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameteranswer',
+            index=models.Index(fields=['user', 'was_complete', 'score_ratio'], name='quiz_parame_user_id_bb97ff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameteranswer',
+            index=models.Index(fields=['question', 'submit_time'], name='quiz_parame_questio_a0c735_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameterquestion',
+            index=models.Index(fields=['user', 'index'], name='quiz_parame_user_id_d82c3f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patternanswer',
+            index=models.Index(fields=['user', 'submit_time'], name='quiz_patter_user_id_a81a7d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patternanswer',
+            index=models.Index(fields=['user', 'was_complete', 'score'], name='quiz_patter_user_id_825a54_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patternanswer',
+            index=models.Index(fields=['question', 'submit_time'], name='quiz_patter_questio_154284_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patternquestion',
+            index=models.Index(fields=['user', 'index'], name='quiz_patter_user_id_051b89_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Max
+import django.db.models.deletion
+
+
+def fold_hidden_users(apps, schema_editor):
+    """
+    Forgotten questions used to be moved to a 'name+hidden' user; move them back as hidden rows.
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserHistory = apps.get_model('quiz', 'UserHistory')
+    UserProgress = apps.get_model('quiz', 'UserProgress')
+    PatternQuestion = apps.get_model('quiz', 'PatternQuestion')
+    ParameterQuestion = apps.get_model('quiz', 'ParameterQuestion')
+    models_with_users = [
+        PatternQuestion,
+        apps.get_model('quiz', 'PatternAnswer'),
+        ParameterQuestion,
+        apps.get_model('quiz', 'ParameterAnswer'),
+    ]
+    users_by_name = dict(User.objects.values_list('username', 'id'))
+    for username, hidden_user_id in users_by_name.items():
+        if not username.endswith('+hidden') or username[:-len('+hidden')] not in users_by_name:
+            continue
+        user_id = users_by_name[username[:-len('+hidden')]]
+        UserHistory.objects.create(user_id=user_id, epoch=1, hidden_before_epoch=1)
+        for model in models_with_users:
+            visible_rows = model.objects.filter(user_id=user_id)
+            if model in [PatternQuestion, ParameterQuestion]:
+                # both sets of questions were numbered from 0; the hidden ones came first
+                hidden_max_index = model.objects.filter(user_id=hidden_user_id).aggregate(Max('index'))['index__max']
+                if hidden_max_index != None:
+                    visible_rows.update(index=F('index') + hidden_max_index + 1)
+            visible_rows.update(epoch=1)
+            model.objects.filter(user_id=hidden_user_id).update(user_id=user_id, epoch=0)
+        UserProgress.objects.filter(user_id__in=[user_id, hidden_user_id]).delete()
+        User.objects.filter(id=hidden_user_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0012_user_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parameteranswer',
+            name='epoch',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='parameterquestion',
+            name='epoch',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='patternanswer',
+            name='epoch',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='patternquestion',
+            name='epoch',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='UserHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.IntegerField(default=0)),
+                ('hidden_before_epoch', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fold_hidden_users, migrations.RunPython.noop),
+    ]
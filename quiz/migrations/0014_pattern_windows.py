@@ -0,0 +1,83 @@
+import json
+
+from django.db import migrations, models
+
+from quiz.models import pack_accesses, unpack_accesses
+
+# PATTERN_WINDOW_SIZE when this migration was written
+WINDOW_SIZE = 100
+
+PARTS = ['hit', 'tag', 'index', 'offset', 'evicted']
+
+def _windows(items):
+    return [items[start:start + WINDOW_SIZE] for start in range(0, len(items), WINDOW_SIZE)]
+
+def split_into_windows(apps, schema_editor):
+    CachePattern = apps.get_model('quiz', 'CachePattern')
+    PatternAnswer = apps.get_model('quiz', 'PatternAnswer')
+    for pattern in CachePattern.objects.iterator():
+        accesses = unpack_accesses(pattern.accesses_raw)
+        pattern.num_accesses = len(accesses)
+        if pattern.results_version > 0:
+            stored = json.loads(pattern.expected_results_raw)
+            pattern.expected_results_raw = '\n'.join(
+                json.dumps({'accesses': pack_accesses(window_accesses), 'hit': hit, 'evicted': evicted})
+                for (window_accesses, hit, evicted) in zip(
+                    _windows(accesses), _windows(stored['hit']), _windows(stored['evicted']))
+            )
+        pattern.save(update_fields=['num_accesses', 'expected_results_raw'])
+    for answer in PatternAnswer.objects.select_related('question').iterator():
+        results = json.loads(answer.access_results_raw)
+        give_first = answer.question.give_first
+        summary = {'score': [], 'answered': []}
+        lines = []
+        for start in range(0, len(results), WINDOW_SIZE):
+            window = results[start:start + WINDOW_SIZE]
+            asked = window[max(0, give_first - start):]
+            # the parts _score_answer marked correct
+            summary['score'].append(sum(1 for result in asked for part in PARTS if result[part]['correct'] == True))
+            summary['answered'].append(all(
+                not result[part]['invalid'] for result in window for part in ['tag', 'index', 'offset', 'evicted']
+            ))
+            lines.append(json.dumps(window))
+        answer.access_results_raw = '\n'.join([json.dumps(summary)] + lines)
+        answer.save(update_fields=['access_results_raw'])
+
+def join_windows(apps, schema_editor):
+    CachePattern = apps.get_model('quiz', 'CachePattern')
+    PatternAnswer = apps.get_model('quiz', 'PatternAnswer')
+    for pattern in CachePattern.objects.filter(results_version__gt=0).iterator():
+        windows = [json.loads(line) for line in pattern.expected_results_raw.split('\n') if line]
+        pattern.expected_results_raw = json.dumps({
+            'hit': [hit for window in windows for hit in window['hit']],
+            'evicted': [evicted for window in windows for evicted in window['evicted']],
+        })
+        pattern.save(update_fields=['expected_results_raw'])
+    empty = {part: {'value': None, 'string': '', 'invalid': True, 'correct': True} for part in PARTS}
+    for answer in PatternAnswer.objects.select_related('question__pattern').iterator():
+        num_accesses = answer.question.pattern.num_accesses
+        results = []
+        for (number, line) in enumerate(answer.access_results_raw.split('\n')[1:]):
+            if line:
+                results.extend(json.loads(line))
+            else:
+                # never answered; the given accesses of this window are left empty too
+                results.extend(empty for _ in range(min(WINDOW_SIZE, num_accesses - number * WINDOW_SIZE)))
+        answer.access_results_raw = json.dumps(results)
+        answer.save(update_fields=['access_results_raw'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0013_userhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachepattern',
+            name='num_accesses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(split_into_windows, join_windows),
+    ]
@@ -1,15 +1,50 @@
-from django.db import models
-from django.db.models import F
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+import array
+import base64
 import bisect
+import collections
+import contextlib
+import hashlib
 import itertools
 import json
 import logging
 import math
+import os
 import random
+import struct
+import sys
 import uuid
+import zlib
 
 logger = logging.getLogger('cachelabweb')
 
+# password (an unusable one, as it starts with '!') of accounts created by migration 0012 for old
+# answers from users who had no account; cleared when someone logs in with the name
+BACKFILLED_PASSWORD = '!cachelab-backfilled'
+
+@contextlib.contextmanager
+def write_transaction():
+    """
+    transaction.atomic() for blocks that write. With the cachelabweb.sqlite3 backend, an outermost
+    block starts with BEGIN IMMEDIATE, so it waits for other processes' writes up front instead of
+    failing when its read lock cannot be upgraded. Read-only atomic blocks do not take the lock.
+    """
+    connection = transaction.get_connection()
+    immediate = not connection.in_atomic_block and hasattr(connection, 'begin_immediate')
+    if immediate:
+        connection.begin_immediate = True
+    try:
+        with transaction.atomic():
+            if immediate:
+                connection.begin_immediate = False
+            yield
+    finally:
+        if immediate:
+            connection.begin_immediate = False
+
 class CacheAccess():
     def __init__(self, address, size=1, kind=None, type='R'):
         self.address = address
@@ -98,6 +133,16 @@ class CacheAccessResult():
         self.evicted = ResultItem(None, string='', invalid=True)
         return self
 
+    @staticmethod
+    def from_dump(dump):
+        self = CacheAccessResult()
+        for key in ['hit', 'tag', 'index', 'offset', 'evicted']:
+            self.__dict__[key] = ResultItem(**dump[key])
+        return self
+
+    def is_answered(self):
+        return not (self.tag.invalid or self.index.invalid or self.offset.invalid or self.evicted.invalid)
+
     def set_from_string(self, key, value):
         int_value = value_from_hex(value)
         self.__dict__[key] = ResultItem(
@@ -186,6 +231,14 @@ class CacheParameters(models.Model):
     address_bits = models.IntegerField(default=8)
     # FIXME: is_writeback support
 
+    class Meta:
+        unique_together = [
+            ('num_ways', 'num_sets', 'block_size', 'address_bits'),
+        ]
+
+    # maximum number of geometries remembered by CacheParameters.get in each process
+    CACHE_SIZE = 1 << 16
+
     @property
     def offset_bits(self):
         return int(math.log2(self.block_size))
@@ -223,28 +276,49 @@ class CacheParameters(models.Model):
             offset
         )
 
+    def split_addresses(self, addresses):
+        # vectorized split_address over a numpy array of addresses
+        import numpy
+        addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+        offset_bits = numpy.uint64(self.offset_bits)
+        index_bits = numpy.uint64(self.index_bits)
+        offsets = addresses & numpy.uint64(~((~0) << self.offset_bits))
+        indices = (addresses >> offset_bits) & numpy.uint64(~((~0) << self.index_bits))
+        tags = addresses >> (offset_bits + index_bits)
+        return (tags, indices, offsets)
+
     def drop_offset(self, address):
         return address & ((~0) << self.offset_bits)
 
 
     @staticmethod
     def get(num_ways, num_sets, block_size, address_bits):
-        possible = CacheParameters.objects.filter(
+        key = (num_ways, num_sets, block_size, address_bits)
+        result = _parameters_by_geometry.get(key)
+        if result != None:
+            _parameters_by_geometry.move_to_end(key)
+            return result
+        (result, _) = CacheParameters.objects.get_or_create(
             num_ways=num_ways,
             num_sets=num_sets,
             block_size=block_size,
             address_bits=address_bits,
         )
-        if len(possible) == 0:
-            result = CacheParameters()
-            result.num_ways = num_ways
-            result.num_sets = num_sets
-            result.block_size = block_size
-            result.address_bits = address_bits
-            result.save()
-            return result
-        else:
-            return possible[0]
+        # only remember rows once they are committed, so a rolled back row is never reused
+        transaction.on_commit(lambda: CacheParameters._remember(key, result))
+        return result
+
+    @staticmethod
+    def _remember(key, parameters):
+        _parameters_by_geometry[key] = parameters
+        while len(_parameters_by_geometry) > CacheParameters.CACHE_SIZE:
+            _parameters_by_geometry.popitem(last=False)
+
+    @staticmethod
+    def clear_cache():
+        _parameters_by_geometry.clear()
+        for space in _parameter_spaces.values():
+            space.preloaded = False
 
     @staticmethod
     def random(
@@ -256,23 +330,104 @@ class CacheParameters(models.Model):
             address_bits_rounding=8,
             min_tag_bits=1,
             max_cache_size=128 * 1024 * 1024):
-        while True:
-            num_ways = random.randint(min_ways, max_ways)
+        bounds = (min_ways, max_ways, min_sets_log, max_sets_log, min_block_size_log, max_block_size_log,
+                  min_address_bits, max_address_bits, address_bits_rounding, min_tag_bits, max_cache_size)
+        space = _parameter_spaces.get(bounds)
+        if space == None:
+            space = CacheParameterSpace(*bounds)
+            _parameter_spaces[bounds] = space
+        return space.sample()
+
+
+# (num_ways, num_sets, block_size, address_bits) -> CacheParameters, least recently used first
+_parameters_by_geometry = collections.OrderedDict()
+
+class CacheParameterSpace():
+    """
+    Every geometry CacheParameters.random can choose with some bounds, so it can be
+    sampled directly instead of by drawing until a geometry is small enough.
+
+    A geometry (num_ways, num_sets, block_size) is chosen uniformly among those within
+    max_cache_size, then address_bits is chosen uniformly from those leaving enough tag
+    bits and rounded up to a multiple of address_bits_rounding.
+    """
+    # only create missing rows in bulk for spaces with at most this many missing geometries
+    MAX_CREATE = 1 << 12
+
+    def __init__(self, min_ways, max_ways, min_sets_log, max_sets_log, min_block_size_log, max_block_size_log,
+                 min_address_bits, max_address_bits, address_bits_rounding, min_tag_bits, max_cache_size):
+        self.max_address_bits = max_address_bits
+        self.address_bits_rounding = address_bits_rounding
+        # (num_ways, num_sets, block_size, minimum address bits)
+        self.choices = []
+        for num_ways in range(min_ways, max_ways + 1):
             way_bits = int(math.log2(num_ways)) + 1
-            index_bits = random.randint(min_sets_log, max_sets_log)
-            num_sets = 1 << index_bits
-            offset_bits = random.randint(min_block_size_log, max_block_size_log)
-            block_size = 1 << offset_bits
-            min_tag_bits = max(min_tag_bits, way_bits)
-            min_address_bits = max(min_address_bits, index_bits + offset_bits + min_tag_bits)
-            address_bits = random.randint(min_address_bits, max_address_bits)
-            if address_bits % address_bits_rounding > 0:
-                address_bits += address_bits_rounding - (address_bits % address_bits_rounding)
-            cache_size = num_ways * block_size * num_sets
-            if cache_size < max_cache_size:
-                break
+            for index_bits in range(min_sets_log, max_sets_log + 1):
+                for offset_bits in range(min_block_size_log, max_block_size_log + 1):
+                    if num_ways << (index_bits + offset_bits) >= max_cache_size:
+                        continue
+                    lowest_address_bits = max(min_address_bits, index_bits + offset_bits + max(min_tag_bits, way_bits))
+                    if lowest_address_bits > max_address_bits:
+                        continue
+                    self.choices.append((num_ways, 1 << index_bits, 1 << offset_bits, lowest_address_bits))
+        if len(self.choices) == 0:
+            raise ValueError('no cache parameters within the given bounds')
+        self.preloaded = False
+
+    def _round_address_bits(self, address_bits):
+        if address_bits % self.address_bits_rounding > 0:
+            address_bits += self.address_bits_rounding - (address_bits % self.address_bits_rounding)
+        return address_bits
+
+    def geometries(self):
+        result = set()
+        for (num_ways, num_sets, block_size, lowest_address_bits) in self.choices:
+            for address_bits in range(lowest_address_bits, self.max_address_bits + 1):
+                result.add((num_ways, num_sets, block_size, self._round_address_bits(address_bits)))
+        return result
+
+    def preload(self):
+        """
+        Load all the CacheParameters rows for this space (creating missing ones if there are
+        not too many) in a few queries.
+        """
+        wanted = self.geometries()
+        def _existing():
+            rows = CacheParameters.objects.filter(
+                num_ways__in=set(g[0] for g in wanted),
+                num_sets__in=set(g[1] for g in wanted),
+                block_size__in=set(g[2] for g in wanted),
+                address_bits__in=set(g[3] for g in wanted),
+            )
+            return {(p.num_ways, p.num_sets, p.block_size, p.address_bits): p for p in rows}
+        existing = _existing()
+        missing = wanted - set(existing.keys())
+        if len(missing) > CacheParameterSpace.MAX_CREATE:
+            logger.info('not creating %d missing cache parameters', len(missing))
+        elif len(missing) > 0:
+            logger.info('creating %d cache parameters', len(missing))
+            CacheParameters.objects.bulk_create([
+                CacheParameters(num_ways=num_ways, num_sets=num_sets, block_size=block_size, address_bits=address_bits)
+                for (num_ways, num_sets, block_size, address_bits) in missing
+            ], ignore_conflicts=True)
+            existing = _existing()
+        # only once the rows are committed; if the transaction is rolled back, the next sample() preloads again
+        def _remember_all():
+            for key in wanted:
+                if key in existing:
+                    CacheParameters._remember(key, existing[key])
+            self.preloaded = True
+        transaction.on_commit(_remember_all)
+
+    def sample(self):
+        if not self.preloaded:
+            self.preload()
+        (num_ways, num_sets, block_size, lowest_address_bits) = random.choice(self.choices)
+        address_bits = self._round_address_bits(random.randint(lowest_address_bits, self.max_address_bits))
         return CacheParameters.get(num_ways=num_ways, num_sets=num_sets, block_size=block_size, address_bits=address_bits)
 
+# bounds passed to CacheParameters.random -> CacheParameterSpace
+_parameter_spaces = {}
 
 def random_parameters_for_pattern():
     return CacheParameters.random(
@@ -296,21 +451,23 @@ all_cache_question_parameters = [
     'address_bits',
 ]
 
+# each set of parameters can be computed from all but one of its members
+cache_parameter_equations = [
+    set(['block_size', 'offset_bits']),
+    set(['index_bits', 'num_sets']),
+    set(['block_size', 'set_size_bytes', 'num_ways']),
+    set(['block_size', 'num_ways', 'num_sets', 'cache_size_bytes']),
+    set(['tag_bits', 'index_bits', 'offset_bits', 'address_bits']),
+    set(['cache_size_bytes', 'set_size_bytes', 'num_sets']),
+    set(['cache_size_bytes', 'way_size_bytes', 'num_ways']),
+]
+
 def _can_find_parameters_from(given_parts):
     known_parts = given_parts
     done = False
-    equations = [
-        set(['block_size', 'offset_bits']),
-        set(['index_bits', 'num_sets']),
-        set(['block_size', 'set_size_bytes', 'num_ways']),
-        set(['block_size', 'num_ways', 'num_sets', 'cache_size_bytes']),
-        set(['tag_bits', 'index_bits', 'offset_bits', 'address_bits']),
-        set(['cache_size_bytes', 'set_size_bytes', 'num_sets']),
-        set(['cache_size_bytes', 'way_size_bytes', 'num_ways']),
-    ]
     while not done:
         done = True
-        for equation in equations:
+        for equation in cache_parameter_equations:
             if len(known_parts & equation) == len(equation) - 1:
                 known_parts |= equation
                 done = False
@@ -335,19 +492,63 @@ def _get_cache_givens_to_ask():
                 can_trim = True
         if not can_trim:
             filtered.add(givens)
-    logger.info('all_cache_given_sets = %s', filtered)
-    return list(filtered)
+    return sorted(sorted(givens) for givens in filtered)
+
+CACHE_GIVENS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache_givens.json')
+
+def cache_givens_fingerprint():
+    description = json.dumps([
+        all_cache_question_parameters,
+        sorted(sorted(equation) for equation in cache_parameter_equations),
+    ])
+    return hashlib.sha256(description.encode('UTF-8')).hexdigest()
 
-all_cache_given_sets = _get_cache_givens_to_ask()
+def write_cache_givens(path=CACHE_GIVENS_FILE):
+    given_sets = _get_cache_givens_to_ask()
+    # one given set per line so changes are easy to review
+    with open(path, 'w') as fh:
+        fh.write('{{\n "fingerprint": {},\n "given_sets": [\n'.format(json.dumps(cache_givens_fingerprint())))
+        fh.write(',\n'.join('  ' + json.dumps(givens) for givens in given_sets))
+        fh.write('\n ]\n}\n')
+    return given_sets
+
+_cache_given_sets = None
+
+def get_cache_given_sets():
+    """
+    Returns the minimal sets of parameters from which all the others can be found.
+
+    These are loaded from CACHE_GIVENS_FILE (regenerate it with 'manage.py update_cache_givens'),
+    and only computed here if it is missing or was made for different parameters or equations.
+    """
+    global _cache_given_sets
+    if _cache_given_sets == None:
+        try:
+            with open(CACHE_GIVENS_FILE) as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('fingerprint') == cache_givens_fingerprint():
+            _cache_given_sets = data['given_sets']
+        else:
+            logger.warning('%s is missing or out of date, computing cache given sets', CACHE_GIVENS_FILE)
+            _cache_given_sets = _get_cache_givens_to_ask()
+    return _cache_given_sets
 
 class ParameterQuestion(models.Model):
     question_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    for_user = models.TextField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    epoch = models.IntegerField(default=0)
     parameters = models.ForeignKey('CacheParameters', on_delete=models.PROTECT)
     missing_parts_raw = models.TextField()
     given_parts_raw = models.TextField()
     index = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'index']),
+        ]
+
     def get_missing_parts(self):
         return json.loads(self.missing_parts_raw)
     
@@ -368,29 +569,48 @@ class ParameterQuestion(models.Model):
         return getattr(self.parameters, name)
    
     @staticmethod
-    def generate_new(for_user):
-        which_given = list(random.choice(all_cache_given_sets))
-        which_parameters = CacheParameters.random()
+    def generate_new(user):
+        # if creating the question fails, the claimed entry goes back into the pool
+        with write_transaction():
+            pooled = QuestionPoolEntry.claim(QuestionPoolEntry.PARAMETER)
+            if pooled != None:
+                return ParameterQuestion._for_parameters(pooled.parameters, pooled.given_parts, user)
+        logger.info('parameter question pool is empty, generating a question for %s', user)
+        which_given = list(random.choice(get_cache_given_sets()))
+        return ParameterQuestion._for_parameters(CacheParameters.random(), which_given, user)
+
+    @staticmethod
+    def _for_parameters(which_parameters, which_given, user):
         q = ParameterQuestion()
-        last_question = ParameterQuestion.last_for_user(for_user)
+        last_question = ParameterQuestion.objects.filter(user=user).order_by('-index').first()
         if last_question != None:
             q.index = last_question.index + 1
         else:
             q.index = 0
-        q.for_user = for_user
+        q.user = user
         q.parameters = which_parameters
         q.given_parts = which_given
         q.missing_parts = list(filter(lambda x: x not in which_given, all_cache_question_parameters))
         q.save()
         return q
 
+    def save(self, *args, **kwargs):
+        with write_transaction():
+            adding = self._state.adding
+            if adding:
+                self.epoch = UserHistory.current_epoch(self.user_id)
+            super().save(*args, **kwargs)
+            if adding:
+                UserProgress.record_parameter_question(self)
+
     @staticmethod
-    def last_for_user(for_user):
-        return ParameterQuestion.objects.filter(for_user__exact=for_user).order_by('-index').first()    
+    def last_for_user(user):
+        return only_visible(ParameterQuestion.objects.filter(user=user)).order_by('-index').first()
 
 
 class ParameterAnswer(models.Model):
-    for_user = models.TextField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    epoch = models.IntegerField(default=0)
     question = models.ForeignKey('ParameterQuestion', on_delete=models.PROTECT)
     submit_time = models.DateTimeField(auto_now=True,editable=False)
     answer_raw = models.TextField()
@@ -402,8 +622,9 @@ class ParameterAnswer(models.Model):
     
     class Meta: 
         indexes = [
-            models.Index(fields=['for_user', 'submit_time']),
-            models.Index(fields=['for_user', 'was_complete', 'score_ratio']),
+            models.Index(fields=['user', 'submit_time']),
+            models.Index(fields=['user', 'was_complete', 'score_ratio']),
+            models.Index(fields=['question', 'submit_time']),
         ]
 
     def set_answer_from_post(self, post):
@@ -423,6 +644,15 @@ class ParameterAnswer(models.Model):
     def max_score(self):
         return len(self.question.missing_parts)
 
+    def save(self, *args, **kwargs):
+        with write_transaction():
+            adding = self._state.adding
+            if adding:
+                self.epoch = UserHistory.current_epoch(self.user_id)
+            super().save(*args, **kwargs)
+            if adding:
+                UserProgress.record_parameter_answer(self)
+
     def _post_to_scored_answer(self, answer):
         score = 0
         incomplete = False
@@ -450,111 +680,578 @@ class ParameterAnswer(models.Model):
     def last_for_question_and_user(question, user):
         if question == None:
             return None
-        return ParameterAnswer.objects.filter(question=question, for_user__exact=user).order_by('-submit_time').first()
+        return only_visible(ParameterAnswer.objects.filter(question=question, user=user)).order_by('-submit_time').first()
 
     @staticmethod
     def last_for_user(user):
-        return ParameterAnswer.objects.filter(for_user__exact=username).order_by('-submit_time').first()
+        return only_visible(ParameterAnswer.objects.filter(user=user)).order_by('-submit_time').first()
     
     @staticmethod
     def num_complete_for_user(user):
-        return ParameterAnswer.objects.filter(for_user__exact=user, was_complete=True).count()
+        return only_visible(ParameterAnswer.objects.filter(user=user, was_complete=True)).count()
     
     @staticmethod
     def best_K_for_user(user, K):
-        return ParameterAnswer.objects.filter(for_user__exact=user, was_complete=True).order_by('-score_ratio', '-submit_time')[:K]
+        return only_visible(ParameterAnswer.objects.filter(user=user, was_complete=True)).order_by('-score_ratio', '-submit_time')[:K]
     
     @staticmethod
     def best_K_for_user_by_time(user, K, time):
-        return ParameterAnswer.objects.filter(for_user__exact=user, was_complete=True, submit_time__lte=time).order_by('-score_ratio', '-submit_time')[:K]
+        return only_visible(ParameterAnswer.objects.filter(user=user, was_complete=True, submit_time__lte=time)).order_by('-score_ratio', '-submit_time')[:K]
 
-def _update_lru(entry_list, new_most_recent):
-    new_most_recent.lru = len(entry_list)
-    entry_list.sort(key=lambda e: e.lru)
-    for i, e in enumerate(entry_list):
-        e.lru = i
+    @staticmethod
+    def best_K_for_all_users_by_times(K, times):
+        """
+        best_K_for_user_by_time for every user and each of times, from one ranked query per time.
+
+        Returns {user id: [[(score, max_score), ...] for each time in times]}.
+        """
+        result = {}
+        max_scores = {}
+        for i, time in enumerate(times):
+            rows = top_rows_per_user(
+                only_visible(ParameterAnswer.objects.filter(was_complete=True, submit_time__lte=time)),
+                [F('score_ratio').desc(), F('submit_time').desc()],
+                ['score', 'question__missing_parts_raw'],
+                K,
+            )
+            for user, score, missing_parts_raw in rows:
+                if missing_parts_raw not in max_scores:
+                    max_scores[missing_parts_raw] = len(json.loads(missing_parts_raw))
+                result.setdefault(user, [[] for _ in times])[i].append((score, max_scores[missing_parts_raw]))
+        return result
+
+class CacheTraceResult():
+    """
+    Columnar results of CacheState.apply_trace, one numpy array element per access.
 
-def _get_lru(entry_list):
-    logger.debug('entry_list = %s', entry_list)
-    return list(filter(lambda e: e.lru == 0, entry_list))[0]
+    evicted is only meaningful where has_evicted is True.
+    """
+    def __init__(self, hit, tag, index, offset, evicted, has_evicted):
+        self.hit = hit
+        self.tag = tag
+        self.index = index
+        self.offset = offset
+        self.evicted = evicted
+        self.has_evicted = has_evicted
+
+    def __len__(self):
+        return len(self.hit)
+
+    @property
+    def num_hits(self):
+        return int(self.hit.sum())
+
+    @property
+    def num_misses(self):
+        return len(self.hit) - self.num_hits
+
+    @property
+    def num_evictions(self):
+        return int(self.has_evicted.sum())
+
+    @staticmethod
+    def concatenate(results):
+        import numpy
+        if len(results) == 0:
+            empty_bool = numpy.zeros(0, dtype=bool)
+            empty_uint = numpy.zeros(0, dtype=numpy.uint64)
+            return CacheTraceResult(empty_bool, empty_uint, empty_uint, empty_uint, empty_uint, empty_bool)
+        return CacheTraceResult(
+            hit=numpy.concatenate([r.hit for r in results]),
+            tag=numpy.concatenate([r.tag for r in results]),
+            index=numpy.concatenate([r.index for r in results]),
+            offset=numpy.concatenate([r.offset for r in results]),
+            evicted=numpy.concatenate([r.evicted for r in results]),
+            has_evicted=numpy.concatenate([r.has_evicted for r in results]),
+        )
+
+    def to_results(self, params):
+        results = []
+        for i in range(len(self.hit)):
+            results.append(CacheAccessResult.from_reference(
+                hit=bool(self.hit[i]),
+                tag=int(self.tag[i]),
+                index=int(self.index[i]),
+                offset=int(self.offset[i]),
+                evicted=int(self.evicted[i]) if self.has_evicted[i] else None,
+                tag_bits=params.tag_bits,
+                index_bits=params.index_bits,
+                offset_bits=params.offset_bits,
+                address_bits=params.address_bits,
+            ))
+        return results
 
 class CacheState():
-    def __init__(self, params):
+    """
+    Simulated LRU cache contents.
+
+    With sparse=True, storage for a set is only allocated the first time an
+    access maps to it, so memory use scales with the number of sets touched
+    rather than with the cache geometry. By default, sparse storage is used for
+    caches with more than SPARSE_MIN_LINES lines.
+    """
+    SPARSE_MIN_LINES = 1 << 16
+
+    def __init__(self, params, sparse=None):
         self.params = params
-        entries = []
-        for index in range(params.num_sets):
-            entries.append([])
-            for way in range(params.num_ways):
-                entries[-1].append(
-                    CacheEntry({
-                        'valid': False,
-                        'tag': None,
-                        'lru': way,
-                        'dirty': False
-                    })
-                )
-        self.entries = entries
+        num_ways = params.num_ways
+        num_sets = params.num_sets
+        if sparse == None:
+            sparse = num_sets * num_ways > CacheState.SPARSE_MIN_LINES
+        self.sparse = sparse
+        self._num_ways = num_ways
+        self._offset_bits = params.offset_bits
+        self._index_bits = params.index_bits
+        self._tag_bits = params.tag_bits
+        self._address_bits = params.address_bits
+        self._offset_mask = ~((~0) << self._offset_bits)
+        self._index_mask = ~((~0) << self._index_bits)
+        # recency is a doubly-linked list of ways within each set; initially
+        # way 0 is least recently used and way num_ways - 1 is most recently used
+        self._initial_older = array.array('h', range(-1, num_ways - 1))
+        self._initial_newer = array.array('h', list(range(1, num_ways)) + [-1])
+        # sets are stored in slots; line number is slot * num_ways + way
+        if sparse:
+            self._slot_for_index = {}
+            num_slots = 0
+        else:
+            self._slot_for_index = None
+            num_slots = num_sets
+        num_lines = num_slots * num_ways
+        self._valid = array.array('b', bytes(num_lines))
+        self._dirty = array.array('b', bytes(num_lines))
+        self._tag = array.array('Q', bytes(8 * num_lines))
+        self._older = self._initial_older * num_slots
+        self._newer = self._initial_newer * num_slots
+        self._lru = array.array('h', [0]) * num_slots
+        self._mru = array.array('h', [num_ways - 1]) * num_slots
+        # block address (address >> offset_bits) -> way, for valid lines only
+        self._way_for_block = {}
+
+    def _set_slot(self, index, materialize=True):
+        if self._slot_for_index == None:
+            return index
+        slot = self._slot_for_index.get(index)
+        if slot == None and materialize:
+            slot = len(self._lru)
+            self._slot_for_index[index] = slot
+            self._valid.frombytes(bytes(self._num_ways))
+            self._dirty.frombytes(bytes(self._num_ways))
+            self._tag.frombytes(bytes(8 * self._num_ways))
+            self._older.extend(self._initial_older)
+            self._newer.extend(self._initial_newer)
+            self._lru.append(0)
+            self._mru.append(self._num_ways - 1)
+        return slot
+
+    def materialized_indices(self):
+        if self._slot_for_index == None:
+            return range(self.params.num_sets)
+        else:
+            return sorted(self._slot_for_index.keys())
+
+    def _touch(self, slot, way):
+        mru = self._mru[slot]
+        if mru == way:
+            return
+        base = slot * self._num_ways
+        older = self._older[base + way]
+        newer = self._newer[base + way]
+        if older == -1:
+            self._lru[slot] = newer
+        else:
+            self._newer[base + older] = newer
+        self._older[base + newer] = older
+        self._newer[base + mru] = way
+        self._older[base + way] = mru
+        self._newer[base + way] = -1
+        self._mru[slot] = way
+
+    def _lru_ranks(self, slot):
+        base = slot * self._num_ways
+        ranks = [0] * self._num_ways
+        way = self._lru[slot]
+        rank = 0
+        while way != -1:
+            ranks[way] = rank
+            rank += 1
+            way = self._newer[base + way]
+        return ranks
+
+    def _entries_for_slot(self, slot):
+        base = slot * self._num_ways
+        ranks = self._lru_ranks(slot)
+        row = []
+        for way in range(self._num_ways):
+            valid = bool(self._valid[base + way])
+            row.append(CacheEntry({
+                'valid': valid,
+                'tag': self._tag[base + way] if valid else None,
+                'lru': ranks[way],
+                'dirty': bool(self._dirty[base + way]),
+            }))
+        return row
+
+    def _load_entries_for_slot(self, index, slot, row):
+        base = slot * self._num_ways
+        for way, entry in enumerate(row):
+            if entry.valid:
+                self._valid[base + way] = 1
+                self._tag[base + way] = entry.tag
+                self._way_for_block[(entry.tag << self._index_bits) | index] = way
+            self._dirty[base + way] = 1 if entry.dirty else 0
+        by_recency = sorted(range(len(row)), key=lambda way: row[way].lru)
+        for older, way, newer in zip([-1] + by_recency[:-1], by_recency, by_recency[1:] + [-1]):
+            self._older[base + way] = older
+            self._newer[base + way] = newer
+        self._lru[slot] = by_recency[0]
+        self._mru[slot] = by_recency[-1]
+
+    def _empty_entries(self):
+        return [CacheEntry({'valid': False, 'tag': None, 'lru': way, 'dirty': False}) for way in range(self._num_ways)]
 
     def to_entries(self):
-        return self.entries
-    
+        # one row per set, even for sets a sparse state never allocated; see to_sparse_entries
+        if self.sparse and self.params.num_sets * self._num_ways > CacheState.SPARSE_MIN_LINES:
+            raise ValueError('{} sets are too many to list; use to_sparse_entries'.format(self.params.num_sets))
+        if self.sparse:
+            rows = [None] * self.params.num_sets
+            for index, row in self.to_sparse_entries():
+                rows[index] = row
+            return [row if row != None else self._empty_entries() for row in rows]
+        else:
+            return [self._entries_for_slot(index) for index in range(self.params.num_sets)]
+
+    def to_sparse_entries(self):
+        """
+        Returns [(index, row), ...] of the sets that have storage, which is all of them for dense states.
+        """
+        return [(index, self._entries_for_slot(self._set_slot(index, materialize=False))) for index in self.materialized_indices()]
+
     def apply_access(self, access, dry_run=False):
-        (tag, index, offset) = self.params.split_address(access.address)
+        address = access.address
+        block = address >> self._offset_bits
+        offset = address & self._offset_mask
+        index = block & self._index_mask
+        tag = block >> self._index_bits
         logger.debug('apply_access(%x,%x,%x)', tag, index, offset)
-        found = None
-        entries_at_index = self.entries[index]
-        was_hit = False
-        for possible in entries_at_index:
-            if possible.tag == tag:
-                found = possible
-                was_hit = True
-                break
+        way = self._way_for_block.get(block)
+        was_hit = way != None
         evicted = None
-        if found == None:
+        slot = self._set_slot(index, materialize=not dry_run)
+        if not was_hit and slot != None:
             # FIXME: record dirty flush here
-            found = _get_lru(entries_at_index)
-            if found.valid:
-                logger.debug('evicted %x', found.tag)
-                evicted = self.params.unsplit_address(found.tag, index, 0)
+            way = self._lru[slot]
+            line = slot * self._num_ways + way
+            if self._valid[line]:
+                logger.debug('evicted %x', self._tag[line])
+                evicted = self.params.unsplit_address(self._tag[line], index, 0)
             else:
                 logger.debug('no eviction')
             if not dry_run:
-                found.valid = True
-                found.tag = tag
-        # FIXME: conditional on is_writeback?
-        if access.is_write:
-            found.dirty = True
+                if self._valid[line]:
+                    del self._way_for_block[(self._tag[line] << self._index_bits) | index]
+                self._valid[line] = 1
+                self._tag[line] = tag
+                self._way_for_block[block] = way
         if not dry_run:
-            _update_lru(entries_at_index, found)
+            # FIXME: conditional on is_writeback?
+            if access.is_write:
+                self._dirty[slot * self._num_ways + way] = 1
+            self._touch(slot, way)
         return CacheAccessResult.from_reference(
             hit=was_hit,
             tag=tag,
             index=index,
             offset=offset,
             evicted=evicted,
-            tag_bits=self.params.tag_bits,
-            index_bits=self.params.index_bits,
-            offset_bits=self.params.offset_bits,
-            address_bits=self.params.address_bits,
+            tag_bits=self._tag_bits,
+            index_bits=self._index_bits,
+            offset_bits=self._offset_bits,
+            address_bits=self._address_bits,
+        )
+
+    def apply_trace(self, addresses, writes=None):
+        # numpy is only needed for trace analysis, not for serving questions
+        import numpy
+        (tags, indices, offsets) = self.params.split_addresses(addresses)
+        blocks = (tags << numpy.uint64(self._index_bits)) | indices
+        if writes is None:
+            writes = itertools.repeat(False)
+        else:
+            writes = numpy.asarray(writes, dtype=bool).tolist()
+        num_ways = self._num_ways
+        index_bits = self._index_bits
+        valid = self._valid
+        tag_array = self._tag
+        dirty = self._dirty
+        lru = self._lru
+        way_for_block = self._way_for_block
+        touch = self._touch
+        sparse = self.sparse
+        set_slot = self._set_slot
+        hits = bytearray(len(addresses))
+        evicted_positions = []
+        evicted_blocks = []
+        for i, (block, index, tag, write) in enumerate(zip(blocks.tolist(), indices.tolist(), tags.tolist(), writes)):
+            slot = set_slot(index) if sparse else index
+            way = way_for_block.get(block)
+            if way != None:
+                hits[i] = 1
+            else:
+                way = lru[slot]
+                line = slot * num_ways + way
+                if valid[line]:
+                    old_block = (tag_array[line] << index_bits) | index
+                    del way_for_block[old_block]
+                    evicted_positions.append(i)
+                    evicted_blocks.append(old_block)
+                valid[line] = 1
+                tag_array[line] = tag
+                way_for_block[block] = way
+            if write:
+                dirty[slot * num_ways + way] = 1
+            touch(slot, way)
+        has_evicted = numpy.zeros(len(addresses), dtype=bool)
+        has_evicted[evicted_positions] = True
+        evicted = numpy.zeros(len(addresses), dtype=numpy.uint64)
+        evicted[evicted_positions] = numpy.asarray(evicted_blocks, dtype=numpy.uint64) << numpy.uint64(self._offset_bits)
+        return CacheTraceResult(
+            hit=numpy.frombuffer(bytes(hits), dtype=bool),
+            tag=tags,
+            index=indices,
+            offset=offsets,
+            evicted=evicted,
+            has_evicted=has_evicted,
         )
 
+    # magic, version, is sparse, num_ways, num_sets, block_size, address_bits, number of slots
+    _SNAPSHOT_HEADER = struct.Struct('<4sHBxQQQQQ')
+    SNAPSHOT_MAGIC = b'CLSS'
+    SNAPSHOT_VERSION = 1
+
+    def _snapshot_arrays(self):
+        return [self._valid, self._dirty, self._tag, self._older, self._newer, self._lru, self._mru]
+
+    def to_snapshot(self):
+        """
+        Returns the state as compact bytes, which CacheState.from_snapshot can restore.
+
+        The snapshot is a fixed little-endian header followed by the zlib-compressed
+        storage arrays (and the set index of each slot for sparse states).
+        """
+        if self.sparse:
+            slot_indices = [0] * len(self._lru)
+            for index, slot in self._slot_for_index.items():
+                slot_indices[slot] = index
+            arrays = [array.array('Q', slot_indices)] + self._snapshot_arrays()
+        else:
+            arrays = self._snapshot_arrays()
+        body = []
+        for a in arrays:
+            if sys.byteorder != 'little':
+                a = array.array(a.typecode, a)
+                a.byteswap()
+            body.append(a.tobytes())
+        header = CacheState._SNAPSHOT_HEADER.pack(
+            CacheState.SNAPSHOT_MAGIC,
+            CacheState.SNAPSHOT_VERSION,
+            1 if self.sparse else 0,
+            self.params.num_ways,
+            self.params.num_sets,
+            self.params.block_size,
+            self.params.address_bits,
+            len(self._lru),
+        )
+        return header + zlib.compress(b''.join(body))
+
+    @staticmethod
+    def from_snapshot(params, data):
+        header_size = CacheState._SNAPSHOT_HEADER.size
+        (magic, version, sparse, num_ways, num_sets, block_size, address_bits, num_slots) = \
+            CacheState._SNAPSHOT_HEADER.unpack(data[:header_size])
+        if magic != CacheState.SNAPSHOT_MAGIC:
+            raise ValueError('not a cache state snapshot')
+        if version != CacheState.SNAPSHOT_VERSION:
+            raise ValueError('unsupported cache state snapshot version {}'.format(version))
+        if (num_ways, num_sets, block_size, address_bits) != \
+                (params.num_ways, params.num_sets, params.block_size, params.address_bits):
+            raise ValueError('cache state snapshot is for different cache parameters')
+        body = zlib.decompress(data[header_size:])
+        state = CacheState(params, sparse=bool(sparse))
+        arrays = state._snapshot_arrays()
+        num_lines = num_slots * num_ways
+        # valid, dirty, tag, older, newer have one item per line; lru, mru one per slot
+        counts = [num_lines] * 5 + [num_slots] * 2
+        if state.sparse:
+            slot_indices = array.array('Q')
+            arrays = [slot_indices] + arrays
+            counts = [num_slots] + counts
+        position = 0
+        for a, count in zip(arrays, counts):
+            del a[:]
+            size = a.itemsize * count
+            a.frombytes(body[position:position + size])
+            if sys.byteorder != 'little':
+                a.byteswap()
+            position += size
+        if state.sparse:
+            state._slot_for_index = {index: slot for slot, index in enumerate(slot_indices)}
+        else:
+            slot_indices = range(num_slots)
+        index_bits = state._index_bits
+        for slot, index in enumerate(slot_indices):
+            base = slot * num_ways
+            for way in range(num_ways):
+                if state._valid[base + way]:
+                    state._way_for_block[(state._tag[base + way] << index_bits) | index] = way
+        return state
+
     def to_json(self):
-        return json.dumps(list(
-            map(lambda row: list(map(lambda x: x.as_dump(), row)),
-                self.entries)
-        ))
+        def dump_row(row):
+            return list(map(lambda x: x.as_dump(), row))
+        if self.sparse:
+            return json.dumps({
+                'sets': {str(index): dump_row(row) for index, row in self.to_sparse_entries()},
+            })
+        else:
+            return json.dumps(list(map(dump_row, self.to_entries())))
 
     @staticmethod
     def from_json(params, the_json):
         raw_data = json.loads(the_json)
-        result = []
-        for raw_row in raw_data:
-            row = []
-            for raw_entry in raw_row:
-                row.append(CacheEntry(raw_entry))
-            result.append(row)
-        state = CacheState(params)
-        state.entries = result
+        if isinstance(raw_data, dict):
+            state = CacheState(params, sparse=True)
+            raw_rows = sorted((int(index), raw_row) for index, raw_row in raw_data['sets'].items())
+        else:
+            state = CacheState(params, sparse=False)
+            raw_rows = enumerate(raw_data)
+        for index, raw_row in raw_rows:
+            state._load_entries_for_slot(index, state._set_slot(index), list(map(CacheEntry, raw_row)))
+        return state
+
+def _append_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return (value, position)
+
+def pack_accesses(accesses):
+    """
+    Encode a list of CacheAccesses compactly as JSON of the form
+    {"format": 2, "kinds": [...], "packed": "..."}, where packed is base64 of a varint
+    triple per access: zigzag-encoded difference from the previous address, size,
+    and position of the kind in kinds.
+    """
+    kinds = []
+    kind_ids = {}
+    packed = bytearray()
+    last_address = 0
+    for access in accesses:
+        if access.kind not in kind_ids:
+            kind_ids[access.kind] = len(kinds)
+            kinds.append(access.kind)
+        delta = access.address - last_address
+        _append_varint(packed, delta << 1 if delta >= 0 else ((-delta) << 1) - 1)
+        _append_varint(packed, access.size)
+        _append_varint(packed, kind_ids[access.kind])
+        last_address = access.address
+    return json.dumps({
+        'format': 2,
+        'kinds': kinds,
+        'packed': base64.b64encode(bytes(packed)).decode('ascii'),
+    })
+
+def unpack_accesses(raw):
+    """
+    Decode accesses from pack_accesses or from the original format, a JSON list of CacheAccess.as_dump()s.
+    """
+    data = json.loads(raw)
+    if isinstance(data, list):
+        return list(map(lambda x: CacheAccess(**x), data))
+    if data.get('format') != 2:
+        raise ValueError('unknown access encoding {}'.format(data.get('format')))
+    kinds = data['kinds']
+    packed = base64.b64decode(data['packed'])
+    accesses = []
+    address = 0
+    position = 0
+    while position < len(packed):
+        (zigzag, position) = _read_varint(packed, position)
+        (size, position) = _read_varint(packed, position)
+        (kind_id, position) = _read_varint(packed, position)
+        address += zigzag >> 1 if zigzag & 1 == 0 else -((zigzag + 1) >> 1)
+        accesses.append(CacheAccess(address=address, size=size, kind=kinds[kind_id]))
+    return accesses
+
+# bump when a change to CacheState would change the stored results of existing patterns
+SIMULATOR_VERSION = 1
+
+# patterns are stored, shown and answered this many accesses at a time
+PATTERN_WINDOW_SIZE = 100
+
+def pattern_windows(start, end):
+    """
+    Returns the (number, start, end) of each window overlapping accesses start to end.
+    """
+    return [
+        (window_start // PATTERN_WINDOW_SIZE, window_start, min(window_start + PATTERN_WINDOW_SIZE, end))
+        for window_start in range(start - start % PATTERN_WINDOW_SIZE, end, PATTERN_WINDOW_SIZE)
+    ]
+
+def _window_line(raw, number):
+    # line number of raw without splitting the lines after it
+    return raw.split('\n', number + 1)[number]
+
+class _IndexedSet():
+    # a set that also supports choosing a random item in constant time
+    def __init__(self):
+        self._items = []
+        self._positions = {}
+
+    def add(self, item):
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        position = self._positions.pop(item, None)
+        if position == None:
+            return
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._positions[last] = position
+
+    def choice(self):
+        return random.choice(self._items)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __len__(self):
+        return len(self._items)
+
+def _random_excluding(limit, excluded):
+    # uniformly random integer in [0, limit) that is not in the sorted list excluded
+    rank = random.randrange(0, limit - len(excluded))
+    value = rank
+    while True:
+        next_value = rank + bisect.bisect_right(excluded, value)
+        if next_value == value:
+            return value
+        value = next_value
 
 # because random.choices isn't available until Python 3.6
 def _random_weighted(possibilities, weights):
@@ -568,15 +1265,36 @@ class CachePattern(models.Model):
     parameters = models.ForeignKey('CacheParameters', on_delete=models.PROTECT)
     access_size = models.IntegerField(default=2)
     address_bits = models.IntegerField(default=8)
-    # JSON list of cache accesses
+    # cache accesses encoded by pack_accesses (older rows: JSON list of cache accesses)
     accesses_raw = models.TextField()
+    num_accesses = models.IntegerField(default=0)
+    # expected results, stored when the pattern is saved, as one line of JSON per window of
+    # PATTERN_WINDOW_SIZE accesses, of the form {"accesses": pack_accesses(...), "hit": [...], "evicted": [...]},
+    # so that one window can be shown without parsing the others
+    expected_results_raw = models.TextField(default='')
+    # CacheState.to_snapshot() of the state after all accesses
+    final_state_snapshot = models.BinaryField(default=b'')
+    # SIMULATOR_VERSION the stored results were computed with, 0 if none
+    results_version = models.IntegerField(default=0)
     _have_access_results = False
+    _final_state = None
+    # (accesses_raw, accesses parsed from it)
+    _parsed_accesses = (None, None)
 
     def get_accesses(self):
-        return list(map(lambda x: CacheAccess(**x), json.loads(self.accesses_raw)))
+        (parsed_raw, accesses) = self._parsed_accesses
+        if parsed_raw is not self.accesses_raw:
+            accesses = unpack_accesses(self.accesses_raw)
+            self._parsed_accesses = (self.accesses_raw, accesses)
+        return accesses
 
     def set_accesses(self, accesses):
-        self.accesses_raw = json.dumps(list(map(lambda x: x.as_dump(), accesses)))
+        self.accesses_raw = pack_accesses(accesses)
+        self._parsed_accesses = (self.accesses_raw, list(accesses))
+        self.num_accesses = len(accesses)
+        self._have_access_results = False
+        self._final_state = None
+        self.results_version = 0
 
     accesses = property(get_accesses, set_accesses)
 
@@ -592,17 +1310,120 @@ class CachePattern(models.Model):
     @property
     def final_state(self):
         self.generate_results()
+        if self._final_state == None:
+            self._final_state = CacheState.from_snapshot(self.parameters, bytes(self.final_state_snapshot))
         return self._final_state
 
     def generate_results(self):
-        if not self._have_access_results:
-            state = CacheState(self.parameters)
-            results = []
-            for access in self.accesses:
-                results.append(state.apply_access(access))
-            self._access_results = results
-            self._final_state = state
-            self._have_access_results = True
+        if self._have_access_results:
+            return
+        if self.results_version == SIMULATOR_VERSION:
+            self._load_stored_results()
+        else:
+            # stored by save(), or for existing rows by update_stale_results(), not while reading
+            self._simulate()
+        self._have_access_results = True
+
+    @staticmethod
+    def update_stale_results(limit=100):
+        """
+        Store results for up to limit patterns whose stored results are from an older SIMULATOR_VERSION.
+        Returns the number of patterns updated.
+        """
+        updated = 0
+        stale = CachePattern.objects.filter(results_version__lt=SIMULATOR_VERSION).select_related('parameters')
+        for pattern in stale[:limit]:
+            pattern._simulate()
+            with write_transaction():
+                # unless another process got there first
+                updated += CachePattern.objects.filter(
+                    pattern_id=pattern.pattern_id, results_version__lt=SIMULATOR_VERSION
+                ).update(
+                    expected_results_raw=pattern.expected_results_raw,
+                    final_state_snapshot=pattern.final_state_snapshot,
+                    results_version=pattern.results_version,
+                )
+        if updated > 0:
+            logger.info('updated stored results of %d patterns to simulator version %d', updated, SIMULATOR_VERSION)
+        return updated
+
+    def _simulate(self):
+        state = CacheState(self.parameters)
+        accesses = self.accesses
+        results = []
+        for access in accesses:
+            results.append(state.apply_access(access))
+        self._access_results = results
+        self._final_state = state
+        self.expected_results_raw = '\n'.join(
+            json.dumps({
+                'accesses': pack_accesses(accesses[start:end]),
+                'hit': [result.hit.value for result in results[start:end]],
+                'evicted': [result.evicted.value for result in results[start:end]],
+            })
+            for (_, start, end) in pattern_windows(0, len(accesses))
+        )
+        self.final_state_snapshot = state.to_snapshot()
+        self.results_version = SIMULATOR_VERSION
+
+    def _uses_stored_windows(self):
+        # the full lists are parsed or simulated already, or the stored windows are out of date
+        return not self._have_access_results and self.results_version == SIMULATOR_VERSION
+
+    def accesses_between(self, start, end):
+        """
+        Same as accesses[start:end], but only parses the windows of the stored results in that range.
+        """
+        if not self._uses_stored_windows():
+            return self.accesses[start:end]
+        return [access for (access, _, _) in self._stored_between(start, end)]
+
+    def access_results_between(self, start, end):
+        """
+        Same as access_results[start:end], but only builds the results in that range when they are stored.
+        """
+        if not self._uses_stored_windows():
+            return self.access_results[start:end]
+        return self._results_between(start, end)
+
+    def _load_stored_results(self):
+        self._access_results = self._results_between(0, self.num_accesses)
+
+    def _stored_between(self, start, end):
+        # (access, hit, evicted) for each access from start to end, from the stored windows
+        stored = []
+        for (number, window_start, window_end) in pattern_windows(start, min(end, self.num_accesses)):
+            window = json.loads(_window_line(self.expected_results_raw, number))
+            first = max(start, window_start) - window_start
+            last = window_end - window_start
+            stored.extend(zip(
+                unpack_accesses(window['accesses'])[first:last], window['hit'][first:last], window['evicted'][first:last]
+            ))
+        return stored
+
+    def _results_between(self, start, end):
+        params = self.parameters
+        (tag_bits, index_bits, offset_bits, address_bits) = (
+            params.tag_bits, params.index_bits, params.offset_bits, params.address_bits)
+        results = []
+        for access, hit, evicted in self._stored_between(start, end):
+            (tag, index, offset) = params.split_address(access.address)
+            results.append(CacheAccessResult.from_reference(
+                hit=hit,
+                tag=tag,
+                index=index,
+                offset=offset,
+                evicted=evicted,
+                tag_bits=tag_bits,
+                index_bits=index_bits,
+                offset_bits=offset_bits,
+                address_bits=address_bits,
+            ))
+        return results
+
+    def save(self, *args, **kwargs):
+        self.generate_results()
+        super().save(*args, **kwargs)
 
 
     """
@@ -633,35 +1454,32 @@ class CachePattern(models.Model):
             chance_miss_prefer_empty=0,
             chance_miss_prefer_used=0.5):
         MAX_TRIES = 20
-        MAX_RANDOM_LIST = 1000
         result = CachePattern()
         result.access_size = 2
         result.parameters = parameters
         accesses =  []
         state = CacheState(parameters)
-        would_hit = set()
-        would_miss = set()  # miss AND previously accessed
-        used_indices = set()
-        used_by_count = {}
+        would_hit = _IndexedSet()
+        would_miss = _IndexedSet()  # miss AND previously accessed
+        used_indices = _IndexedSet()
+        used_index_list = []  # sorted
+        cached_tags_by_index = {}
+        # indices_by_occupancy[n] has the used sets with n valid lines
+        indices_by_occupancy = [_IndexedSet() for _ in range(parameters.num_ways + 1)]
+        num_sets = parameters.num_sets
+        num_ways = parameters.num_ways
         tag_bits = parameters.tag_bits
         index_bits = parameters.index_bits
         offset_bits = parameters.offset_bits
         address_bits = parameters.address_bits
         def _find_unused_miss():
-            if len(used_indices) != parameters.num_sets:
-                possible_indices = []
+            if len(used_indices) != num_sets:
                 for _ in range(MAX_TRIES):
                     index = random.randrange(0, 1 << index_bits)
                     if index not in used_indices:
                         tag = random.randrange(0, 1 << tag_bits)
                         return parameters.unsplit_address(tag, index, 0)
-                for index in range(parameters.num_sets):
-                    if index in used_indices:
-                        continue
-                    possible_indices.append(index)
-                    if len(possible_indices) > MAX_RANDOM_LIST:
-                        break
-                index = random.choice(possible_indices)
+                index = _random_excluding(num_sets, used_index_list)
                 tag = random.randrange(0, 1 << tag_bits)
                 return parameters.unsplit_address(tag, index, 0)
             else:
@@ -671,33 +1489,27 @@ class CachePattern(models.Model):
             if prefer_non_conflict:
                 # first try to find a random non-conflict miss
                 for _ in range(MAX_TRIES):
-                    tag = random.randrange(0, 1 << parameters.tag_bits)
+                    tag = random.randrange(0, 1 << tag_bits)
                     block_address = parameters.unsplit_address(tag, index, 0)
                     if block_address in would_hit or block_address in would_miss:
                         continue
                     return block_address
             # then try to find a random maybe-conflict-miss
             for _ in range(MAX_TRIES):
-                tag = random.randrange(0, 1 << parameters.tag_bits)
+                tag = random.randrange(0, 1 << tag_bits)
                 block_address = parameters.unsplit_address(tag, index, 0)
                 if block_address in would_hit:
                     continue
                 return block_address
-            # then search exhaustively for possible blocks
-            possible_blocks = []
-            for tag in range(0, 1 << parameters.tag_bits):
-                block_address = parameters.unsplit_address(tag, index, 0)
-                if block_address in would_hit:
-                    continue
-                possible_blocks.append(block_address)
-                if len(possible_blocks) > MAX_RANDOM_LIST:
-                    break
-            return random.choice(possible_blocks)
+            # then choose directly among the tags not in the set
+            cached_tags = sorted(cached_tags_by_index.get(index, ()))
+            tag = _random_excluding(1 << tag_bits, cached_tags)
+            return parameters.unsplit_address(tag, index, 0)
 
         def _find_used_miss():
             if len(used_indices) == 0:
                 return random.randrange(0, 1 << address_bits)
-            index = random.choice(list(used_indices))
+            index = used_indices.choice()
             return _find_miss_for_index(index)
 
         def _find_random_miss():
@@ -713,6 +1525,15 @@ class CachePattern(models.Model):
             if address == None:
                 address = _find_used_miss()
             return address
+
+        def _find_most_full_index():
+            # prefer the fullest set that is not yet full, so the pattern builds up to a conflict
+            for occupancy in range(num_ways - 1, 0, -1):
+                if len(indices_by_occupancy[occupancy]) > 0:
+                    return indices_by_occupancy[occupancy].choice()
+            if len(indices_by_occupancy[num_ways]) > 0:
+                return indices_by_occupancy[num_ways].choice()
+            return None
             
         for i in range(num_accesses):
             if i < len(start_actions):
@@ -745,27 +1566,19 @@ class CachePattern(models.Model):
             elif access_kind == 'miss_prefer_used':
                 address = _find_used_miss()
             elif access_kind == 'hit':
-                address = random.choice(list(would_hit))
+                address = would_hit.choice()
             elif access_kind == 'conflict_miss':
-                address = random.choice(list(would_miss))
+                address = would_miss.choice()
             elif access_kind == 'setup_conflict_aggressive':
-                best_count = None
-                for v in used_by_count.values():
-                    if best_count == None:
-                        best_count = v
-                    elif v > best_count or (v > 0 and best_count == parameters.num_ways):
-                        best_count = v
-                logger.debug('looking for count %s', best_count)
-                candidates = []
-                for k, v in used_by_count.items():
-                    if v == best_count:
-                        candidates.append(k)
-                logger.debug('candidates are %s', candidates)
-                index = random.choice(candidates)
-                address = _find_miss_for_index(index, prefer_non_conflict=False)
+                index = _find_most_full_index()
+                logger.debug('most full index is %s', index)
+                if index == None:
+                    address = _find_random_miss()
+                else:
+                    address = _find_miss_for_index(index, prefer_non_conflict=False)
             elif access_kind == 'setup_conflict':
-                base_address = random.choice(list(would_hit))
-                (_, index, _) = parameters.split_address(address)
+                base_address = would_hit.choice()
+                (_, index, _) = parameters.split_address(base_address)
                 address = _find_miss_for_index(index, prefer_non_conflict=False)
             else:
                 raise Exception("Could not identify access type")
@@ -779,17 +1592,23 @@ class CachePattern(models.Model):
             (new_tag, new_index, _) = parameters.split_address(address)
             assert tag == new_tag
             assert index == new_index
-            used_indices.add(index)
-            if index in used_by_count:
-                used_by_count[index] = max(used_by_count[index] + 1, parameters.num_ways)
-            else:
-                used_by_count[index] = 1
+            if index not in used_indices:
+                used_indices.add(index)
+                bisect.insort(used_index_list, index)
+            cached_tags = cached_tags_by_index.setdefault(index, set())
+            old_occupancy = len(cached_tags)
+            cached_tags.add(tag)
             would_hit.add(without_offset)
             would_miss.discard(without_offset)
             if access_result.evicted.value != None:
                 would_miss.add(access_result.evicted.value)
                 would_hit.discard(access_result.evicted.value)
-        result.accesses_raw = json.dumps(list(map(lambda a: a.as_dump(), accesses)))
+                (evicted_tag, _, _) = parameters.split_address(access_result.evicted.value)
+                cached_tags.discard(evicted_tag)
+            if len(cached_tags) != old_occupancy:
+                indices_by_occupancy[old_occupancy].discard(index)
+                indices_by_occupancy[len(cached_tags)].add(index)
+        result.accesses = accesses
         result.generate_results()
         result.save()
         return result
@@ -799,14 +1618,15 @@ class CachePattern(models.Model):
 class PatternQuestion(models.Model):
     question_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     pattern = models.ForeignKey('CachePattern', on_delete=models.PROTECT)
-    for_user = models.TextField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    epoch = models.IntegerField(default=0)
     ask_evict = models.BooleanField(default=True)
     index = models.IntegerField()
     give_first = models.IntegerField(default=5)
    
     class Meta: 
         indexes = [
-            models.Index(fields=['for_user', 'index']),
+            models.Index(fields=['user', 'index']),
         ]
 
     @property
@@ -825,25 +1645,112 @@ class PatternQuestion(models.Model):
     def address_bits(self):
         return self.pattern.address_bits
 
+    def save(self, *args, **kwargs):
+        with write_transaction():
+            adding = self._state.adding
+            if adding:
+                self.epoch = UserHistory.current_epoch(self.user_id)
+            super().save(*args, **kwargs)
+            if adding:
+                UserProgress.record_pattern_question(self)
+
+    @staticmethod
+    def last_for_user(user):
+        return only_visible(PatternQuestion.objects.filter(user=user)).order_by('-index').first()
+
+    @staticmethod
+    def random(parameters, user, **extra_args):
+        pattern = CachePattern.random(parameters, **extra_args)
+        return PatternQuestion.for_pattern(pattern, user)
+
     @staticmethod
-    def last_for_user(for_user):
-        return PatternQuestion.objects.filter(for_user__exact=for_user).order_by('-index').first()    
+    def generate_new(user):
+        # if creating the question fails, the claimed entry goes back into the pool
+        with write_transaction():
+            pooled = QuestionPoolEntry.claim(QuestionPoolEntry.PATTERN)
+            if pooled != None:
+                return PatternQuestion.for_pattern(pooled.pattern, user)
+        logger.info('pattern question pool is empty, generating a question for %s', user)
+        return PatternQuestion.random(random_parameters_for_pattern(), user)
 
     @staticmethod
-    def generate_random(parameters, for_user, **extra_args):
-        last_question = PatternQuestion.last_for_user(for_user)
+    def for_pattern(pattern, user):
+        last_question = PatternQuestion.objects.filter(user=user).order_by('-index').first()
         if last_question:
             index = last_question.index + 1
         else:
             index = 0
-        pattern = CachePattern.generate_random(parameters, **extra_args)
         result = PatternQuestion()
         result.pattern = pattern
-        result.for_user = for_user
+        result.user = user
         result.index = index
         result.save()
         return result
 
+class QuestionPoolEntry(models.Model):
+    """
+    A pre-generated question body that has not been given to anyone yet.
+
+    The fill_question_pool command keeps the pool stocked in the background, so that
+    giving someone a new question only needs to claim an entry.
+    """
+    PATTERN = 'pattern'
+    PARAMETER = 'parameter'
+    # claim randomly among this many of the oldest entries to reduce contention between workers
+    CLAIM_SPREAD = 8
+    MAX_CLAIM_TRIES = 5
+
+    kind = models.CharField(max_length=16)
+    parameters = models.ForeignKey('CacheParameters', on_delete=models.PROTECT)
+    # for pattern questions
+    pattern = models.ForeignKey('CachePattern', null=True, on_delete=models.CASCADE)
+    # for parameter questions
+    given_parts_raw = models.TextField(default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'id']),
+        ]
+
+    def get_given_parts(self):
+        return json.loads(self.given_parts_raw)
+
+    def set_given_parts(self, given_parts):
+        self.given_parts_raw = json.dumps(given_parts)
+
+    given_parts = property(get_given_parts, set_given_parts)
+
+    @staticmethod
+    def claim(kind):
+        for _ in range(QuestionPoolEntry.MAX_CLAIM_TRIES):
+            candidates = list(QuestionPoolEntry.objects.filter(kind=kind).select_related(
+                'parameters', 'pattern').order_by('id')[:QuestionPoolEntry.CLAIM_SPREAD])
+            if len(candidates) == 0:
+                return None
+            entry = random.choice(candidates)
+            # if another worker claimed the entry first, nothing is deleted and we try again
+            (deleted, _) = QuestionPoolEntry.objects.filter(pk=entry.pk).delete()
+            if deleted > 0:
+                return entry
+        return None
+
+    @staticmethod
+    def fill(kind, target):
+        missing = target - QuestionPoolEntry.objects.filter(kind=kind).count()
+        for _ in range(missing):
+            entry = QuestionPoolEntry()
+            entry.kind = kind
+            if kind == QuestionPoolEntry.PATTERN:
+                entry.parameters = random_parameters_for_pattern()
+                entry.pattern = CachePattern.random(entry.parameters)
+            elif kind == QuestionPoolEntry.PARAMETER:
+                entry.parameters = CacheParameters.random()
+                entry.given_parts = list(random.choice(get_cache_given_sets()))
+            else:
+                raise ValueError('unknown question pool kind {}'.format(kind))
+            entry.save()
+        return max(missing, 0)
+
 def value_from_hex(x):
     if x != None and (x.startswith('0x') or x.startswith('0X')):
         x = x[2:]
@@ -887,6 +1794,9 @@ def value_from_any(x):
 
 class PatternAnswer(models.Model):
     question = models.ForeignKey('PatternQuestion', on_delete=models.PROTECT)
+    # a line of JSON {"score": [...], "answered": [...]} with the score of each window of PATTERN_WINDOW_SIZE
+    # accesses and whether all of its accesses were answered, then a line per window with the
+    # CacheAccessResult.as_dump() of each of its accesses, or an empty line if it was never answered
     access_results_raw = models.TextField()
     final_state_raw = models.TextField()
     score = models.IntegerField()
@@ -894,36 +1804,95 @@ class PatternAnswer(models.Model):
     was_complete = models.BooleanField(default=False)
     was_save = models.BooleanField(default=False)
     submit_time = models.DateTimeField(auto_now=True,editable=False)
-    for_user = models.TextField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    epoch = models.IntegerField(default=0)
 
     class Meta:
         indexes = [
-            models.Index(fields=['for_user', 'submit_time']),
-            models.Index(fields=['for_user', 'was_complete', 'score']),
+            models.Index(fields=['user', 'submit_time']),
+            models.Index(fields=['user', 'was_complete', 'score']),
+            models.Index(fields=['question', 'submit_time']),
         ]
 
     _access_results = None
 
     def get_access_results(self):
         if self._access_results == None:
-            self._access_results = json.loads(self.access_results_raw)
-        return self._access_results 
-        
+            self._access_results = self.access_results_between(0, self.question.pattern.num_accesses)
+        return self._access_results
 
     def set_access_results(self, value):
-        self._access_results = self._score_answer(value)
-        self.access_results_raw = json.dumps(list(map(lambda x: x.as_dump(), self._access_results)))
+        self.set_results_between(None, 0, value)
 
     access_results = property(get_access_results, set_access_results)
 
-    def _score_answer(self, submitted_results):
-        expected_results = self.question.pattern.access_results
+    def access_results_between(self, start, end):
+        """
+        Same as access_results[start:end], but only parses the windows in that range. Accesses in windows
+        that were never answered are empty, or the expected results if they are given.
+        """
+        question = self.question
+        results = []
+        for (number, window_start, window_end) in pattern_windows(start, min(end, question.pattern.num_accesses)):
+            first = max(start, window_start)
+            line = _window_line(self.access_results_raw, number + 1)
+            if line:
+                results.extend(json.loads(line)[first - window_start:window_end - window_start])
+            else:
+                given = question.pattern.access_results_between(first, min(window_end, question.give_first))
+                results.extend(result.as_dump() for result in given)
+                results.extend(CacheAccessResult.empty().as_dump() for _ in range(first + len(given), window_end))
+        return results
+
+    def set_results_between(self, previous, start, results):
+        """
+        Set and score the answers to accesses start to start + len(results), which must cover whole windows,
+        keeping the other windows of the previous answer, or leaving them unanswered if it is None.
+        """
+        pattern = self.question.pattern
+        give_first = self.question.give_first
+        if previous != None:
+            lines = previous.access_results_raw.split('\n')
+            summary = json.loads(lines[0])
+        else:
+            windows = pattern_windows(0, pattern.num_accesses)
+            lines = [None] + [''] * len(windows)
+            summary = {
+                'score': [0] * len(windows),
+                'answered': [window_end <= give_first for (_, _, window_end) in windows],
+            }
+        end = start + len(results)
+        expected_results = pattern.access_results_between(start, end)
+        for (number, window_start, window_end) in pattern_windows(start, end):
+            window_results = results[window_start - start:window_end - start]
+            summary['score'][number] = self._score_answer(
+                window_start, window_results, expected_results[window_start - start:window_end - start])
+            summary['answered'][number] = all(result.is_answered() for result in window_results)
+            lines[number + 1] = json.dumps([result.as_dump() for result in window_results])
+        lines[0] = json.dumps(summary)
+        self.access_results_raw = '\n'.join(lines)
+        self._access_results = None
+        self.score = sum(summary['score'])
+        self.max_score = 5 * max(0, pattern.num_accesses - give_first)
+
+    def all_answered(self):
+        return all(json.loads(_window_line(self.access_results_raw, 0))['answered'])
+
+    def save(self, *args, **kwargs):
+        with write_transaction():
+            adding = self._state.adding
+            if adding:
+                self.epoch = UserHistory.current_epoch(self.user_id)
+            super().save(*args, **kwargs)
+            if adding:
+                UserProgress.record_pattern_answer(self)
+
+    def _score_answer(self, start, submitted_results, expected_results):
+        # marks which parts of submitted_results (for accesses from start) are correct, and returns the score
         score = 0
-        max_score = 0
-        for i, (submitted, expected) in enumerate(zip(submitted_results, expected_results)):
+        for i, (submitted, expected) in enumerate(zip(submitted_results, expected_results), start):
             if i < self.question.give_first:
                 continue
-            max_score += 5
             if submitted.hit.value == expected.hit.value:
                 score += 1
                 submitted.hit.correct = True
@@ -938,31 +1907,257 @@ class PatternAnswer(models.Model):
             if expected.evicted.value == submitted.evicted.value:
                 score += 1
                 submitted.evicted.correct = True
-        self.score = score
-        self.max_score = max_score
-        return submitted_results
+        return score
 
     @staticmethod
-    def last_for_question_and_user(question, for_user):
+    def last_for_question_and_user(question, user):
         if question == None:
             return None
-        return PatternAnswer.objects.filter(question=question, for_user__exact=for_user).order_by('-submit_time').first()
+        return only_visible(PatternAnswer.objects.filter(question=question, user=user)).order_by('-submit_time').first()
 
     @staticmethod
     def best_complete_for_user(user):
-        return PatternAnswer.objects.filter(for_user__exact=user,was_complete=True).order_by(
+        return only_visible(PatternAnswer.objects.filter(user=user, was_complete=True)).order_by(
                     F('max_score') - F('score')
                 ).first()
 
     @staticmethod
     def best_complete_for_user_by_time(user, submit_time):
-        return PatternAnswer.objects.filter(for_user__exact=user,was_complete=True, submit_time__lte=submit_time).order_by(
+        return only_visible(PatternAnswer.objects.filter(user=user, was_complete=True, submit_time__lte=submit_time)).order_by(
                     F('max_score') - F('score')
                 ).first()
+
+    @staticmethod
+    def best_complete_for_all_users_by_times(times):
+        """
+        best_complete_for_user_by_time for every user and each of times, from one ranked query per time.
+
+        Returns {user id: [(score, max_score) or None for each time in times]}.
+        """
+        result = {}
+        for i, time in enumerate(times):
+            rows = top_rows_per_user(
+                only_visible(PatternAnswer.objects.filter(was_complete=True, submit_time__lte=time)),
+                [(F('max_score') - F('score')).asc(), F('submit_time').desc()],
+                ['score', 'max_score'],
+                1,
+            )
+            for user, score, max_score in rows:
+                result.setdefault(user, [None for _ in times])[i] = (score, max_score)
+        return result
+
     @staticmethod
     def num_complete_for_user(user):
-        return PatternAnswer.objects.filter(for_user__exact=user,was_complete=True).count()
+        return only_visible(PatternAnswer.objects.filter(user=user, was_complete=True)).count()
 
     @staticmethod
     def last_for_user(user):
-        return PatternAnswer.objects.filter(for_user__exact=user).order_by('-submit_time').first()
+        return only_visible(PatternAnswer.objects.filter(user=user)).order_by('-submit_time').first()
+
+class UserProgress(models.Model):
+    """
+    Summary of a user's questions and best answers, so pages need not search all of their answers.
+
+    Updated in the same transaction as each new question or answer; rebuild() recomputes it from
+    scratch when history is hidden or restored.
+    """
+    NEEDED_PARAMETER_PERFECT = 3
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    last_parameter_question = models.ForeignKey('ParameterQuestion', null=True, on_delete=models.SET_NULL, related_name='+')
+    last_parameter_in_progress = models.BooleanField(default=False)
+    last_pattern_question = models.ForeignKey('PatternQuestion', null=True, on_delete=models.SET_NULL, related_name='+')
+    last_pattern_in_progress = models.BooleanField(default=False)
+    parameter_complete = models.IntegerField(default=0)
+    pattern_complete = models.IntegerField(default=0)
+    # [[score_ratio, score, max_score], ...] for the best NEEDED_PARAMETER_PERFECT complete
+    # parameter answers, best and then most recent first
+    best_parameter_answers_raw = models.TextField(default='[]')
+    best_pattern_score = models.IntegerField(null=True)
+    best_pattern_max_score = models.IntegerField(null=True)
+
+    def get_best_parameter_answers(self):
+        return json.loads(self.best_parameter_answers_raw)
+
+    def set_best_parameter_answers(self, value):
+        self.best_parameter_answers_raw = json.dumps(value)
+
+    best_parameter_answers = property(get_best_parameter_answers, set_best_parameter_answers)
+
+    @property
+    def best_parameter_scores(self):
+        return [(score, max_score) for (score_ratio, score, max_score) in self.best_parameter_answers]
+
+    @property
+    def parameter_perfect_count(self):
+        return len([1 for (score, max_score) in self.best_parameter_scores if score == max_score])
+
+    @property
+    def parameter_perfect(self):
+        return self.parameter_perfect_count >= UserProgress.NEEDED_PARAMETER_PERFECT
+
+    @property
+    def pattern_perfect(self):
+        return self.best_pattern_score != None and self.best_pattern_score == self.best_pattern_max_score
+
+    @staticmethod
+    def for_user(user_id):
+        progress = UserProgress.objects.filter(user_id=user_id).first()
+        if progress == None:
+            progress = UserProgress.rebuild(user_id)
+        return progress
+
+    @staticmethod
+    def rebuild(user_id):
+        progress = UserProgress()
+        progress.last_parameter_question = ParameterQuestion.last_for_user(user_id)
+        last_parameter_answer = ParameterAnswer.last_for_question_and_user(progress.last_parameter_question, user_id)
+        progress.last_parameter_in_progress = last_parameter_answer != None and not last_parameter_answer.was_complete
+        progress.last_pattern_question = PatternQuestion.last_for_user(user_id)
+        last_pattern_answer = PatternAnswer.last_for_question_and_user(progress.last_pattern_question, user_id)
+        if last_pattern_answer != None:
+            progress.last_pattern_in_progress = not last_pattern_answer.was_complete
+        else:
+            progress.last_pattern_in_progress = progress.last_pattern_question != None
+        progress.parameter_complete = ParameterAnswer.num_complete_for_user(user_id)
+        progress.pattern_complete = PatternAnswer.num_complete_for_user(user_id)
+        progress.best_parameter_answers = [
+            [answer.score_ratio, answer.score, answer.max_score]
+            for answer in ParameterAnswer.best_K_for_user(user_id, UserProgress.NEEDED_PARAMETER_PERFECT).select_related('question')
+        ]
+        best_pattern_answer = PatternAnswer.best_complete_for_user(user_id)
+        if best_pattern_answer != None:
+            progress.best_pattern_score = best_pattern_answer.score
+            progress.best_pattern_max_score = best_pattern_answer.max_score
+        fields = {
+            field.name: getattr(progress, field.name)
+            for field in UserProgress._meta.concrete_fields
+            if field.name not in ('id', 'user')
+        }
+        return UserProgress.objects.update_or_create(user_id=user_id, defaults=fields)[0]
+
+    @staticmethod
+    def _locked(user_id):
+        """
+        Returns (progress, True) if progress needs updating for a just-saved question or answer,
+        or (progress, False) if it was just rebuilt and already includes it.
+        """
+        progress = UserProgress.objects.select_for_update().filter(user_id=user_id).first()
+        if progress == None:
+            return (UserProgress.rebuild(user_id), False)
+        else:
+            return (progress, True)
+
+    @staticmethod
+    def record_parameter_question(question):
+        progress, needs_update = UserProgress._locked(question.user_id)
+        if needs_update:
+            progress.last_parameter_question = question
+            progress.last_parameter_in_progress = False
+            progress.save()
+
+    @staticmethod
+    def record_pattern_question(question):
+        progress, needs_update = UserProgress._locked(question.user_id)
+        if needs_update:
+            progress.last_pattern_question = question
+            progress.last_pattern_in_progress = True
+            progress.save()
+
+    @staticmethod
+    def record_parameter_answer(answer):
+        progress, needs_update = UserProgress._locked(answer.user_id)
+        if not needs_update:
+            return
+        if answer.question_id == progress.last_parameter_question_id:
+            progress.last_parameter_in_progress = not answer.was_complete
+        if answer.was_complete:
+            progress.parameter_complete += 1
+            best = progress.best_parameter_answers
+            position = 0
+            while position < len(best) and best[position][0] > answer.score_ratio:
+                position += 1
+            best.insert(position, [answer.score_ratio, answer.score, answer.max_score])
+            progress.best_parameter_answers = best[:UserProgress.NEEDED_PARAMETER_PERFECT]
+        progress.save()
+
+    @staticmethod
+    def record_pattern_answer(answer):
+        progress, needs_update = UserProgress._locked(answer.user_id)
+        if not needs_update:
+            return
+        if answer.question_id == progress.last_pattern_question_id:
+            progress.last_pattern_in_progress = not answer.was_complete
+        if answer.was_complete:
+            progress.pattern_complete += 1
+            if progress.best_pattern_score == None or \
+                    answer.max_score - answer.score < progress.best_pattern_max_score - progress.best_pattern_score:
+                progress.best_pattern_score = answer.score
+                progress.best_pattern_max_score = answer.max_score
+        progress.save()
+
+class UserHistory(models.Model):
+    """
+    Which of a user's questions and answers are hidden.
+
+    New questions and answers are stamped with the user's current epoch. Rows from epochs before
+    hidden_before_epoch are hidden, so forgetting or restoring all of them is a single-row write.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    epoch = models.IntegerField(default=0)
+    hidden_before_epoch = models.IntegerField(default=0)
+
+    @staticmethod
+    def current_epoch(user_id):
+        return UserHistory.objects.filter(user_id=user_id).values_list('epoch', flat=True).first() or 0
+
+    @staticmethod
+    def is_hidden(row):
+        hidden_before_epoch = UserHistory.objects.filter(user_id=row.user_id).values_list('hidden_before_epoch', flat=True).first()
+        return hidden_before_epoch != None and row.epoch < hidden_before_epoch
+
+    @staticmethod
+    def forget(user_id):
+        with write_transaction():
+            history, _ = UserHistory.objects.select_for_update().get_or_create(user_id=user_id)
+            history.epoch += 1
+            history.hidden_before_epoch = history.epoch
+            history.save()
+            # everything is hidden now, so the summary is empty
+            UserProgress.objects.filter(user_id=user_id).update(
+                last_parameter_question=None, last_parameter_in_progress=False,
+                last_pattern_question=None, last_pattern_in_progress=False,
+                parameter_complete=0, pattern_complete=0, best_parameter_answers_raw='[]',
+                best_pattern_score=None, best_pattern_max_score=None,
+            )
+
+    @staticmethod
+    def unforget(user_id):
+        with write_transaction():
+            UserHistory.objects.filter(user_id=user_id).update(hidden_before_epoch=0)
+            UserProgress.rebuild(user_id)
+
+def top_rows_per_user(queryset, order_by, fields, limit):
+    """
+    Returns [(user id, field values...), ...] for the first limit rows of each user's rows in queryset
+    when ordered by order_by, best first within each user. Numbering each user's rows with
+    ROW_NUMBER() and keeping only the first ones happens in the database.
+    """
+    ranked = queryset.annotate(user_rank=Window(
+        expression=RowNumber(), partition_by=[F('user_id')], order_by=order_by,
+    )).values_list('user_id', *fields, 'user_rank')
+    (sql, params) = ranked.query.sql_with_params()
+    qn = connection.ops.quote_name
+    # Django 2.2 cannot filter on a window expression, so filter the ranked rows in an outer query
+    outer_sql = 'SELECT * FROM ({}) ranked WHERE ranked.{} <= %s ORDER BY ranked.{}, ranked.{}'.format(
+        sql, qn('user_rank'), qn('user_id'), qn('user_rank'))
+    with connection.cursor() as cursor:
+        cursor.execute(outer_sql, params + (limit,))
+        return [row[:-1] for row in cursor.fetchall()]
+
+def only_visible(queryset):
+    """
+    Filters a queryset of questions or answers to those not hidden by UserHistory.forget.
+    """
+    hidden_before_epoch = UserHistory.objects.filter(user_id=OuterRef('user_id')).values('hidden_before_epoch')[:1]
+    return queryset.filter(epoch__gte=Coalesce(Subquery(hidden_before_epoch), 0))
@@ -0,0 +1,110 @@
+"""
+Archiving and clearing out a term's questions and answers.
+
+Archives are gzipped Django JSON fixtures, so `manage.py loaddata ARCHIVE` restores one.
+"""
+import gzip
+import itertools
+import logging
+import os
+
+import django
+from django.core import serializers
+from django.core.management.color import no_style
+from django.db import connection
+
+from .models import CachePattern, ParameterAnswer, ParameterQuestion, PatternAnswer, PatternQuestion, QuestionPoolEntry, UserHistory, UserProgress, write_transaction
+
+logger = logging.getLogger('cachelabweb')
+
+# in an order loaddata can restore; CacheParameters and users are shared between terms and kept
+ARCHIVED_MODELS = [
+    CachePattern,
+    PatternQuestion,
+    PatternAnswer,
+    ParameterQuestion,
+    ParameterAnswer,
+    UserHistory,
+    UserProgress,
+]
+
+# not worth archiving, but refer to archived rows
+CLEARED_MODELS = [QuestionPoolEntry] + ARCHIVED_MODELS
+
+def _table_names():
+    return [model._meta.db_table for model in CLEARED_MODELS]
+
+def _write_fixture(path):
+    count = 0
+    def _counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+    rows = itertools.chain.from_iterable(model.objects.order_by('pk').iterator() for model in ARCHIVED_MODELS)
+    with gzip.open(path, 'wt', encoding='utf-8') as fh:
+        serializers.serialize('json', _counted(rows), stream=fh)
+    return count
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def write_archive(path):
+    """
+    Write every row of ARCHIVED_MODELS to a gzipped JSON fixture at path. Returns the number of rows.
+    """
+    temporary_path = path + '.tmp'
+    try:
+        count = _write_fixture(temporary_path)
+    except BaseException:
+        _remove_if_exists(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+    return count
+
+def clear_term():
+    """
+    Empty the tables of CLEARED_MODELS with one statement each (TRUNCATE where the database has it)
+    rather than deleting rows one model at a time.
+    """
+    if django.VERSION >= (3, 1):
+        statements = connection.ops.sql_flush(no_style(), _table_names(), reset_sequences=False, allow_cascade=False)
+    else:
+        statements = connection.ops.sql_flush(no_style(), _table_names(), sequences=[], allow_cascade=False)
+    with write_transaction():
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+def vacuum():
+    """
+    Return the space freed by clear_term to the filesystem. Must be run outside a transaction.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+        elif connection.vendor == 'postgresql':
+            for table in _table_names():
+                cursor.execute('VACUUM ANALYZE {}'.format(connection.ops.quote_name(table)))
+
+def roll_over_term(path):
+    """
+    Archive the term's questions and answers to path and then clear them, in one transaction.
+    The archive only appears at path if that transaction commits. Returns the number of rows archived.
+    """
+    temporary_path = path + '.tmp'
+    try:
+        with write_transaction():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('LOCK TABLE {} IN EXCLUSIVE MODE'.format(
+                        ', '.join(connection.ops.quote_name(table) for table in _table_names())))
+            count = _write_fixture(temporary_path)
+            clear_term()
+    except BaseException:
+        _remove_if_exists(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+    logger.info('archived %d rows to %s', count, path)
+    return count
@@ -1,8 +1,14 @@
-from django.test import Client, TestCase
+from django.db import transaction
+from django.test import Client, TestCase, TransactionTestCase
 
 from .models import *
+from .models import _get_cache_givens_to_ask, _random_excluding
+from .analysis import apply_trace_with_checkpoints, geometries_within, read_trace, resume_trace, simulate_sharded, stack_distances, sweep
 
+import io
+import math
 import random
+import tempfile
 
 import logging
 
@@ -17,7 +23,7 @@ class PatternQuestionTest(TestCase):
             block_size=1,
             address_bits=1,
         )
-        pattern = PatternQuestion.random(parameters, 'test',
+        pattern = PatternQuestion.random(parameters, get_user('test'),
             num_accesses=6,
             start_actions=['random_miss', 'random_miss', 'conflict_miss', 'hit', 'random_miss', 'conflict_miss'],
             )
@@ -40,7 +46,7 @@ class PatternQuestionTest(TestCase):
                                 logger.info("starting a subtest")
                                 desired_actions = ['random_miss'] + (['setup_conflict_aggressive'] * (ways)) + ['conflict_miss'] + \
                                                     ['hit', 'random_miss', 'conflict_miss', 'hit', 'hit']
-                                question = PatternQuestion.random(parameters, 'test',
+                                question = PatternQuestion.random(parameters, get_user('test'),
                                     num_accesses=len(desired_actions) if not is_huge else 1000,
                                     start_actions=desired_actions
                                     )
@@ -56,15 +62,232 @@ class PatternQuestionTest(TestCase):
                                     if expect_type == 'conflict_miss':
                                         self.assertTrue(result.evicted.value != None)
 
+    def test_generate_large(self):
+        parameters = CacheParameters.get(num_ways=2, num_sets=8, block_size=4, address_bits=12)
+        random.seed(1)
+        pattern = CachePattern.random(parameters, num_accesses=20000, chance_setup_conflict_aggressive=0.5, chance_miss_prefer_empty=0.5)
+        self.assertEqual(len(pattern.accesses), 20000)
+        for access, result in zip(pattern.accesses, pattern.access_results):
+            if 'miss' in access.kind or 'setup_conflict' in access.kind:
+                self.assertFalse(result.hit.value)
+            elif access.kind == 'hit':
+                self.assertTrue(result.hit.value)
 
+    def test_random_excluding(self):
+        random.seed(2)
+        excluded = [0, 1, 5, 6, 9]
+        seen = set(_random_excluding(10, excluded) for _ in range(500))
+        self.assertEqual(seen, set([2, 3, 4, 7, 8]))
 
-def login_as(client, username):
+
+def _reference_lru_results(parameters, addresses):
+    sets = [[] for _ in range(parameters.num_sets)]
+    results = []
+    for address in addresses:
+        (tag, index, offset) = parameters.split_address(address)
+        ways = sets[index]
+        evicted = None
+        if tag in ways:
+            hit = True
+            ways.remove(tag)
+        else:
+            hit = False
+            if len(ways) == parameters.num_ways:
+                evicted = parameters.unsplit_address(ways.pop(0), index, 0)
+        ways.append(tag)
+        results.append((hit, tag, index, offset, evicted))
+    return results
+
+class CacheStateTest(TestCase):
+    def test_matches_reference_lru(self):
+        for ways in [1, 2, 3, 5]:
+            for index_bits in [0, 1, 3]:
+                parameters = CacheParameters.get(num_ways=ways, num_sets=1<<index_bits, block_size=4, address_bits=10)
+                with self.subTest(ways=ways, index_bits=index_bits):
+                    random.seed(ways * 10 + index_bits)
+                    addresses = [random.randrange(0, 1 << 10) for _ in range(500)]
+                    state = CacheState(parameters)
+                    actual = [state.apply_access(CacheAccess(address)) for address in addresses]
+                    expected = _reference_lru_results(parameters, addresses)
+                    for (hit, tag, index, offset, evicted), result in zip(expected, actual):
+                        self.assertEqual(result, CacheAccessResult.from_reference(hit, tag, index, offset, evicted,
+                            tag_bits=parameters.tag_bits, index_bits=parameters.index_bits,
+                            offset_bits=parameters.offset_bits, address_bits=parameters.address_bits))
+
+    def test_json_round_trip(self):
+        parameters = CacheParameters.get(num_ways=3, num_sets=4, block_size=4, address_bits=10)
+        random.seed(42)
+        addresses = [random.randrange(0, 1 << 10) for _ in range(200)]
+        state = CacheState(parameters)
+        for address in addresses[:100]:
+            state.apply_access(CacheAccess(address))
+        restored = CacheState.from_json(parameters, state.to_json())
+        self.assertEqual(restored.to_json(), state.to_json())
+        for address in addresses[100:]:
+            self.assertEqual(restored.apply_access(CacheAccess(address)), state.apply_access(CacheAccess(address)))
+
+    def test_apply_trace_matches_apply_access(self):
+        parameters = CacheParameters.get(num_ways=3, num_sets=8, block_size=8, address_bits=12)
+        random.seed(7)
+        addresses = [random.randrange(0, 1 << 12) for _ in range(1000)]
+        trace_state = CacheState(parameters)
+        trace = trace_state.apply_trace(addresses)
+        state = CacheState(parameters)
+        expected = [state.apply_access(CacheAccess(address)) for address in addresses]
+        self.assertEqual(trace.to_results(parameters), expected)
+        self.assertEqual(trace.num_hits, sum(1 for result in expected if result.hit.value))
+        self.assertEqual(trace_state.to_json(), state.to_json())
+
+    def test_sparse_matches_dense(self):
+        parameters = CacheParameters.get(num_ways=2, num_sets=64, block_size=4, address_bits=12)
+        random.seed(11)
+        addresses = [random.randrange(0, 1 << 12) for _ in range(300)]
+        dense = CacheState(parameters, sparse=False)
+        sparse = CacheState(parameters, sparse=True)
+        for address in addresses:
+            self.assertEqual(sparse.apply_access(CacheAccess(address)), dense.apply_access(CacheAccess(address)))
+        restored = CacheState.from_json(parameters, sparse.to_json())
+        self.assertTrue(restored.sparse)
+        self.assertEqual(restored.to_json(), sparse.to_json())
+        for index, row in restored.to_sparse_entries():
+            self.assertEqual(list(map(vars, row)), list(map(vars, dense.to_entries()[index])))
+        self.assertEqual([list(map(vars, row)) for row in restored.to_entries()],
+                         [list(map(vars, row)) for row in dense.to_entries()])
+
+    def test_sparse_huge_geometry(self):
+        parameters = CacheParameters.get(num_ways=12, num_sets=1 << 24, block_size=256, address_bits=64)
+        state = CacheState(parameters)
+        self.assertTrue(state.sparse)
+        state.apply_access(CacheAccess(0x12345678))
+        state.apply_access(CacheAccess(0x12345678))
+        state.apply_access(CacheAccess(0xabcdef0000))
+        self.assertEqual(len(json.loads(state.to_json())['sets']), 2)
+        self.assertEqual(list(state.materialized_indices()), sorted([0x123456, 0xcdef00]))
+        self.assertEqual([index for index, _ in state.to_sparse_entries()], sorted([0x123456, 0xcdef00]))
+        with self.assertRaises(ValueError):
+            state.to_entries()
+
+    def test_snapshot_round_trip(self):
+        for parameters, sparse in [
+                (CacheParameters(num_ways=3, num_sets=8, block_size=4, address_bits=12), False),
+                (CacheParameters(num_ways=4, num_sets=1 << 20, block_size=4, address_bits=32), True)]:
+            with self.subTest(sparse=sparse):
+                random.seed(13)
+                addresses = [random.randrange(0, 1 << 24) for _ in range(400)]
+                state = CacheState(parameters)
+                self.assertEqual(state.sparse, sparse)
+                state.apply_trace(addresses[:200], [True] * 200)
+                snapshot = state.to_snapshot()
+                restored = CacheState.from_snapshot(parameters, snapshot)
+                self.assertEqual(restored.to_json(), state.to_json())
+                self.assertEqual(restored.apply_trace(addresses[200:]).to_results(parameters),
+                    state.apply_trace(addresses[200:]).to_results(parameters))
+        with self.assertRaises(ValueError):
+            CacheState.from_snapshot(CacheParameters(num_ways=2, num_sets=1 << 20, block_size=4, address_bits=32), snapshot)
+
+    def test_dry_run_does_not_change_state(self):
+        parameters = CacheParameters.get(num_ways=2, num_sets=1, block_size=1, address_bits=8)
+        state = CacheState(parameters)
+        state.apply_access(CacheAccess(0x10))
+        state.apply_access(CacheAccess(0x20))
+        before = state.to_json()
+        result = state.apply_access(CacheAccess(0x30), dry_run=True)
+        self.assertEqual(result.evicted.value, 0x10)
+        self.assertEqual(state.to_json(), before)
+
+class StackDistanceTest(TestCase):
+    def test_matches_simulation_for_every_associativity(self):
+        random.seed(3)
+        addresses = [random.randrange(0, 1 << 11) for _ in range(2000)]
+        for num_sets in [1, 4]:
+            result = stack_distances(addresses, num_sets=num_sets, block_size=8, address_bits=12)
+            for num_ways in range(1, 9):
+                with self.subTest(num_sets=num_sets, num_ways=num_ways):
+                    parameters = CacheParameters(num_ways=num_ways, num_sets=num_sets, block_size=8, address_bits=12)
+                    simulated = CacheState(parameters).apply_trace(addresses)
+                    self.assertEqual(result.hits_for_ways(num_ways), simulated.num_hits)
+            self.assertEqual(result.num_compulsory_misses, len(set(a >> 3 for a in addresses)))
+
+    def test_command(self):
+        from django.core.management import call_command
+        with tempfile.NamedTemporaryFile('w', suffix='.trace') as trace:
+            trace.write('# comment\nR 0x100\nW 0x200\n0x100\n\n')
+            trace.flush()
+            with open(trace.name) as fh:
+                (addresses, writes) = read_trace(fh)
+            self.assertEqual(list(addresses), [0x100, 0x200, 0x100])
+            self.assertEqual(list(writes), [False, True, False])
+            out = io.StringIO()
+            call_command('stack_distance', trace.name, '--sets', '1', '--block-sizes', '16', '--max-ways', '2', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1].split('\t')[:5], ['1', '16', '1', '16', '0'])
+        self.assertEqual(lines[2].split('\t')[:5], ['1', '16', '2', '32', '1'])
+
+class SweepTest(TestCase):
+    def test_matches_simulation(self):
+        random.seed(9)
+        addresses = [random.randrange(0, 1 << 12) for _ in range(1500)]
+        geometries = geometries_within(min_ways=1, max_ways=4, min_sets_log=0, max_sets_log=3,
+            min_block_size_log=1, max_block_size_log=3, max_cache_size=256)
+        self.assertIn((3, 8, 8), geometries)
+        self.assertNotIn((4, 8, 8), geometries)
+        rows = sweep(addresses, geometries, address_bits=12)
+        self.assertEqual(len(rows), len(geometries))
+        for (num_ways, num_sets, block_size, cache_size_bytes, accesses, hits, misses, evictions) in rows:
+            with self.subTest(num_ways=num_ways, num_sets=num_sets, block_size=block_size):
+                parameters = CacheParameters(num_ways=num_ways, num_sets=num_sets, block_size=block_size, address_bits=12)
+                simulated = CacheState(parameters).apply_trace(addresses)
+                self.assertEqual((accesses, hits, misses, evictions),
+                    (len(addresses), simulated.num_hits, simulated.num_misses, simulated.num_evictions))
+
+    def test_command_csv(self):
+        from django.core.management import call_command
+        with tempfile.NamedTemporaryFile('w', suffix='.trace') as trace:
+            trace.write('0\n40\n0\n80\n')
+            trace.flush()
+            out = io.StringIO()
+            call_command('cache_sweep', trace.name, '--max-ways', '2', '--max-sets-log', '0',
+                '--min-block-size-log', '6', '--max-block-size-log', '6', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'num_ways,num_sets,block_size,cache_size_bytes,accesses,hits,misses,evictions')
+        self.assertEqual(lines[1:], ['1,1,64,64,4,0,4,3', '2,1,64,128,4,1,3,1'])
+
+class CheckpointTest(TestCase):
+    def test_resume_replays_remaining(self):
+        parameters = CacheParameters(num_ways=2, num_sets=8, block_size=4, address_bits=12)
+        random.seed(17)
+        addresses = [random.randrange(0, 1 << 12) for _ in range(1000)]
+        full = CacheState(parameters).apply_trace(addresses)
+        with tempfile.TemporaryDirectory() as directory:
+            # simulate a run that was interrupted after 650 accesses
+            apply_trace_with_checkpoints(CacheState(parameters), addresses[:650], directory=directory, interval=300)
+            (position, state, result) = resume_trace(parameters, addresses, directory=directory, interval=300)
+        self.assertEqual(position, 650)
+        self.assertEqual(len(result), 350)
+        self.assertEqual(result.to_results(parameters), full.to_results(parameters)[650:])
+
+class ShardedSimulationTest(TestCase):
+    def test_matches_serial(self):
+        parameters = CacheParameters(num_ways=2, num_sets=16, block_size=4, address_bits=12)
+        random.seed(5)
+        addresses = [random.randrange(0, 1 << 12) for _ in range(3000)]
+        writes = [random.random() < 0.3 for _ in addresses]
+        serial = CacheState(parameters).apply_trace(addresses, writes)
+        sharded = simulate_sharded(parameters, addresses, writes, num_shards=3, max_workers=2)
+        self.assertEqual(sharded.to_results(parameters), serial.to_results(parameters))
+        self.assertEqual(sharded.num_evictions, serial.num_evictions)
+
+def get_user(username):
     from django.contrib.auth.models import User
     try:
-        account = User.objects.get(username=username)
+        return User.objects.get(username=username)
     except User.DoesNotExist:
-        account = User.objects.create_user(username)
+        return User.objects.create_user(username)
+
+def login_as(client, username):
+    account = get_user(username)
     client.force_login(account) 
+    return account
 
 class PatternEvaluateTest(TestCase):
     def test_evaluate_simple(self):
@@ -97,6 +320,687 @@ class PatternEvaluateTest(TestCase):
             self.assertEquals(expected.offset.value, actual.offset.value)
             self.assertEquals(expected.evicted.value, actual.evicted.value)
 
+class PatternStoredResultsTest(TestCase):
+    def _make_pattern(self):
+        pattern = CachePattern()
+        pattern.parameters = CacheParameters.get(num_ways=2,num_sets=4,block_size=4,address_bits=8)
+        pattern.accesses = [CacheAccess(0x10), CacheAccess(0x50), CacheAccess(0x90), CacheAccess(0x10), CacheAccess(0x54)]
+        pattern.save()
+        return pattern
+
+    def test_loads_without_simulating(self):
+        pattern = self._make_pattern()
+        expected = pattern.access_results
+        from unittest import mock
+        with mock.patch.object(CacheState, 'apply_access', side_effect=AssertionError('simulated')):
+            loaded = CachePattern.objects.get(pattern_id=pattern.pattern_id)
+            self.assertEqual(loaded.access_results, expected)
+            self.assertEqual(loaded.final_state.to_json(), pattern.final_state.to_json())
+        self.assertEqual([r.evicted.value for r in expected], [None, None, 0x10, 0x50, None])
+
+    def test_accesses_encoding(self):
+        accesses = [CacheAccess(0x123, size=2, kind='random_miss'), CacheAccess(0x20, size=2, kind='hit'),
+                    CacheAccess((1 << 64) - 2, size=4, kind='hit'), CacheAccess(0, size=1)]
+        raw = pack_accesses(accesses)
+        self.assertLess(len(raw), len(json.dumps([a.as_dump() for a in accesses])))
+        unpacked = unpack_accesses(raw)
+        self.assertEqual([a.as_dump() for a in unpacked], [a.as_dump() for a in accesses])
+        self.assertEqual(unpack_accesses(json.dumps([a.as_dump() for a in accesses]))[2].address, (1 << 64) - 2)
+
+    def test_old_accesses_rows_and_memoization(self):
+        pattern = self._make_pattern()
+        CachePattern.objects.filter(pattern_id=pattern.pattern_id).update(
+            accesses_raw=json.dumps([CacheAccess(0x10).as_dump(), CacheAccess(0x50).as_dump()]))
+        loaded = CachePattern.objects.get(pattern_id=pattern.pattern_id)
+        self.assertEqual(loaded.accesses, [CacheAccess(0x10), CacheAccess(0x50)])
+        self.assertIs(loaded.accesses, loaded.accesses)
+        loaded.accesses = [CacheAccess(0x90)]
+        self.assertEqual(loaded.accesses, [CacheAccess(0x90)])
+        self.assertEqual(len(loaded.access_results), 1)
+
+    def test_recomputes_stale_version(self):
+        pattern = self._make_pattern()
+        CachePattern.objects.filter(pattern_id=pattern.pattern_id).update(results_version=0, expected_results_raw='')
+        loaded = CachePattern.objects.get(pattern_id=pattern.pattern_id)
+        with self.assertNumQueries(1):
+            # only the parameters; reading does not write the results back
+            self.assertEqual(loaded.access_results, pattern.access_results)
+        self.assertEqual(CachePattern.objects.get(pattern_id=pattern.pattern_id).results_version, 0)
+        self.assertEqual(CachePattern.update_stale_results(), 1)
+        self.assertEqual(CachePattern.update_stale_results(), 0)
+        stored = CachePattern.objects.get(pattern_id=pattern.pattern_id)
+        self.assertEqual(stored.results_version, SIMULATOR_VERSION)
+        self.assertEqual(stored.access_results, pattern.access_results)
+
+class CacheParametersGetTest(TransactionTestCase):
+    def setUp(self):
+        CacheParameters.clear_cache()
+
+    def tearDown(self):
+        CacheParameters.clear_cache()
+
+    def test_get_is_cached_and_shared(self):
+        first = CacheParameters.get(num_ways=2, num_sets=4, block_size=8, address_bits=12)
+        with self.assertNumQueries(0):
+            second = CacheParameters.get(num_ways=2, num_sets=4, block_size=8, address_bits=12)
+        self.assertIs(first, second)
+        CacheParameters.clear_cache()
+        self.assertEqual(CacheParameters.get(num_ways=2, num_sets=4, block_size=8, address_bits=12).pk, first.pk)
+        self.assertEqual(CacheParameters.objects.count(), 1)
+
+    def test_rolled_back_rows_are_not_cached(self):
+        from django.db import transaction
+        try:
+            with transaction.atomic():
+                CacheParameters.get(num_ways=3, num_sets=4, block_size=8, address_bits=12)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(CacheParameters.objects.count(), 0)
+        CacheParameters.get(num_ways=3, num_sets=4, block_size=8, address_bits=12)
+        self.assertEqual(CacheParameters.objects.count(), 1)
+
+class CacheParameterSpaceTest(TransactionTestCase):
+    def setUp(self):
+        CacheParameters.clear_cache()
+
+    def tearDown(self):
+        CacheParameters.clear_cache()
+
+    def test_sample_within_bounds(self):
+        seen = set()
+        for _ in range(200):
+            p = CacheParameters.random(min_ways=1, max_ways=4, min_sets_log=0, max_sets_log=3, min_block_size_log=1,
+                                       max_block_size_log=2, min_address_bits=8, max_address_bits=16,
+                                       address_bits_rounding=4, max_cache_size=64)
+            self.assertTrue(1 <= p.num_ways <= 4)
+            self.assertIn(p.num_sets, [1, 2, 4, 8])
+            self.assertIn(p.block_size, [2, 4])
+            self.assertLess(p.num_ways * p.num_sets * p.block_size, 64)
+            self.assertEqual(p.address_bits % 4, 0)
+            self.assertTrue(8 <= p.address_bits <= 16)
+            self.assertGreaterEqual(p.tag_bits, int(math.log2(p.num_ways)) + 1)
+            seen.add((p.num_ways, p.num_sets, p.block_size))
+        space = CacheParameterSpace(1, 4, 0, 3, 1, 2, 8, 16, 4, 1, 64)
+        self.assertEqual(seen, set(c[:3] for c in space.choices))
+
+    def test_empty_space(self):
+        with self.assertRaises(ValueError):
+            CacheParameterSpace(4, 4, 4, 4, 4, 4, 8, 8, 8, 1, 1024)
+
+    def test_preload_shares_rows(self):
+        first = random_parameters_for_pattern()
+        space = CacheParameterSpace(2, 3, 3, 6, 2, 3, 12, 12, 4, 1, 128 * 1024 * 1024)
+        self.assertEqual(CacheParameters.objects.count(), len(space.geometries()))
+        with self.assertNumQueries(0):
+            for _ in range(20):
+                random_parameters_for_pattern()
+        self.assertEqual(CacheParameters.objects.count(), len(space.geometries()))
+
+    def test_preload_retried_after_rollback(self):
+        space = CacheParameterSpace(2, 3, 3, 6, 2, 3, 12, 12, 4, 1, 128 * 1024 * 1024)
+        try:
+            with transaction.atomic():
+                space.sample()
+                raise RuntimeError('simulated')
+        except RuntimeError:
+            pass
+        self.assertFalse(space.preloaded)
+        self.assertEqual(CacheParameters.objects.count(), 0)
+        space.sample()
+        self.assertTrue(space.preloaded)
+        self.assertEqual(CacheParameters.objects.count(), len(space.geometries()))
+
+class QuestionPoolTest(TestCase):
+    def test_new_questions_claim_from_pool(self):
+        QuestionPoolEntry.fill(QuestionPoolEntry.PATTERN, 2)
+        QuestionPoolEntry.fill(QuestionPoolEntry.PARAMETER, 2)
+        self.assertEqual(QuestionPoolEntry.fill(QuestionPoolEntry.PATTERN, 2), 0)
+        pooled_patterns = set(QuestionPoolEntry.objects.filter(kind=QuestionPoolEntry.PATTERN).values_list('pattern_id', flat=True))
+        c = Client()
+        login_as(c, 'test')
+        c.post('/new-pattern-question')
+        c.post('/new-parameter-question')
+        self.assertIn(PatternQuestion.last_for_user(get_user('test')).pattern_id, pooled_patterns)
+        self.assertEqual(QuestionPoolEntry.objects.filter(kind=QuestionPoolEntry.PATTERN).count(), 1)
+        self.assertEqual(QuestionPoolEntry.objects.filter(kind=QuestionPoolEntry.PARAMETER).count(), 1)
+        self.assertEqual(ParameterQuestion.last_for_user(get_user('test')).index, 0)
+
+    def test_empty_pool_generates(self):
+        question = PatternQuestion.generate_new(get_user('test'))
+        self.assertEqual(question.index, 0)
+        self.assertEqual(PatternQuestion.generate_new(get_user('test')).index, 1)
+        self.assertEqual(QuestionPoolEntry.claim(QuestionPoolEntry.PARAMETER), None)
+
+    def test_failed_creation_keeps_entry(self):
+        from unittest import mock
+        QuestionPoolEntry.fill(QuestionPoolEntry.PATTERN, 1)
+        with mock.patch.object(PatternQuestion, 'save', side_effect=RuntimeError('simulated')):
+            with self.assertRaises(RuntimeError):
+                PatternQuestion.generate_new(get_user('test'))
+        self.assertEqual(QuestionPoolEntry.objects.filter(kind=QuestionPoolEntry.PATTERN).count(), 1)
+
+class UserProgressTest(TestCase):
+    def _answer_parameter_question(self, c, correct):
+        question = ParameterQuestion.generate_new(get_user('test'))
+        answers = {item: str(question.find_cache_property(item)) for item in question.missing_parts}
+        if not correct:
+            answers[question.missing_parts[0]] = '12345678'
+        c.post('/submit-parameter-answer/{}'.format(question.question_id), answers)
+
+    def _assert_matches_rebuild(self):
+        progress = UserProgress.objects.get(user=get_user('test'))
+        rebuilt = UserProgress.rebuild(get_user('test').id)
+        for field in ['last_parameter_question_id', 'last_parameter_in_progress', 'last_pattern_question_id',
+                      'last_pattern_in_progress', 'parameter_complete', 'pattern_complete',
+                      'best_parameter_scores', 'best_pattern_score', 'best_pattern_max_score']:
+            self.assertEqual(getattr(progress, field), getattr(rebuilt, field), field)
+
+    def test_parameter_progress(self):
+        c = Client()
+        login_as(c, 'test')
+        self._answer_parameter_question(c, False)
+        self._assert_matches_rebuild()
+        for _ in range(3):
+            self._answer_parameter_question(c, True)
+        question = ParameterQuestion.generate_new(get_user('test'))
+        c.post('/submit-parameter-answer/{}'.format(question.question_id), {'is_save': '1'})
+        progress = UserProgress.objects.get(user=get_user('test'))
+        self.assertEqual(progress.parameter_complete, 4)
+        self.assertEqual(progress.parameter_perfect_count, 3)
+        self.assertTrue(progress.parameter_perfect)
+        self.assertTrue(progress.last_parameter_in_progress)
+        self._assert_matches_rebuild()
+
+    def test_pattern_progress(self):
+        c = Client()
+        login_as(c, 'test')
+        question = PatternQuestion.random(random_parameters_for_pattern(), get_user('test'))
+        self.assertTrue(UserProgress.objects.get(user=get_user('test')).last_pattern_in_progress)
+        answer = PatternAnswer(question=question, user=get_user('test'), was_complete=True)
+        answer.access_results = question.pattern.access_results
+        answer.save()
+        progress = UserProgress.objects.get(user=get_user('test'))
+        self.assertFalse(progress.last_pattern_in_progress)
+        self.assertEqual(progress.pattern_complete, 1)
+        self.assertTrue(progress.pattern_perfect)
+        self._assert_matches_rebuild()
+
+    def test_index_reads_summary(self):
+        c = Client()
+        login_as(c, 'test')
+        self._answer_parameter_question(c, True)
+        c.get('/')
+        # the session and user come from the cache, leaving just the summary row
+        with self.assertNumQueries(1):
+            response = c.get('/')
+        self.assertEqual(response.context['parameter_complete'], 1)
+        self.assertEqual(response.context['parameter_perfect_count'], 1)
+
+    def test_forget_rebuilds(self):
+        c = Client()
+        login_as(c, 'test')
+        session = c.session
+        session['is_staff'] = True
+        session.save()
+        self._answer_parameter_question(c, True)
+        c.post('/forget-questions')
+        self.assertEqual(c.get('/').context['parameter_complete'], 0)
+        c.post('/unforget-questions')
+        self.assertEqual(c.get('/').context['parameter_complete'], 1)
+
+    def test_forget_hides_history(self):
+        c = Client()
+        user = login_as(c, 'test')
+        session = c.session
+        session['is_staff'] = True
+        session.save()
+        for _ in range(3):
+            self._answer_parameter_question(c, True)
+        old_question = ParameterQuestion.last_for_user(user)
+        pattern_question = PatternQuestion.generate_new(user)
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        other = get_user('other')
+        with CaptureQueriesContext(connection) as empty_history:
+            UserHistory.forget(other.id)
+        with self.assertNumQueries(len(empty_history)):
+            UserHistory.forget(user.id)
+        self.assertEqual(ParameterQuestion.last_for_user(user), None)
+        self.assertEqual(PatternQuestion.last_for_user(user), None)
+        self.assertEqual(c.get('/parameter-question/{}'.format(old_question.question_id)).status_code, 403)
+        self.assertEqual(c.get('/pattern-question/{}'.format(pattern_question.question_id)).status_code, 403)
+        self.assertFalse(c.get('/').context['parameter_perfect'])
+        self._answer_parameter_question(c, True)
+        new_question = ParameterQuestion.last_for_user(user)
+        self.assertEqual(new_question.index, old_question.index + 1)
+        self.assertEqual(c.get('/').context['parameter_complete'], 1)
+        c.post('/unforget-questions')
+        response = c.get('/')
+        self.assertEqual(response.context['parameter_complete'], 4)
+        self.assertTrue(response.context['parameter_perfect'])
+        self.assertEqual(ParameterQuestion.last_for_user(user), new_question)
+        self.assertEqual(c.get('/pattern-question/{}'.format(pattern_question.question_id)).status_code, 200)
+
+class TermRolloverTest(TestCase):
+    def test_archive_and_restore(self):
+        import os
+        from django.core.management import CommandError, call_command
+        user = get_user('test')
+        question = PatternQuestion.random(random_parameters_for_pattern(), user)
+        answer = PatternAnswer(question=question, user=user, was_complete=True)
+        answer.access_results = question.pattern.access_results
+        answer.save()
+        ParameterQuestion.generate_new(user)
+        QuestionPoolEntry.fill(QuestionPoolEntry.PATTERN, 1)
+        UserHistory.forget(user.id)
+        num_parameters = CacheParameters.objects.count()
+        counts = {model: model.objects.count() for model in [CachePattern, PatternQuestion, PatternAnswer, ParameterQuestion, UserHistory]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'term.json.gz')
+            out = io.StringIO()
+            call_command('roll_over_term', path, '--no-vacuum', stdout=out)
+            for model in list(counts.keys()) + [QuestionPoolEntry, UserProgress]:
+                self.assertEqual(model.objects.count(), 0)
+            self.assertEqual(CacheParameters.objects.count(), num_parameters)
+            with self.assertRaises(CommandError):
+                call_command('roll_over_term', path, '--no-vacuum', stdout=out)
+            call_command('loaddata', path, verbosity=0)
+        for model, count in counts.items():
+            self.assertEqual(model.objects.count(), count)
+        restored = PatternAnswer.objects.get(pk=answer.pk)
+        self.assertEqual(restored.score, answer.score)
+        self.assertEqual(restored.question.pattern.accesses, question.pattern.accesses)
+        self.assertEqual(PatternQuestion.last_for_user(user), None)
+
+    def test_failed_clear_leaves_no_archive(self):
+        import os
+        import quiz.term
+        from unittest import mock
+        ParameterQuestion.generate_new(get_user('test'))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'term.json.gz')
+            with mock.patch.object(quiz.term, 'clear_term', side_effect=RuntimeError('simulated')):
+                with self.assertRaises(RuntimeError):
+                    quiz.term.roll_over_term(path)
+            self.assertEqual(os.listdir(directory), [])
+        self.assertEqual(ParameterQuestion.objects.count(), 1)
+
+class SQLiteBackendTest(TestCase):
+    def test_pragmas(self):
+        import os
+        from django.db import connection
+        from cachelabweb.sqlite3.base import DatabaseWrapper
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(connection.settings_dict)
+            settings_dict['NAME'] = os.path.join(directory, 'test.sqlite3')
+            wrapper = DatabaseWrapper(settings_dict)
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)
+            finally:
+                wrapper.close()
+
+    def test_invalid_pragmas(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from cachelabweb.sqlite3.base import pragma_statements
+        self.assertEqual(pragma_statements({'cache_size': -64, 'temp_store': 'MEMORY'}),
+                         ['PRAGMA cache_size = -64', 'PRAGMA temp_store = MEMORY'])
+        for pragmas in [{'journal_mode; DROP TABLE x': 'WAL'}, {'journal_mode': 'WAL; DROP TABLE x'}, {'mmap_size': 1.5}]:
+            with self.assertRaises(ImproperlyConfigured):
+                pragma_statements(pragmas)
+
+class WriteTransactionTest(TransactionTestCase):
+    def _begins(self, block):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            with block():
+                UserHistory.current_epoch(get_user('test').id)
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith('BEGIN')]
+
+    def test_only_write_transactions_begin_immediate(self):
+        from django.db import connection
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        self.assertEqual(self._begins(write_transaction), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self._begins(transaction.atomic), ['BEGIN'])
+        self.assertFalse(connection.begin_immediate)
+
+class BackupTest(TransactionTestCase):
+    def _count_in(self, path):
+        import sqlite3
+        db = sqlite3.connect(path)
+        try:
+            return db.execute('SELECT COUNT(*) FROM quiz_parameterquestion').fetchone()[0]
+        finally:
+            db.close()
+
+    def test_incremental_backups(self):
+        import datetime
+        import os
+        from quiz.backup import backup, list_snapshots, restore
+        user = get_user('test')
+        start = datetime.datetime(2018, 3, 29, 1, 0, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            names = []
+            for i in range(5):
+                ParameterQuestion.generate_new(user)
+                names.append(backup(directory, full_every=2, keep_full=2, pages_per_step=1,
+                                    now=start + datetime.timedelta(minutes=i)))
+            self.assertEqual([name.split('-')[0] for name in names], ['full', 'incremental', 'full', 'incremental', 'full'])
+            # the oldest chain was rotated away
+            self.assertEqual([name for _, _, name in list_snapshots(directory)], names[2:])
+            restored = os.path.join(directory, 'restored.sqlite3')
+            restore(directory, restored)
+            self.assertEqual(self._count_in(restored), 5)
+            restore(directory, restored, time=(start + datetime.timedelta(minutes=3)).strftime('%Y%m%dT%H%M%S'))
+            self.assertEqual(self._count_in(restored), 4)
+            with self.assertRaises(ValueError):
+                restore(directory, restored, time='20180101T000000')
+            # only hashes of the newest snapshot are kept, not a copy of it
+            self.assertEqual(sorted(os.listdir(directory)), sorted(names[2:] + ['latest.hashes', 'restored.sqlite3']))
+
+    def test_names_are_utc(self):
+        import datetime
+        from quiz.backup import backup
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        with tempfile.TemporaryDirectory() as directory:
+            name = backup(directory, now=datetime.datetime(2018, 3, 29, 20, 30, 0, tzinfo=eastern))
+            self.assertEqual(name, 'full-20180330T013000.sqlite3.gz')
+            self.assertTrue(backup(directory).startswith('incremental-'))
+
+    def test_keep_full_at_least_one(self):
+        import os
+        from quiz.backup import backup, rotate
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                backup(directory, keep_full=0)
+            self.assertEqual(os.listdir(directory), [])
+            with self.assertRaises(ValueError):
+                rotate(directory, 0)
+
+class CachedAuthTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_tests_use_local_cache(self):
+        from django.conf import settings
+        self.assertEqual(settings.CACHES['default']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+
+    def test_sessions_from_before_cached_backend(self):
+        c = Client()
+        c.force_login(get_user('test'), backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(c.get('/').status_code, 200)
+
+    def test_forwarded_login_uses_cached_backend(self):
+        from django.contrib.auth import BACKEND_SESSION_KEY
+        c = Client()
+        session = c.session
+        session['allowed_logins'] = ['test']
+        session.save()
+        c.post('/login', {'username': 'test'})
+        self.assertEqual(c.session[BACKEND_SESSION_KEY], 'quiz.auth.CachedModelBackend')
+        self.assertEqual(c.get('/').status_code, 200)
+
+    def test_user_cache_invalidated_on_save(self):
+        from quiz.auth import CachedModelBackend
+        user = get_user('test')
+        backend = CachedModelBackend()
+        self.assertEqual(backend.get_user(user.id).username, 'test')
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(user.id).username, 'test')
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(backend.get_user(user.id).username, 'renamed')
+        user_id = user.id
+        user.delete()
+        self.assertEqual(backend.get_user(user_id), None)
+
+class QuestionPageCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_pattern_rows_cached_until_new_answer(self):
+        from unittest import mock
+        c = Client()
+        user = login_as(c, 'test')
+        question = PatternQuestion.random(random_parameters_for_pattern(), user)
+        with mock.patch('quiz.views.CacheAccessResult.empty', wraps=CacheAccessResult.empty) as empty:
+            first = c.get('/pattern-question')
+            self.assertEqual(empty.call_count, 1)
+            second = c.get('/pattern-question')
+            self.assertEqual(empty.call_count, 1)
+            c.post('/submit-pattern-answer/{}'.format(question.question_id), {'is_save': '1', 'access_tag_{}'.format(question.give_first): '1f'})
+            third = c.get('/pattern-question')
+        self.assertIn(b'value="1f"', third.content)
+        self.assertNotIn(b'value="1f"', second.content)
+
+class ScoresCsvTest(TestCase):
+    def _parameter_answer(self, user, score):
+        question = ParameterQuestion.generate_new(get_user(user))
+        answers = {item: str(question.find_cache_property(item)) for item in question.missing_parts}
+        for item in question.missing_parts[:len(question.missing_parts) - score]:
+            answers[item] = '12345678'
+        answer = ParameterAnswer(question=question, user=get_user(user))
+        answer.set_answer_from_post(answers)
+        answer.was_save = False
+        answer.save()
+        return answer
+
+    def test_scores_for_several_due_dates(self):
+        import csv
+        import datetime
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        for user in ['alice', 'bob', 'carol']:
+            User.objects.create_user(user)
+        alice_low = self._parameter_answer('alice', 1)
+        alice_high = self._parameter_answer('alice', 4)
+        bob_parameter = self._parameter_answer('bob', 3)
+        question = PatternQuestion.random(random_parameters_for_pattern(), get_user('bob'))
+        answer = PatternAnswer(question=question, user=get_user('bob'), was_complete=True)
+        answer.access_results = question.pattern.access_results
+        answer.save()
+        early = timezone.now() - datetime.timedelta(days=1)
+        ParameterAnswer.objects.filter(user=get_user('alice'), score=1).update(submit_time=early)
+        due_strings = [
+            (early + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M%z'),
+            (timezone.now() + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M%z'),
+        ]
+        c = Client()
+        login_as(c, 'staff')
+        session = c.session
+        session['is_staff'] = True
+        session.save()
+        response = c.get('/scores.csv', {'due': due_strings})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows[0]), 7)
+        by_user = {row[0]: row[1:] for row in rows[1:]}
+        self.assertEqual(set(by_user.keys()), set(['alice', 'bob', 'carol', 'staff']))
+        self.assertEqual(by_user['carol'], ['', '(none)', '0.0'] * 2)
+        self.assertEqual(by_user['alice'][0], '1/{}'.format(alice_low.max_score))
+        self.assertEqual(by_user['alice'][3], '4/{} and 1/{}'.format(alice_high.max_score, alice_low.max_score))
+        self.assertEqual(by_user['bob'][:2], ['', '(none)'])
+        self.assertEqual(by_user['bob'][4], '{}/{}'.format(answer.score, answer.max_score))
+        self.assertEqual(by_user['bob'][5], '{:.1f}'.format((3.0 / bob_parameter.max_score / 3.0 + 1.0) / 2.0 * 10.0))
+        for due, offset in zip(due_strings, [0, 3]):
+            single = c.get('/scores.csv', {'due': due})
+            single_rows = list(csv.reader(io.StringIO(b''.join(single.streaming_content).decode())))
+            self.assertEqual(single_rows[0], ['compid', 'parameter scores', 'pattern score', 'lab score [10]'])
+            self.assertEqual({row[0]: row[1:] for row in single_rows[1:]}, {user: row[offset:offset + 3] for user, row in by_user.items()})
+
+    def test_best_answers_ranked_in_one_query(self):
+        from django.utils import timezone
+        for score in [2, 4, 1, 3]:
+            self._parameter_answer('alice', score)
+        self._parameter_answer('bob', 2)
+        with self.assertNumQueries(1):
+            best = ParameterAnswer.best_K_for_all_users_by_times(3, [timezone.now()])
+        for user in ['alice', 'bob']:
+            expected = ParameterAnswer.best_K_for_user_by_time(get_user(user), 3, timezone.now())
+            self.assertEqual(best[get_user(user).id][0], [(answer.score, answer.max_score) for answer in expected])
+        self.assertEqual(len(best[get_user('bob').id][0]), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(PatternAnswer.best_complete_for_all_users_by_times([timezone.now()]), {})
+
+class UserMigrationTest(TransactionTestCase):
+    BEFORE = [('quiz', '0011_userprogress')]
+
+    def _migrate(self, targets):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+        executor = MigrationExecutor(connection)
+        if targets == None:
+            targets = executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        self.old_apps = self._migrate(self.BEFORE)
+
+    def tearDown(self):
+        self._migrate(None)
+
+    def _old_parameter_answer(self, for_user, index):
+        CacheParameters = self.old_apps.get_model('quiz', 'CacheParameters')
+        ParameterQuestion = self.old_apps.get_model('quiz', 'ParameterQuestion')
+        ParameterAnswer = self.old_apps.get_model('quiz', 'ParameterAnswer')
+        (parameters, _) = CacheParameters.objects.get_or_create(num_ways=2, num_sets=4, block_size=8, address_bits=8)
+        question = ParameterQuestion.objects.create(for_user=for_user, parameters=parameters, index=index,
+                                                    missing_parts_raw='["num_ways"]', given_parts_raw='[]')
+        ParameterAnswer.objects.create(for_user=for_user, question=question, answer_raw='{}',
+                                       was_complete=True, was_save=False, score=1, score_ratio=1.0)
+        return question
+
+    def _scores_csv(self):
+        import csv
+        import datetime
+        from django.utils import timezone
+        c = Client()
+        login_as(c, 'staff')
+        session = c.session
+        session['is_staff'] = True
+        session.save()
+        due = (timezone.now() + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M%z')
+        response = c.get('/scores.csv', {'due': due})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        return {row[0]: row[1:] for row in rows[1:]}
+
+    def test_scores_csv_after_migrating(self):
+        from django.contrib.auth.models import User
+        get_user('alice')
+        get_user('bob')
+        for for_user in ['alice', 'guest', 'bob', 'bob+hidden', 'carol+hidden', 'dave']:
+            self._old_parameter_answer(for_user, 0)
+        self._migrate(None)
+        self.assertEqual(set(self._scores_csv().keys()), set(['alice', 'bob', 'staff']))
+        self.assertEqual(ParameterAnswer.objects.filter(user=get_user('guest')).count(), 1)
+        self.assertTrue(get_user('dave').is_active)
+        for username in ['dave', 'bob']:
+            c = Client()
+            session = c.session
+            session['allowed_logins'] = [username]
+            session.save()
+            if username == 'bob':
+                # deactivated by an admin; logging in must not undo that
+                User.objects.filter(username='bob').update(is_active=False)
+            c.post('/login', {'username': username})
+        self.assertFalse(get_user('bob').is_active)
+        self.assertFalse(get_user('dave').has_usable_password())
+        scores = self._scores_csv()
+        self.assertEqual(set(scores.keys()), set(['alice', 'bob', 'dave', 'staff']))
+        self.assertEqual(scores['dave'][0], '1/1')
+
+    def test_fold_hidden_questions(self):
+        get_user('alice')
+        hidden = [self._old_parameter_answer('alice+hidden', index) for index in range(2)]
+        visible = [self._old_parameter_answer('alice', index) for index in range(2)]
+        self._migrate(None)
+        alice = get_user('alice')
+        questions = ParameterQuestion.objects.filter(user=alice)
+        self.assertEqual(sorted(questions.values_list('index', flat=True)), [0, 1, 2, 3])
+        self.assertEqual(ParameterQuestion.last_for_user(alice).question_id, visible[-1].question_id)
+        self.assertEqual(ParameterAnswer.objects.filter(user=alice).count(), 4)
+        self.assertEqual(len(self._scores_csv()['alice'][0].split(' and ')), 2)
+        UserHistory.unforget(alice.id)
+        self.assertEqual(ParameterQuestion.last_for_user(alice).question_id, visible[-1].question_id)
+        self.assertEqual(ParameterQuestion.objects.get(user=alice, index=0).question_id, hidden[0].question_id)
+        self.assertEqual(ParameterQuestion.generate_new(alice).index, 4)
+
+class PatternWindowMigrationTest(TransactionTestCase):
+    BEFORE = [('quiz', '0013_userhistory')]
+    _migrate = UserMigrationTest._migrate
+
+    def setUp(self):
+        self.old_apps = self._migrate(self.BEFORE)
+
+    def tearDown(self):
+        self._migrate(None)
+
+    def test_split_into_windows(self):
+        OldParameters = self.old_apps.get_model('quiz', 'CacheParameters')
+        OldPattern = self.old_apps.get_model('quiz', 'CachePattern')
+        OldQuestion = self.old_apps.get_model('quiz', 'PatternQuestion')
+        OldAnswer = self.old_apps.get_model('quiz', 'PatternAnswer')
+        reference = CachePattern()
+        reference.parameters = CacheParameters(num_ways=2, num_sets=4, block_size=16, address_bits=16)
+        reference.accesses = [CacheAccess((i * 0x130) % 0x1000) for i in range(2 * PATTERN_WINDOW_SIZE + 50)]
+        results = reference.access_results
+        parameters = OldParameters.objects.create(num_ways=2, num_sets=4, block_size=16, address_bits=16)
+        pattern = OldPattern.objects.create(
+            parameters=parameters,
+            accesses_raw=pack_accesses(reference.accesses),
+            expected_results_raw=json.dumps({
+                'hit': [result.hit.value for result in results],
+                'evicted': [result.evicted.value for result in results],
+            }),
+            results_version=SIMULATOR_VERSION,
+        )
+        question = OldQuestion.objects.create(index=0, pattern=pattern, user_id=get_user('test').id, give_first=5)
+        submitted = [CacheAccessResult.empty() for _ in range(PATTERN_WINDOW_SIZE)] + results[PATTERN_WINDOW_SIZE:]
+        OldAnswer.objects.create(
+            question=question, user_id=get_user('test').id, access_results_raw=json.dumps([r.as_dump() for r in submitted]),
+            final_state_raw='', score=(len(results) - PATTERN_WINDOW_SIZE) * 5, max_score=(len(results) - 5) * 5,
+        )
+        self._migrate(None)
+        migrated = CachePattern.objects.get(pattern_id=pattern.pattern_id)
+        self.assertEqual(migrated.num_accesses, len(results))
+        self.assertEqual(migrated.accesses_between(240, 250), reference.accesses[240:250])
+        self.assertEqual(migrated.access_results, results)
+        answer = PatternAnswer.objects.get(question_id=question.question_id)
+        self.assertFalse(answer.all_answered())
+        answer.set_results_between(answer, 0, results[:PATTERN_WINDOW_SIZE])
+        self.assertTrue(answer.all_answered())
+        self.assertEqual(answer.score, answer.max_score)
+
+class CacheGivensTest(TestCase):
+    def test_shipped_table_is_current(self):
+        with open(CACHE_GIVENS_FILE) as fh:
+            data = json.load(fh)
+        self.assertEqual(data['fingerprint'], cache_givens_fingerprint(),
+            'run manage.py update_cache_givens after changing the cache parameter equations')
+        self.assertEqual(data['given_sets'], _get_cache_givens_to_ask())
+
+    def test_recomputes_when_out_of_date(self):
+        import quiz.models
+        from unittest import mock
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as fh:
+            json.dump({'fingerprint': 'stale', 'given_sets': [['num_ways']]}, fh)
+            fh.flush()
+            with mock.patch.object(quiz.models, 'CACHE_GIVENS_FILE', fh.name), \
+                    mock.patch.object(quiz.models, '_cache_given_sets', None):
+                self.assertEqual(get_cache_given_sets(), _get_cache_givens_to_ask())
+
 class PatternSubmitTest(TestCase):
     def test_evaluate_simple(self):
         pattern = CachePattern()
@@ -124,7 +1028,7 @@ class PatternSubmitTest(TestCase):
         question = PatternQuestion()
         question.index = 0
         question.pattern = pattern
-        question.for_user = 'test'
+        question.user = get_user('test')
         question.give_first = 1
         question.save()
         c = Client()
@@ -180,14 +1084,170 @@ class PatternSubmitTest(TestCase):
         })
         logger.debug('POST response was %s', response)
         self.assertTrue(response.status_code >= 300 and response.status_code < 400)
-        last_answer = PatternAnswer.last_for_question_and_user(question, 'test')
+        last_answer = PatternAnswer.last_for_question_and_user(question, get_user('test'))
         self.assertTrue(last_answer.was_complete)
         self.assertFalse(last_answer.was_save)
         self.assertEqual(last_answer.score, 6 * 5)
         self.assertEqual(last_answer.max_score, 6 * 5)
-        best_complete = PatternAnswer.best_complete_for_user('test')
+        best_complete = PatternAnswer.best_complete_for_user(get_user('test'))
         self.assertEqual(best_complete, last_answer)
 
+class PatternWindowTest(TestCase):
+    def _window_post(self, pattern, start, end, **extra):
+        post = {'window_start': str(start)}
+        for i in range(start, end):
+            expected = pattern.access_results[i]
+            if expected.hit.value:
+                post['access_hit_{}'.format(i)] = 'hit'
+            elif expected.evicted.value == None:
+                post['access_hit_{}'.format(i)] = 'miss-noevict'
+            else:
+                post['access_hit_{}'.format(i)] = 'miss-evict'
+                post['access_evicted_{}'.format(i)] = expected.evicted.string
+            for which in ['tag', 'index', 'offset']:
+                post['access_{}_{}'.format(which, i)] = getattr(expected, which).string
+        post.update(extra)
+        return post
+
+    def test_save_and_submit_by_window(self):
+        from .views import PATTERN_WINDOW_SIZE
+        pattern = CachePattern()
+        pattern.parameters = CacheParameters.get(num_ways=2,num_sets=4,block_size=16,address_bits=16)
+        pattern.accesses = [CacheAccess((i * 0x130) % 0x1000) for i in range(PATTERN_WINDOW_SIZE * 2 + 50)]
+        pattern.save()
+        question = PatternQuestion()
+        question.index = 0
+        question.pattern = pattern
+        question.user = get_user('test')
+        question.give_first = 1
+        question.save()
+        c = Client()
+        login_as(c, 'test')
+        url = '/pattern-question/{}'.format(question.question_id)
+        submit_url = '/submit-pattern-answer/{}'.format(question.question_id)
+        page = c.get(url + '?start=150')
+        self.assertEqual(page.context['window_start'], PATTERN_WINDOW_SIZE)
+        rows = page.context['accesses_with_default_and_correct_and_given']
+        self.assertEqual(len(rows), PATTERN_WINDOW_SIZE)
+        self.assertEqual(rows[0][0], pattern.accesses[PATTERN_WINDOW_SIZE])
+        self.assertNotIn('access_tag_0"', page.content.decode())
+
+        response = c.post(submit_url, self._window_post(pattern, PATTERN_WINDOW_SIZE, 2 * PATTERN_WINDOW_SIZE, go_to='0'))
+        self.assertRedirects(response, url + '?start=0')
+        saved = PatternAnswer.last_for_question_and_user(question, get_user('test'))
+        self.assertTrue(saved.was_save)
+        self.assertEqual(saved.access_results[PATTERN_WINDOW_SIZE]['tag']['string'],
+                         pattern.access_results[PATTERN_WINDOW_SIZE].tag.string)
+        self.assertEqual(saved.access_results[5]['tag']['string'], '')
+
+        c.post(submit_url, self._window_post(pattern, 0, PATTERN_WINDOW_SIZE, go_to=str(2 * PATTERN_WINDOW_SIZE)))
+        page = c.get(url + '?start={}'.format(2 * PATTERN_WINDOW_SIZE))
+        self.assertEqual(len(page.context['accesses_with_default_and_correct_and_given']), 50)
+        self.assertEqual(page.context['next_window_start'], None)
+        c.post(submit_url, self._window_post(pattern, 2 * PATTERN_WINDOW_SIZE, len(pattern.accesses)))
+        answer = PatternAnswer.last_for_question_and_user(question, get_user('test'))
+        self.assertTrue(answer.was_complete)
+        self.assertEqual(answer.score, answer.max_score)
+        self.assertEqual(answer.max_score, (len(pattern.accesses) - 1) * 5)
+
+    def test_page_only_parses_its_window(self):
+        import quiz.models
+        from unittest import mock
+        pattern = CachePattern()
+        pattern.parameters = CacheParameters.get(num_ways=2,num_sets=4,block_size=16,address_bits=16)
+        pattern.accesses = [CacheAccess((i * 0x130) % 0x1000) for i in range(PATTERN_WINDOW_SIZE * 5)]
+        pattern.save()
+        question = PatternQuestion(index=0, pattern=pattern, user=get_user('test'), give_first=1)
+        question.save()
+        c = Client()
+        login_as(c, 'test')
+        c.post('/submit-pattern-answer/{}'.format(question.question_id),
+               self._window_post(pattern, PATTERN_WINDOW_SIZE, 2 * PATTERN_WINDOW_SIZE, is_save='1'))
+        parsed = []
+        def _unpack(raw):
+            parsed.append(len(unpack_accesses(raw)))
+            return unpack_accesses(raw)
+        with mock.patch.object(quiz.models, 'unpack_accesses', _unpack), \
+             mock.patch.object(json, 'loads', wraps=json.loads) as loads:
+            page = c.get('/pattern-question/{}?start={}'.format(question.question_id, 3 * PATTERN_WINDOW_SIZE))
+            c.post('/submit-pattern-answer/{}'.format(question.question_id),
+                   self._window_post(pattern, 2 * PATTERN_WINDOW_SIZE, 3 * PATTERN_WINDOW_SIZE, is_save='1'))
+        self.assertEqual(len(page.context['accesses_with_default_and_correct_and_given']), PATTERN_WINDOW_SIZE)
+        self.assertEqual(max(parsed), PATTERN_WINDOW_SIZE)
+        self.assertLess(max(len(call[0][0]) for call in loads.call_args_list), len(pattern.expected_results_raw) / 4)
+        answer = PatternAnswer.last_for_question_and_user(question, get_user('test'))
+        self.assertEqual(answer.access_results[2 * PATTERN_WINDOW_SIZE + 5]['tag']['string'],
+                         pattern.access_results[2 * PATTERN_WINDOW_SIZE + 5].tag.string)
+        self.assertEqual(answer.access_results[PATTERN_WINDOW_SIZE + 5]['tag']['string'],
+                         pattern.access_results[PATTERN_WINDOW_SIZE + 5].tag.string)
+        self.assertEqual(answer.score, 2 * PATTERN_WINDOW_SIZE * 5)
+
+    def test_submit_with_unanswered_window_is_incomplete(self):
+        from .views import PATTERN_WINDOW_SIZE
+        pattern = CachePattern()
+        pattern.parameters = CacheParameters.get(num_ways=2,num_sets=4,block_size=16,address_bits=16)
+        pattern.accesses = [CacheAccess((i * 0x130) % 0x1000) for i in range(PATTERN_WINDOW_SIZE + 10)]
+        pattern.save()
+        question = PatternQuestion()
+        question.index = 0
+        question.pattern = pattern
+        question.user = get_user('test')
+        question.save()
+        c = Client()
+        login_as(c, 'test')
+        c.post('/submit-pattern-answer/{}'.format(question.question_id), self._window_post(pattern, 0, PATTERN_WINDOW_SIZE))
+        answer = PatternAnswer.last_for_question_and_user(question, get_user('test'))
+        self.assertFalse(answer.was_complete)
+        self.assertFalse(answer.was_save)
+
+
+class PatternApiTest(TestCase):
+    def setUp(self):
+        self.question = PatternQuestion.random(random_parameters_for_pattern(), get_user('test'))
+        self.client = Client()
+        login_as(self.client, 'test')
+
+    def test_question_columns(self):
+        response = self.client.get('/api/pattern-question/{}'.format(self.question.question_id))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        accesses = self.question.pattern.accesses
+        self.assertEqual(data['accesses']['address'], [access.address for access in accesses])
+        self.assertEqual(len(data['givens']['tag']), self.question.give_first)
+        self.assertEqual(data['givens']['hit'][0], self.question.pattern.access_results[0].hit.value)
+        again = self.client.get('/api/pattern-question/{}'.format(self.question.question_id),
+                                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_answer_is_revalidated(self):
+        url = '/api/pattern-answer/{}'.format(self.question.question_id)
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'answer': None})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        i = self.question.give_first
+        self.client.post('/submit-pattern-answer/{}'.format(self.question.question_id),
+                         {'is_save': '1', 'access_hit_{}'.format(i): 'hit', 'access_tag_{}'.format(i): '1f'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        answer = response.json()['answer']
+        self.assertTrue(answer['was_save'])
+        self.assertEqual(answer['tag'][i], '1f')
+        self.assertEqual(answer['hit'][i], True)
+        self.assertNotIn('correct', answer)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # saved again within the same second
+        self.client.post('/submit-pattern-answer/{}'.format(self.question.question_id),
+                         {'is_save': '1', 'access_tag_{}'.format(i): '2f'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['answer']['tag'][i], '2f')
+
+    def test_other_users_question(self):
+        c = Client()
+        login_as(c, 'other')
+        self.assertEqual(c.get('/api/pattern-question/{}'.format(self.question.question_id)).status_code, 403)
+        self.assertEqual(c.get('/api/pattern-answer/{}'.format(self.question.question_id)).status_code, 403)
 
 
 class ParameterSubmitTest(TestCase):
@@ -203,7 +1263,7 @@ class ParameterSubmitTest(TestCase):
         question.index = 0
         question.missing_parts = ['tag_bits', 'offset_bits', 'cache_size_bytes', 'num_sets', 'set_size_bytes', 'way_size_bytes']
         question.given_parts = ['num_ways', 'index_bits', 'block_size', 'address_bits']
-        question.for_user = 'test'
+        question.user = get_user('test')
         question.save()
         
         c = Client()
@@ -234,7 +1294,7 @@ class ParameterSubmitTest(TestCase):
         })
         logger.debug('POST response was %s', response)
         self.assertTrue(response.status_code >= 300 and response.status_code < 400)
-        last_answer = ParameterAnswer.last_for_question_and_user(question, 'test')
+        last_answer = ParameterAnswer.last_for_question_and_user(question, get_user('test'))
         logger.debug('last_answer answers %s', last_answer.answer)
         self.assertTrue(last_answer.was_complete)
         self.assertFalse(last_answer.was_save)
@@ -8,6 +8,8 @@ urlpatterns = [
     path('pattern-question/<question_id>', views.pattern_question_detail, name='pattern-question'),
     path('submit-pattern-answer/<question_id>', views.pattern_answer, name='pattern-answer'),
     path('new-pattern-question', views.new_pattern_question, name='new-pattern-question'),
+    path('api/pattern-question/<question_id>', views.api_pattern_question, name='api-pattern-question'),
+    path('api/pattern-answer/<question_id>', views.api_pattern_answer, name='api-pattern-answer'),
 
     path('parameter-question', views.last_parameter_question, name='last-parameter-question'),
     path('parameter-question/<question_id>', views.parameter_question_detail, name='parameter-question'),
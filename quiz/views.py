@@ -8,130 +8,129 @@ from django import template
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
-from django.views.decorators.http import require_http_methods
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition, require_http_methods
 from django.contrib.auth.decorators import permission_required, login_required
 
-from .models import PatternAnswer, PatternQuestion, CacheAccessResult, CachePattern, CacheParameters, ParameterQuestion, ParameterAnswer, ResultItem, all_cache_question_parameters, random_parameters_for_pattern
+from .models import BACKFILLED_PASSWORD, PATTERN_WINDOW_SIZE, PatternAnswer, PatternQuestion, CacheAccessResult, CachePattern, CacheParameters, ParameterQuestion, ParameterAnswer, QuestionPoolEntry, ResultItem, UserHistory, UserProgress, all_cache_question_parameters
+from .term import clear_term
 
 logger = logging.getLogger('cachelabweb')
 
-NEEDED_PARAMETER_PERFECT = 3
+NEEDED_PARAMETER_PERFECT = UserProgress.NEEDED_PARAMETER_PERFECT
+
+def user_progress(request):
+    if not hasattr(request, 'quiz_progress'):
+        request.quiz_progress = UserProgress.for_user(request.user.id)
+    return request.quiz_progress
 
 def pattern_perfect(request):
-    user = request.user.get_username()
-    best_pattern_answer = PatternAnswer.best_complete_for_user(request.user.get_username())
-    if best_pattern_answer != None:
-        return best_pattern_answer.score == best_pattern_answer.max_score
-    else:
-        return False
+    return user_progress(request).pattern_perfect
 
 def parameter_perfect(request):
-    user = request.user.get_username()
-    parameter_perfect_count = 0
-    best_parameter_answers = ParameterAnswer.best_K_for_user(user, NEEDED_PARAMETER_PERFECT)
-    for answer in best_parameter_answers:
-        if answer.score == answer.max_score:
-            parameter_perfect_count += 1
-    return parameter_perfect_count >= NEEDED_PARAMETER_PERFECT
+    return user_progress(request).parameter_perfect
 
 @login_required
 def index_page(request):
-    user = request.user.get_username()
-    last_parameter_question = ParameterQuestion.last_for_user(user)
-    last_parameter_answer = ParameterAnswer.last_for_question_and_user(last_parameter_question, user)
-    if last_parameter_answer != None:
-        last_parameter_in_progress = not last_parameter_answer.was_complete
-    else:
-        last_parameter_in_progress = False
-    num_parameter_answer = ParameterAnswer.num_complete_for_user(user)
-    best_parameter_answers = ParameterAnswer.best_K_for_user(user, NEEDED_PARAMETER_PERFECT)
-    parameter_perfect_count = 0
-    for answer in best_parameter_answers:
-        if answer.score == answer.max_score:
-            parameter_perfect_count += 1
-    last_pattern_question = PatternQuestion.last_for_user(user)
-    last_pattern_answer = PatternAnswer.last_for_question_and_user(last_pattern_question, user)
-    if last_pattern_answer != None and last_pattern_answer.question == last_pattern_question:
-        last_pattern_in_progress = not last_pattern_answer.was_complete
-    elif last_pattern_question != None:
-        last_pattern_in_progress = True
-    else:
-        last_pattern_in_progress = False
-    num_pattern_answer = PatternAnswer.num_complete_for_user(user)
-    if num_pattern_answer > 0:
-        best_pattern_answer = PatternAnswer.best_complete_for_user(user)
-        pattern_score = best_pattern_answer.score
-        pattern_max_score = best_pattern_answer.max_score
-    else:
-        pattern_score = None
-        pattern_max_score = None
+    progress = user_progress(request)
     context = {
         'user': request.user.get_username(),
-        'parameter_in_progress': last_parameter_in_progress,
-        'parameter_complete': num_parameter_answer,
-        'parameter_perfect_count':  parameter_perfect_count,
-        'parameter_perfect': parameter_perfect_count >= NEEDED_PARAMETER_PERFECT,
+        'parameter_in_progress': progress.last_parameter_in_progress,
+        'parameter_complete': progress.parameter_complete,
+        'parameter_perfect_count':  progress.parameter_perfect_count,
+        'parameter_perfect': progress.parameter_perfect,
 
-        'pattern_complete': num_pattern_answer,
-        'pattern_in_progress': last_pattern_in_progress,
-        'pattern_score': pattern_score,
-        'pattern_max_score': pattern_max_score,
-        'pattern_perfect': pattern_score != None and pattern_score == pattern_max_score,
+        'pattern_complete': progress.pattern_complete,
+        'pattern_in_progress': progress.last_pattern_in_progress,
+        'pattern_score': progress.best_pattern_score,
+        'pattern_max_score': progress.best_pattern_max_score,
+        'pattern_perfect': progress.pattern_perfect,
 
         'staff': request.session.get('is_staff', False),
         'course_website': settings.COURSE_WEBSITE
     }
-    for i, answer in enumerate(best_parameter_answers):
-        context['parameter_score{}'.format(i+1)] = answer.score
-        context['parameter_score{}_max'.format(i+1)] = answer.max_score
+    for i, (score, max_score) in enumerate(progress.best_parameter_scores):
+        context['parameter_score{}'.format(i+1)] = score
+        context['parameter_score{}_max'.format(i+1)] = max_score
     return HttpResponse(render(request, 'quiz/user_index.html', context))
 
 
 @login_required
 def last_pattern_question(request):
-    question = PatternQuestion.last_for_user(request.user.get_username())
+    question = PatternQuestion.last_for_user(request.user)
     if not question:
-        PatternQuestion.random(
-            parameters=random_parameters_for_pattern(), for_user=request.user.get_username()
-        )
-        question = PatternQuestion.last_for_user(request.user.get_username())
+        question = PatternQuestion.generate_new(request.user)
     return pattern_question_detail(request, question.question_id)
 
 @login_required
 @require_http_methods(["POST"])
 def new_pattern_question(request):
-    parameters = random_parameters_for_pattern()
-    PatternQuestion.random(parameters=parameters, for_user=request.user.get_username())
+    PatternQuestion.generate_new(request.user)
     return redirect('last-pattern-question')
 
 # FIXME: @permission_required('quiz.delete_patternquestion')
 def test_control(request):
     return HttpResponse(render(request, 'quiz/test_control.html', {}))
 
-def pattern_question_detail(request, question_id):
-    question = PatternQuestion.objects.get(question_id=question_id)
-    if question.for_user != request.user.get_username():
-        raise PermissionDenied()
-    answer = PatternAnswer.last_for_question_and_user(question, request.user.get_username())
-    empty_access = CacheAccessResult.empty()
-    is_given = itertools.chain([True] * question.give_first, itertools.cycle([False]))
+def _answer_version(answer):
+    """
+    Identifies the answer shown on a question page, for caching the rendered rows; answers are
+    never modified, only replaced by newer ones.
+    """
     if answer:
-        accesses_with_default = zip(question.pattern.accesses, answer.access_results, question.pattern.access_results, is_given)
+        return '{}-{}'.format(answer.pk, answer.submit_time.timestamp())
     else:
-        old_answers = [empty_access] * len(question.pattern.accesses)
-        for i in range(question.give_first):
-            old_answers[i] = question.pattern.access_results[i]
-        accesses_with_default = zip(question.pattern.accesses, old_answers, question.pattern.access_results, is_given)
-    accesses_with_default = list(accesses_with_default)
+        return 'none'
+
+def _pattern_window(num_accesses, start):
+    """
+    Returns (start, end) of the accesses shown on one page of a pattern question.
+    """
+    if num_accesses <= PATTERN_WINDOW_SIZE:
+        return (0, num_accesses)
+    try:
+        start = int(start)
+    except (TypeError, ValueError):
+        start = 0
+    start = max(0, min(start, num_accesses - 1))
+    start -= start % PATTERN_WINDOW_SIZE
+    return (start, min(start + PATTERN_WINDOW_SIZE, num_accesses))
+
+def pattern_question_detail(request, question_id):
+    # the window's accesses are read from the stored expected results
+    question = PatternQuestion.objects.select_related('pattern__parameters').defer(
+        'pattern__accesses_raw', 'pattern__final_state_snapshot').get(question_id=question_id)
+    if question.user_id != request.user.id or UserHistory.is_hidden(question):
+        raise PermissionDenied()
+    answer = PatternAnswer.last_for_question_and_user(question, request.user)
+    num_accesses = question.pattern.num_accesses
+    (window_start, window_end) = _pattern_window(num_accesses, request.GET.get('start'))
+    # only evaluated by the template when the rows are not cached
+    def accesses_with_default():
+        accesses = question.pattern.accesses_between(window_start, window_end)
+        expected_results = question.pattern.access_results_between(window_start, window_end)
+        is_given = [i < question.give_first for i in range(window_start, window_end)]
+        if answer:
+            old_answers = answer.access_results_between(window_start, window_end)
+        else:
+            empty_access = CacheAccessResult.empty()
+            old_answers = [expected if given else empty_access for expected, given in zip(expected_results, is_given)]
+        return list(zip(accesses, old_answers, expected_results, is_given))
     widths = int((max(question.tag_bits, question.offset_bits, question.index_bits) + 3) / 4) + 3
     address_width = int((question.address_bits + 3) / 4) + 3
     context = {
         'question': question,
         'answer': answer,
-        'accesses_with_default_and_correct_and_given': accesses_with_default,
+        'accesses_with_default_and_correct_and_given': SimpleLazyObject(accesses_with_default),
+        'answer_version': _answer_version(answer),
+        'num_accesses': num_accesses,
+        'window_start': window_start,
+        'window_end': window_end,
+        'previous_window_start': window_start - PATTERN_WINDOW_SIZE if window_start > 0 else None,
+        'next_window_start': window_end if window_end < num_accesses else None,
         'show_correct': True if answer and answer.was_complete else False,
         'show_invalid': True if answer and not answer.was_complete and not answer.was_save else False,
         'tag_width': widths,
@@ -142,6 +141,7 @@ def pattern_question_detail(request, question_id):
         'give_first': question.give_first,
         'staff': request.session.get('is_staff', False),
         'debug_enable': request.session.get('is_staff', False) and request.GET.get('debug', 'false') == 'true',
+        'debug_results': SimpleLazyObject(lambda: question.pattern.access_results_between(window_start, window_end)),
         'user': request.user.get_username(),
         'pattern_perfect': pattern_perfect(request),
         'parameter_perfect': parameter_perfect(request),
@@ -159,23 +159,26 @@ def value_from_hex(x):
         return None
 
 def pattern_answer(request, question_id):
-    question = get_object_or_404(PatternQuestion, question_id=question_id)
-    if question.for_user != request.user.get_username():
+    question = get_object_or_404(PatternQuestion.objects.select_related('pattern__parameters').defer(
+        'pattern__accesses_raw', 'pattern__final_state_snapshot'), question_id=question_id)
+    if question.user_id != request.user.id or UserHistory.is_hidden(question):
         raise PermissionDenied()
-    last_answer = PatternAnswer.last_for_question_and_user(question, request.user.get_username())
+    last_answer = PatternAnswer.last_for_question_and_user(question, request.user)
     if last_answer and last_answer.was_complete:  # FIXME: threshold?
         return HttpResponse("You already submitted an answer to this question.")
     answer = PatternAnswer()
     answer.question = question
-    submitted_results = []
-    is_complete = True
     parts = ['tag', 'index', 'offset']
     if question.ask_evict:
         parts.append('evicted')
     logger.debug('POST request is %s', request.POST)
-    for i in range(question.give_first):
-        submitted_results.append(question.pattern.access_results[i])
-    for i in range(question.give_first, len(question.pattern.access_results)):
+    num_accesses = question.pattern.num_accesses
+    if 'window_start' in request.POST:
+        (window_start, window_end) = _pattern_window(num_accesses, request.POST['window_start'])
+    else:
+        (window_start, window_end) = (0, num_accesses)
+    submitted_results = question.pattern.access_results_between(window_start, min(question.give_first, window_end))
+    for i in range(max(question.give_first, window_start), window_end):
         cur_access = CacheAccessResult()
         hit_key = 'access_hit_{}'.format(i)
         if hit_key in request.POST:
@@ -195,31 +198,124 @@ def pattern_answer(request, question_id):
                 value = request.POST[key].strip()
             else:
                 value = ''
-            value_invalid = cur_access.set_from_string(which, value)
-            is_complete = is_complete and value_invalid
+            cur_access.set_from_string(which, value)
         if hit_value != 'miss-evict':
             cur_access.set_from_string('evicted', '')
             cur_access.evicted.invalid = False
         else:
             value = request.POST.get('access_evicted_{}'.format(i), '')
-            value_invalid = cur_access.set_from_string('evicted', value)
-            is_complete = is_complete and value_invalid
+            cur_access.set_from_string('evicted', value)
         logger.debug('adding access %s', cur_access)
         submitted_results.append(cur_access)
-    answer.access_results = submitted_results
-    answer.for_user = request.user.get_username()
-    answer.was_complete = is_complete
-    if request.POST.get('is_save'):
+    # answers outside the window come from the last saved answer
+    answer.set_results_between(last_answer, window_start, submitted_results)
+    answer.user = request.user
+    answer.was_complete = answer.all_answered()
+    go_to = request.POST.get('go_to')
+    if request.POST.get('is_save') or go_to != None:
         answer.was_save = True
         answer.was_complete = False
     answer.save()
-    if answer.was_save:
+    if go_to != None:
+        (go_to_start, _) = _pattern_window(num_accesses, go_to)
+        return redirect('{}?start={}'.format(reverse('pattern-question', args=[question.question_id]), go_to_start))
+    elif answer.was_save:
         return redirect('user-index')
-    elif PatternQuestion.last_for_user(request.user.get_username()) == question:
+    elif PatternQuestion.last_for_user(request.user) == question:
         return redirect('last-pattern-question')
     else:
         return redirect('pattern-question', question.question_id)
 
+# bump when the JSON returned by the api_ views changes, so clients do not reuse old copies
+API_FORMAT = 1
+
+def _json_response(data):
+    response = JsonResponse(data, json_dumps_params={'separators': (',', ':')})
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _api_question(request, question_id):
+    if not hasattr(request, 'quiz_question'):
+        question = get_object_or_404(PatternQuestion.objects.select_related('pattern__parameters'), question_id=question_id)
+        if question.user_id != request.user.id or UserHistory.is_hidden(question):
+            raise PermissionDenied()
+        request.quiz_question = question
+    return request.quiz_question
+
+def _api_answer(request, question_id):
+    if not hasattr(request, 'quiz_answer'):
+        request.quiz_answer = PatternAnswer.last_for_question_and_user(_api_question(request, question_id), request.user)
+    return request.quiz_answer
+
+def _api_question_etag(request, question_id):
+    # questions are never modified
+    return 'pattern-question-{}-{}'.format(_api_question(request, question_id).question_id, API_FORMAT)
+
+def _api_answer_etag(request, question_id):
+    return 'pattern-answer-{}-{}'.format(_answer_version(_api_answer(request, question_id)), API_FORMAT)
+
+def _columns(results, parts, key):
+    return {part: [result[part][key] for result in results] for part in parts}
+
+@login_required
+@require_http_methods(['GET', 'HEAD'])
+@condition(etag_func=_api_question_etag)
+def api_pattern_question(request, question_id):
+    """
+    The accesses of a pattern question and the given answers, as columns:
+    {"accesses": {"address": [...], "size": [...]}, "givens": {"hit": [...], "tag": [...], ...}, ...}
+    """
+    question = _api_question(request, question_id)
+    parameters = question.pattern.parameters
+    accesses = question.pattern.accesses
+    givens = question.pattern.access_results_between(0, question.give_first)
+    return _json_response({
+        'question_id': str(question.question_id),
+        'parameters': {
+            'num_ways': parameters.num_ways,
+            'num_sets': parameters.num_sets,
+            'block_size': parameters.block_size,
+            'address_bits': question.pattern.address_bits,
+            'tag_bits': question.tag_bits,
+            'index_bits': question.index_bits,
+            'offset_bits': question.offset_bits,
+        },
+        'ask_evict': question.ask_evict,
+        'give_first': question.give_first,
+        'accesses': {
+            'address': [access.address for access in accesses],
+            'size': [access.size for access in accesses],
+        },
+        'givens': _columns([given.as_dump() for given in givens], ['hit', 'tag', 'index', 'offset', 'evicted'], 'value'),
+    })
+
+@login_required
+@require_http_methods(['GET', 'HEAD'])
+# no Last-Modified: it only has one-second resolution, and answers can be saved more often than that
+@condition(etag_func=_api_answer_etag)
+def api_pattern_answer(request, question_id):
+    """
+    The last saved or submitted answer to a pattern question ({"answer": null} if there is none), with
+    the answer to each part of each access as typed in columns. Graded answers also have a "correct" column
+    for each part.
+    """
+    answer = _api_answer(request, question_id)
+    if answer == None:
+        return _json_response({'answer': None})
+    results = answer.access_results
+    data = {
+        'submit_time': answer.submit_time.isoformat(),
+        'was_save': answer.was_save,
+        'was_complete': answer.was_complete,
+        'hit': [result['hit']['value'] for result in results],
+    }
+    data.update(_columns(results, ['tag', 'index', 'offset', 'evicted'], 'string'))
+    if answer.was_complete:
+        data['score'] = answer.score
+        data['max_score'] = answer.max_score
+        data['correct'] = _columns(results, ['hit', 'tag', 'index', 'offset', 'evicted'], 'correct')
+    return _json_response({'answer': data})
+
 def _name_parameter(parameter):
     if parameter.startswith('num_'):
         return 'number of ' + parameter[len('num_'):]
@@ -248,12 +344,10 @@ def format_value_with_postfix(value):
 
 @login_required
 def parameter_question_detail(request, question_id):
-    question = get_object_or_404(ParameterQuestion, question_id=question_id)
-    user = request.user.get_username()
-    if question.for_user != user:
+    question = get_object_or_404(ParameterQuestion.objects.select_related('parameters'), question_id=question_id)
+    if question.user_id != request.user.id or UserHistory.is_hidden(question):
         raise PermissionDenied()
-    last_answer = ParameterAnswer.last_for_question_and_user(question, request.user.get_username())
-    params = []
+    last_answer = ParameterAnswer.last_for_question_and_user(question, request.user)
     if last_answer:
         mark_invalid = not last_answer.was_complete and not last_answer.was_save
         show_correct = last_answer.was_complete
@@ -261,40 +355,41 @@ def parameter_question_detail(request, question_id):
     else:
         mark_invalid = False
         show_correct = False
-    for item in all_cache_question_parameters:
-        if item in question.given_parts:
-            value = ResultItem(
-                value=question.find_cache_property(item),
-                string=format_value_with_postfix(question.find_cache_property(item)),
-                correct=True,
-                invalid=False,
-            )
-            given_p = True
-        elif item in question.missing_parts:
-            given_p = False
-            if last_answer:
-                value = last_answer.answer.get(item)
+    # only evaluated by the template when the rows are not cached
+    def params():
+        result = []
+        for item in all_cache_question_parameters:
+            if item in question.given_parts:
+                value = ResultItem(
+                    value=question.find_cache_property(item),
+                    string=format_value_with_postfix(question.find_cache_property(item)),
+                    correct=True,
+                    invalid=False,
+                )
+                given_p = True
+            elif item in question.missing_parts:
+                given_p = False
+                if last_answer:
+                    value = last_answer.answer.get(item)
+                else:
+                    value = ResultItem.empty_invalid()
             else:
-                value = ResultItem.empty_invalid()
-        else:
-            continue
-        current = {
-            'id': item,
-            'name': _name_parameter(item),
-            'value': value,
-            'given': given_p,
-            'correct_value': format_value_with_postfix(question.find_cache_property(item)),
-        }
-        params.append(current)
-    best_parameter_answers = ParameterAnswer.best_K_for_user(user, 3)
-    parameter_perfect_count = 0
-    for answer in best_parameter_answers:
-        if answer.score == answer.max_score:
-            parameter_perfect_count += 1
+                continue
+            current = {
+                'id': item,
+                'name': _name_parameter(item),
+                'value': value,
+                'given': given_p,
+                'correct_value': format_value_with_postfix(question.find_cache_property(item)),
+            }
+            result.append(current)
+        return result
+    parameter_perfect_count = user_progress(request).parameter_perfect_count
     context = {
         'show_correct': show_correct,
         'mark_invalid': mark_invalid,
-        'params': params,
+        'params': SimpleLazyObject(params),
+        'answer_version': _answer_version(last_answer),
         'question': question,
         'answer': last_answer,
 
@@ -311,11 +406,11 @@ def parameter_question_detail(request, question_id):
 @require_http_methods(["POST"])
 def parameter_answer(request, question_id):
     question = get_object_or_404(ParameterQuestion, question_id=question_id)
-    if question.for_user != request.user.get_username():
+    if question.user_id != request.user.id or UserHistory.is_hidden(question):
         raise PermissionDenied()
     answer = ParameterAnswer()
     answer.question = question
-    answer.for_user = request.user.get_username()
+    answer.user = request.user
     answer.set_answer_from_post(request.POST)
     if request.POST.get('is_save', '') != '':
         answer.was_complete = False
@@ -333,27 +428,23 @@ def parameter_answer(request, question_id):
 @login_required
 @require_http_methods(["POST"])
 def new_parameter_question(request):
-    question = ParameterQuestion.generate_new(request.user.get_username())
+    question = ParameterQuestion.generate_new(request.user)
     return redirect('last-parameter-question')
 
 @login_required
 def last_parameter_question(request):
-    question = ParameterQuestion.last_for_user(request.user.get_username())
+    question = ParameterQuestion.last_for_user(request.user)
     if not question:
-        question = ParameterQuestion.generate_new(request.user.get_username())
+        question = ParameterQuestion.generate_new(request.user)
     return parameter_question_detail(request, question.question_id)
 
 # FIXME: make admin only
 @require_http_methods(["POST"])
 #@permission_required('quiz.delete_patternquestion')
 def clear_all_questions(request):
-    if PatternQuestion.objects.filter(~Q(for_user__exact='guest') & ~Q(for_user__exact='test')).count() == 0:
-        PatternAnswer.objects.all().delete()
-        PatternQuestion.objects.all().delete()
-        ParameterAnswer.objects.all().delete()
-        ParameterQuestion.objects.all().delete()
-        CachePattern.objects.all().delete()
-        CacheParameters.objects.all().delete()
+    if PatternQuestion.objects.exclude(user__username__in=['guest', 'test']).count() == 0:
+        # CacheParameters rows are kept: they are shared and cached by every worker process
+        clear_term()
         return HttpResponse("Cleared all questions.")
     else:
         return HttpResponse("Refusing to clear all questions.")
@@ -364,12 +455,7 @@ def forget_questions(request):
     if request.session.get('is_staff', False) == False:
         return HttpResponse('This feature is for staff only.')
     else:
-        user = request.user.get_username()
-        hidden_user = user + '+hidden'
-        PatternAnswer.objects.filter(for_user__exact=user).update(for_user=hidden_user)
-        PatternQuestion.objects.filter(for_user__exact=user).update(for_user=hidden_user)
-        ParameterAnswer.objects.filter(for_user__exact=user).update(for_user=hidden_user)
-        ParameterQuestion.objects.filter(for_user__exact=user).update(for_user=hidden_user)
+        UserHistory.forget(request.user.id)
         return HttpResponse('questions forgotten')
 
 @login_required
@@ -378,43 +464,59 @@ def unforget_questions(request):
     if request.session.get('is_staff', False) == False:
         return HttpResponse('This feature is for staff only.')
     else:
-        user = request.user.get_username()
-        hidden_user = user + '+hidden'
-        PatternAnswer.objects.filter(for_user__exact=hidden_user).update(for_user=user)
-        PatternQuestion.objects.filter(for_user__exact=hidden_user).update(for_user=user)
-        ParameterAnswer.objects.filter(for_user__exact=hidden_user).update(for_user=user)
-        ParameterQuestion.objects.filter(for_user__exact=hidden_user).update(for_user=user)
+        UserHistory.unforget(request.user.id)
         return HttpResponse('questions unforgotten')
 
+def _lab_score(parameter_scores, pattern_score):
+    total_param_score = 0.0
+    for score, max_score in parameter_scores:
+        total_param_score += float(score) / float(max_score)
+    total_pattern_score = 0.0
+    if pattern_score != None:
+        total_pattern_score += float(pattern_score[0]) / float(pattern_score[1])
+    score = (
+                total_param_score / NEEDED_PARAMETER_PERFECT +
+                total_pattern_score
+            ) / 2.0 * 10.0
+    if total_param_score > 2:
+        score = max(5.0, score)
+    return score
+
+class _Echo():
+    def write(self, value):
+        return value
+
+def _score_rows(due_strings, due_datetimes):
+    if len(due_datetimes) == 1:
+        yield ['compid', 'parameter scores', 'pattern score', 'lab score [10]']
+    else:
+        header = ['compid']
+        for due in due_strings:
+            header += ['parameter scores ({})'.format(due), 'pattern score ({})'.format(due), 'lab score [10] ({})'.format(due)]
+        yield header
+    parameter_scores = ParameterAnswer.best_K_for_all_users_by_times(NEEDED_PARAMETER_PERFECT, due_datetimes)
+    pattern_scores = PatternAnswer.best_complete_for_all_users_by_times(due_datetimes)
+    no_parameter_scores = [[] for _ in due_datetimes]
+    no_pattern_scores = [None for _ in due_datetimes]
+    for user_id, username in User.objects.exclude(password=BACKFILLED_PASSWORD).order_by('username').values_list('id', 'username').iterator():
+        row = [username]
+        for param_scores, pattern_score in zip(parameter_scores.get(user_id, no_parameter_scores), pattern_scores.get(user_id, no_pattern_scores)):
+            row.append(' and '.join('{}/{}'.format(score, max_score) for score, max_score in param_scores))
+            row.append('{}/{}'.format(*pattern_score) if pattern_score != None else '(none)')
+            row.append('{:.1f}'.format(_lab_score(param_scores, pattern_score)))
+        yield row
+
 @login_required
 def get_scores_csv(request):
     if request.session.get('is_staff', False) == False:
         return HttpResponse('This feature is for staff only.')
     else:
-        due_datetime = datetime.datetime.strptime(request.GET.get('due'), '%Y-%m-%dT%H:%M%z')
-        response = HttpResponse(content_type='text/csv')
-        writer = csv.writer(response)
-        writer.writerow(['compid', 'parameter scores', 'pattern score', 'lab score [10]'])
-        for user in map(lambda x: x.get_username(), User.objects.all()):
-            parameter_answers = ParameterAnswer.best_K_for_user_by_time(user, NEEDED_PARAMETER_PERFECT, due_datetime)
-            pattern_answer = PatternAnswer.best_complete_for_user_by_time(user, due_datetime)
-            param_complete = False
-            param_scores = []
-            total_param_score = 0.0
-            for answer in parameter_answers:
-                param_scores.append('{}/{}'.format(answer.score, answer.max_score))
-                total_param_score += float(answer.score) / float(answer.max_score)
-            pattern_score = '(none)'
-            total_pattern_score = 0.0
-            if pattern_answer != None:
-                pattern_score = '{}/{}'.format(pattern_answer.score, pattern_answer.max_score)
-                total_pattern_score += float(pattern_answer.score) / float(pattern_answer.max_score)
-            score = (
-                        total_param_score / NEEDED_PARAMETER_PERFECT +
-                        total_pattern_score
-                    ) / 2.0 * 10.0
-            if total_param_score > 2:
-                score = max(5.0, score)
-            score = '{:.1f}'.format(score)
-            writer.writerow([user, ' and '.join(param_scores), pattern_score, score])
-        return response
+        due_strings = request.GET.getlist('due')
+        due_datetimes = [datetime.datetime.strptime(due, '%Y-%m-%dT%H:%M%z') for due in due_strings]
+        if len(due_datetimes) == 0:
+            return HttpResponse('No due date given.', status=400)
+        writer = csv.writer(_Echo())
+        return StreamingHttpResponse(
+            (writer.writerow(row) for row in _score_rows(due_strings, due_datetimes)),
+            content_type='text/csv'
+        )